@@ -0,0 +1,157 @@
+'''
+Streaming batch analysis of many positions. FEN lines or PGN games are read lazily from files or stdin,
+sent in chunks to a process pool, and one JSON object per position is written as soon as its chunk is done,
+in input order. Only a bounded number of chunks is ever in flight so memory doesn't grow with the input size.
+
+Usage:
+    python ChessBatch.py positions.fen games.pgn --output results.jsonl --workers 8 --depth 3
+    zcat games.pgn.gz | python ChessBatch.py - --format pgn > results.jsonl
+Each result has id, fen, legalMoves and, unless --no-search is given, bestMove, san, score, depth and nodes.
+Positions that can't be read produce a result with an error field instead.
+'''
+import argparse
+import itertools
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import ChessEngine
+import ChessPGN
+import ChessSearch
+
+'''
+Yields {'id','fen'} records from one FEN file, one position per line, blank lines and # comments skipped
+'''
+def iterFenRecords(stream,name):
+    for lineNumber,line in enumerate(stream,1):
+        line = line.strip()
+        if line and not line.startswith('#'):
+            yield {'id':'%s:%d' % (name,lineNumber),'fen':line}
+
+'''
+Yields a record for every position of every game (before each move) in a PGN stream
+'''
+def iterPgnRecords(stream,name):
+    for gameNumber,(headers,sanMoves,result) in enumerate(ChessPGN.readGames(stream),1):
+        gameId = '%s:game%d' % (name,gameNumber)
+        try:
+            gs = ChessEngine.GameState.fromFen(headers['FEN']) if 'FEN' in headers else ChessEngine.GameState()
+        except ValueError as e:
+            yield {'id':gameId,'error':str(e)}
+            continue
+        for ply,san in enumerate(sanMoves):
+            yield {'id':'%s:ply%d' % (gameId,ply),'fen':gs.getFen()}
+            try:
+                gs.makeMove(ChessPGN.parseSan(gs,san))
+            except ValueError as e: #the position after the bad move can't be reached
+                yield {'id':'%s:ply%d' % (gameId,ply+1),'error':str(e)}
+                break
+        else:
+            yield {'id':'%s:ply%d' % (gameId,len(sanMoves)),'fen':gs.getFen()}
+
+'''
+Chain the records of every input, '-' is stdin. fmt is 'fen', 'pgn' or 'auto' (by file extension)
+'''
+def iterRecords(paths,fmt='auto'):
+    for path in paths:
+        kind = fmt
+        if kind == 'auto':
+            kind = 'pgn' if path.lower().endswith('.pgn') else 'fen'
+        reader = iterPgnRecords if kind == 'pgn' else iterFenRecords
+        if path == '-':
+            yield from reader(sys.stdin,'stdin')
+        else:
+            with open(path) as stream:
+                yield from reader(stream,os.path.basename(path))
+
+'''
+Analyse one record: legal move count and, when depth/nodes/timeLimit allow a search, the best move and its score
+'''
+def analyzeRecord(record,depth=2,nodes=None,timeLimit=None,search=True,ttSize=1 << 16):
+    if 'error' in record:
+        return record
+    result = {'id':record['id'],'fen':record['fen']}
+    try:
+        gs = ChessEngine.GameState.fromFen(record['fen'])
+    except ValueError as e:
+        result['error'] = str(e)
+        return result
+    moves = gs.getValidMoves()
+    result['legalMoves'] = len(moves)
+    result['inCheck'] = gs.inCheck
+    if search:
+        #fresh searcher, history, killers and caches carried over from other positions would change the answer
+        searched = ChessSearch.Searcher(ttSize).search(gs,depth,timeLimit,nodes)
+        best = searched.bestMove
+        result['bestMove'] = best.getChessNotation() if best else None
+        result['san'] = ChessPGN.toSan(gs,best,moves) if best else None
+        result['score'] = searched.score
+        result['depth'] = searched.depth
+        result['nodes'] = searched.nodes
+    return result
+
+def _analyzeChunk(records,settings):
+    return [analyzeRecord(record,**settings) for record in records]
+
+'''
+Analyse a stream of records and yield results in input order.
+At most maxPending chunks of chunkSize records are queued at once, so memory use is independent of the input size
+'''
+def analyzeStream(records,workers=None,chunkSize=64,maxPending=None,**settings):
+    workers = workers or os.cpu_count() or 1
+    records = iter(records)
+    chunks = iter(lambda: list(itertools.islice(records,chunkSize)),[])
+    if workers == 1:
+        for chunk in chunks:
+            yield from _analyzeChunk(chunk,settings)
+        return
+    maxPending = maxPending or workers*4
+    with ProcessPoolExecutor(workers) as pool:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(pool.submit(_analyzeChunk,chunk,settings))
+            if len(pending) >= maxPending:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Analyse FEN/PGN positions in bulk, writes JSON lines')
+    parser.add_argument('inputs',nargs='*',default=['-'],help="FEN or PGN files, '-' for stdin (default)")
+    parser.add_argument('--format',choices=('auto','fen','pgn'),default='auto')
+    parser.add_argument('--output','-o',default='-',help="results file, '-' for stdout (default)")
+    parser.add_argument('--workers',type=int,default=None,help='number of processes (default: number of cores)')
+    parser.add_argument('--depth',type=int,default=2)
+    parser.add_argument('--nodes',type=int,default=None,help='node limit per position')
+    parser.add_argument('--time',type=float,default=None,help='time limit per position in seconds')
+    parser.add_argument('--no-search',dest='search',action='store_false',help='only count legal moves')
+    parser.add_argument('--chunk',type=int,default=64,help='positions per task')
+    parser.add_argument('--progress',type=float,default=5.0,help='seconds between throughput reports on stderr, 0 for none')
+    args = parser.parse_args(argv)
+
+    out = sys.stdout if args.output == '-' else open(args.output,'w')
+    start = lastReport = time.perf_counter()
+    count = errors = 0
+    try:
+        results = analyzeStream(iterRecords(args.inputs,args.format),args.workers,args.chunk,
+                                depth=args.depth,nodes=args.nodes,timeLimit=args.time,search=args.search)
+        for result in results:
+            out.write(json.dumps(result) + '\n')
+            count += 1
+            errors += 'error' in result
+            now = time.perf_counter()
+            if args.progress and now - lastReport >= args.progress:
+                lastReport = now
+                print('%d positions  %.1f positions/s' % (count,count/(now-start)),file=sys.stderr)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    seconds = time.perf_counter() - start
+    print('done: %d positions (%d errors) in %.2fs, %.1f positions/s' % (count,errors,seconds,count/seconds if seconds else 0),
+          file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
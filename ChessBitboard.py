@@ -0,0 +1,132 @@
+'''
+Precomputed bitboard tables used by the bitboard backend of ChessEngine.GameState.
+A bitboard is a python int where bit n is set if square n is occupied/attacked.
+Squares are numbered row*8+col, the same layout as GameState.board, so square 0 is a8 and square 63 is h1.
+'''
+
+FULL = (1 << 64) - 1
+DIRECTIONS = ((-1,0),(0,-1),(1,0),(0,1),(-1,-1),(-1,1),(1,-1),(1,1)) #orthogonal directions first, then the diagonals
+SQUARES = [(r,c) for r in range(8) for c in range(8)] #square index -> (row,col)
+
+FILE_A = 0
+for r in range(8):
+    FILE_A |= 1 << (r*8)
+FILE_H = FILE_A << 7
+ROWS = [0xFF << (8*r) for r in range(8)] #ROWS[0] is the 8th rank
+
+'''
+Step from a square in a direction, returns the new square or -1 if it falls off the board
+'''
+def offsetSquare(sq,dr,dc):
+    r = sq // 8 + dr
+    c = sq % 8 + dc
+    if 0 <= r < 8 and 0 <= c < 8:
+        return r*8 + c
+    return -1
+
+def _leaperAttacks(offsets):
+    table = []
+    for sq in range(64):
+        bb = 0
+        for dr,dc in offsets:
+            t = offsetSquare(sq,dr,dc)
+            if t >= 0:
+                bb |= 1 << t
+        table.append(bb)
+    return table
+
+KNIGHT_ATTACKS = _leaperAttacks(((-2,-1),(-2,1),(-1,-2),(-1,2),(1,-2),(1,2),(2,-1),(2,1)))
+KING_ATTACKS = _leaperAttacks(DIRECTIONS)
+#PAWN_ATTACKS[0] are squares a white pawn attacks (towards row 0), PAWN_ATTACKS[1] for black
+PAWN_ATTACKS = [_leaperAttacks(((-1,-1),(-1,1))),_leaperAttacks(((1,-1),(1,1)))]
+
+#RAYS[d][sq] is every square from sq (exclusive) to the edge of the board in DIRECTIONS[d]
+RAYS = []
+for dr,dc in DIRECTIONS:
+    rays = []
+    for sq in range(64):
+        bb = 0
+        t = offsetSquare(sq,dr,dc)
+        while t >= 0:
+            bb |= 1 << t
+            t = offsetSquare(t,dr,dc)
+        rays.append(bb)
+    RAYS.append(rays)
+
+'''
+Slow reference sliding attack generator, walks each direction until it hits a blocker.
+Only used to fill the lookup tables below.
+'''
+def _walkAttacks(sq,occ,dirs):
+    bb = 0
+    for dr,dc in dirs:
+        t = offsetSquare(sq,dr,dc)
+        while t >= 0:
+            bb |= 1 << t
+            if occ >> t & 1:
+                break
+            t = offsetSquare(t,dr,dc)
+    return bb
+
+'''
+Build the occupancy mask and attack lookup for one line (pair of opposite directions) per square.
+The mask leaves out the edge squares since a piece there can never block anything behind it,
+the lookup maps (occupied & mask) to the attacked squares along the line.
+'''
+def _lineTables(dirs):
+    masks = []
+    attacks = []
+    for sq in range(64):
+        mask = 0
+        for dr,dc in dirs:
+            t = offsetSquare(sq,dr,dc)
+            while t >= 0 and offsetSquare(t,dr,dc) >= 0:
+                mask |= 1 << t
+                t = offsetSquare(t,dr,dc)
+        table = {}
+        sub = 0
+        while True: #enumerate every subset of the mask
+            table[sub] = _walkAttacks(sq,sub,dirs)
+            sub = (sub - mask) & mask
+            if sub == 0:
+                break
+        masks.append(mask)
+        attacks.append(table)
+    return masks,attacks
+
+RANK_MASK,RANK_ATTACKS = _lineTables(((0,-1),(0,1)))
+FILE_MASK,FILE_ATTACKS = _lineTables(((-1,0),(1,0)))
+DIAG_MASK,DIAG_ATTACKS = _lineTables(((-1,-1),(1,1)))
+ANTI_MASK,ANTI_ATTACKS = _lineTables(((-1,1),(1,-1)))
+#every square a queen on sq could reach on an empty board
+QUEEN_RAYS = [RAYS[0][sq]|RAYS[1][sq]|RAYS[2][sq]|RAYS[3][sq]|RAYS[4][sq]|RAYS[5][sq]|RAYS[6][sq]|RAYS[7][sq] for sq in range(64)]
+
+#BETWEEN[a][b] is the squares strictly between a and b when they share a line, otherwise 0
+BETWEEN = [[0]*64 for sq in range(64)]
+for a in range(64):
+    for d in range(8):
+        dr,dc = DIRECTIONS[d]
+        between = 0
+        b = offsetSquare(a,dr,dc)
+        while b >= 0:
+            BETWEEN[a][b] = between
+            between |= 1 << b
+            b = offsetSquare(b,dr,dc)
+
+def rookAttacks(sq,occ):
+    return RANK_ATTACKS[sq][occ & RANK_MASK[sq]] | FILE_ATTACKS[sq][occ & FILE_MASK[sq]]
+
+def bishopAttacks(sq,occ):
+    return DIAG_ATTACKS[sq][occ & DIAG_MASK[sq]] | ANTI_ATTACKS[sq][occ & ANTI_MASK[sq]]
+
+def queenAttacks(sq,occ):
+    return rookAttacks(sq,occ) | bishopAttacks(sq,occ)
+
+'''
+Yields the square index of every set bit, lowest first
+'''
+def iterBits(bb):
+    while bb:
+        b = bb & -bb
+        yield b.bit_length() - 1
+        bb ^= b
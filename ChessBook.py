@@ -0,0 +1,219 @@
+'''
+Opening book. A book file is a header followed by fixed size entries sorted by position key (GameState.zobristKey),
+so it is read with mmap and a binary search: nothing is parsed when a book is opened and every engine process using
+the same file shares its pages through the OS page cache.
+build compiles PGN collections into a book, weighting each move by the results it scored.
+
+Usage:
+    python ChessBook.py build games.pgn more.pgn --output book.bin --plies 20 --min-games 2
+    python ChessBook.py probe book.bin --fen "<fen>"
+File layout, big endian:
+    header  8 byte magic, 8 byte key check (ZOBRIST_BLACK_TO_MOVE of the keys the book was built with), 8 byte entry count
+    entry   8 byte position key, 2 byte move, 2 byte weight, 4 byte game count
+A move is start square | end square << 6 | promotion offset << 12, the squares and offset of ChessEngine move codes.
+'''
+import argparse
+import mmap
+import os
+import random
+import struct
+import sys
+
+import ChessEngine
+import ChessPGN
+from ChessEngine import START_FEN,ZOBRIST_BLACK_TO_MOVE
+
+MAGIC = b'CEBOOK\x00\x01'
+HEADER = struct.Struct('>8sQQ')
+ENTRY = struct.Struct('>QHHI')
+MAX_WEIGHT = 0xFFFF
+_KEY = struct.Struct('>Q')
+
+'''
+Book move of an int move code
+'''
+def bookMove(code):
+    return (code & 0xFFF) | (code >> 20 & 7) << 12
+
+class OpeningBook():
+    '''
+    Read only view of a book file. rng picks between weighted moves, pass a seeded random.Random for repeatable games.
+    Raises ValueError if the file isn't a book or was built with other zobrist keys
+    '''
+    def __init__(self,path,rng=None):
+        self.path = path
+        self.rng = rng or random.Random()
+        with open(path,'rb') as f:
+            self.data = mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ)
+        if len(self.data) < HEADER.size:
+            self.close()
+            raise ValueError('%s is not an opening book' % path)
+        magic,keyCheck,self.count = HEADER.unpack_from(self.data,0)
+        if magic != MAGIC or len(self.data) != HEADER.size + self.count*ENTRY.size:
+            self.close()
+            raise ValueError('%s is not an opening book' % path)
+        if keyCheck != ZOBRIST_BLACK_TO_MOVE:
+            self.close()
+            raise ValueError('%s was built with different position keys' % path)
+
+    def __len__(self):
+        return self.count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*exc):
+        self.close()
+
+    def close(self):
+        if self.data is not None:
+            self.data.close()
+            self.data = None
+
+    '''
+    (move, weight, games) of every entry for a position key, heaviest first
+    '''
+    def entries(self,key):
+        data = self.data
+        lo,hi = 0,self.count
+        while lo < hi: #first entry with a key >= key
+            mid = (lo + hi) >> 1
+            if _KEY.unpack_from(data,HEADER.size + mid*ENTRY.size)[0] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        found = []
+        while lo < self.count:
+            entryKey,move,weight,games = ENTRY.unpack_from(data,HEADER.size + lo*ENTRY.size)
+            if entryKey != key:
+                break
+            found.append((move,weight,games))
+            lo += 1
+        return found
+
+    '''
+    (Move, weight, games) for the book moves of gs, each Move taken from gs.getValidMoves().
+    Entries that aren't legal here (a key collision) are left out
+    '''
+    def moves(self,gs):
+        found = self.entries(gs.zobristKey)
+        if not found:
+            return []
+        legal = {bookMove(move.code):move for move in gs.getValidMoves()}
+        return [(legal[move],weight,games) for move,weight,games in found if move in legal]
+
+    '''
+    A book move for gs chosen at random in proportion to the weights, or the heaviest with best set.
+    rng replaces self.rng for this pick. None when the position isn't in the book or only has moves of weight 0
+    '''
+    def pickMove(self,gs,best=False,rng=None):
+        found = [entry for entry in self.moves(gs) if entry[1] > 0]
+        if not found:
+            return None
+        if best:
+            return found[0][0]
+        pick = (rng or self.rng).randrange(sum(weight for move,weight,games in found))
+        for move,weight,games in found:
+            pick -= weight
+            if pick < 0:
+                return move
+        return found[-1][0]
+
+'''
+Count the moves played in the first maxPlies plies of every game, returns {(key, move): [score, games]}.
+score is 2 for a move by the side that went on to win, 1 for a draw or an unfinished game, 0 for a loss.
+Games with an illegal move count up to that move, unless strict is set (raises ValueError)
+'''
+def collectMoves(games,maxPlies=20,strict=False):
+    counts = {}
+    for headers,sanMoves,result in games:
+        try:
+            gs = ChessEngine.GameState.fromFen(headers['FEN']) if 'FEN' in headers else ChessEngine.GameState()
+        except ValueError:
+            if strict:
+                raise
+            continue
+        if result == '1-0':
+            scores = (2,0)
+        elif result == '0-1':
+            scores = (0,2)
+        else:
+            scores = (1,1)
+        for san in sanMoves[:maxPlies]:
+            try:
+                move = ChessPGN.parseSan(gs,san)
+            except ValueError:
+                if strict:
+                    raise
+                break
+            entry = counts.setdefault((gs.zobristKey,bookMove(move.code)),[0,0])
+            entry[0] += scores[0 if gs.whiteToMove else 1]
+            entry[1] += 1
+            gs.makeMove(move)
+    return counts
+
+'''
+Write the counted moves of collectMoves as a book file, keeping moves played in at least minGames games.
+Weights of a position are scaled down together when the largest doesn't fit in 16 bits.
+The file is written next to path and renamed over it so readers never see half a book.
+Returns the number of entries and positions
+'''
+def writeBook(path,counts,minGames=1):
+    byKey = {}
+    for (key,move),(score,games) in counts.items():
+        if games >= minGames:
+            byKey.setdefault(key,[]).append((move,score,games))
+    entries = []
+    for key in sorted(byKey):
+        moves = byKey[key]
+        top = max(score for move,score,games in moves)
+        scale = MAX_WEIGHT/top if top > MAX_WEIGHT else 1
+        moves.sort(key=lambda m: (-m[1],-m[2],m[0]))
+        for move,score,games in moves:
+            entries.append((key,move,int(score*scale),min(games,0xFFFFFFFF)))
+    temp = path + '.tmp'
+    with open(temp,'wb') as f:
+        f.write(HEADER.pack(MAGIC,ZOBRIST_BLACK_TO_MOVE,len(entries)))
+        for entry in entries:
+            f.write(ENTRY.pack(*entry))
+    os.replace(temp,path)
+    return len(entries),len(byKey)
+
+def _iterGames(paths):
+    for path in paths:
+        if path == '-':
+            yield from ChessPGN.readGames(sys.stdin)
+        else:
+            with open(path) as stream:
+                yield from ChessPGN.readGames(stream)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Build or query an opening book')
+    commands = parser.add_subparsers(dest='command',required=True)
+    build = commands.add_parser('build',help='compile PGN files into a book')
+    build.add_argument('inputs',nargs='+',help="PGN files, '-' for stdin")
+    build.add_argument('--output','-o',default='book.bin')
+    build.add_argument('--plies',type=int,default=20,help='moves taken from the start of each game')
+    build.add_argument('--min-games',type=int,default=1,help='leave out moves played in fewer games')
+    probe = commands.add_parser('probe',help='list the book moves of a position')
+    probe.add_argument('book')
+    probe.add_argument('--fen',default=START_FEN)
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        counts = collectMoves(_iterGames(args.inputs),args.plies)
+        entries,positions = writeBook(args.output,counts,args.min_games)
+        print('%d entries, %d positions written to %s' % (entries,positions,args.output))
+    else:
+        gs = ChessEngine.GameState.fromFen(args.fen)
+        with OpeningBook(args.book) as book:
+            moves = book.moves(gs)
+            total = sum(weight for move,weight,games in moves)
+            for move,weight,games in moves:
+                print('%-7s weight %5d (%5.1f%%)  games %d' % (ChessPGN.toSan(gs,move),weight,
+                                                               100.0*weight/total if total else 0,games))
+            if not moves:
+                print('position not in book')
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,72 @@
+import random
+
+from ChessEval import PST_MG,PST_EG,PHASE_WEIGHTS,evalTerms
+from ChessBitboard import (FULL,DIRECTIONS,FILE_A,FILE_H,ROWS,SQUARES,BETWEEN,KNIGHT_ATTACKS,KING_ATTACKS,PAWN_ATTACKS,
+                           RANK_MASK,RANK_ATTACKS,FILE_MASK,FILE_ATTACKS,DIAG_MASK,DIAG_ATTACKS,ANTI_MASK,ANTI_ATTACKS)
+
+#piece string -> index into GameState.pieceBitboards, white pieces first then black
+PIECES = ['wP','wN','wB','wR','wQ','wK','bP','bN','bB','bR','bQ','bK']
+PIECE_INDEX = {piece:i for i,piece in enumerate(PIECES)}
+NO_PIECE = 12 #mailbox/move code value for an empty square
+START_FEN = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
+MAX_PLY = 128 #number of preallocated move buffers, the deepest ply perft or search can reach
+
+#moves are encoded as ints for the search and perft hot paths:
+#bits 0-5 start square, 6-11 end square, 12-15 piece moved, 16-19 piece captured (NO_PIECE if none),
+#20-22 promotion (offset of the new piece from the pawn: 1 knight .. 4 queen, 0 if none), 23 en-passant, 24 castling.
+#squares are row*8+col and pieces are PIECES indexes. Move objects are only built at the API boundary
+MOVE_END_SHIFT = 6
+MOVE_PIECE_SHIFT = 12
+MOVE_CAPTURE_SHIFT = 16
+MOVE_PROMOTION_SHIFT = 20
+MOVE_ENPASSANT = 1 << 23
+MOVE_CASTLE = 1 << 24
+QUIET = NO_PIECE << MOVE_CAPTURE_SHIFT
+PROMOTION_PIECES = ' NBRQ' #promotion offset -> piece type
+PROMOTION_OFFSETS = (4,3,2,1) #queen first, the order promotions are generated in
+#move kinds for GameState.generateMoves
+CAPTURES = 1 #captures, en-passant and promotions, the moves that change the material
+QUIETS = 2
+ALL_MOVES = CAPTURES | QUIETS
+
+def encodeMove(start,end,moved,captured=NO_PIECE,promotion=0,flags=0):
+    return start | end << MOVE_END_SHIFT | moved << MOVE_PIECE_SHIFT | captured << MOVE_CAPTURE_SHIFT | promotion << MOVE_PROMOTION_SHIFT | flags
+
+#castling rights are a 4 bit mask
+WHITE_KINGSIDE = 1
+WHITE_QUEENSIDE = 2
+BLACK_KINGSIDE = 4
+BLACK_QUEENSIDE = 8
+CASTLING_LETTERS = ((WHITE_KINGSIDE,'K'),(WHITE_QUEENSIDE,'Q'),(BLACK_KINGSIDE,'k'),(BLACK_QUEENSIDE,'q'))
+#rights kept when a piece moves from or to a square, a king or rook leaving home or a rook being captured drops them
+CASTLING_KEEP = [15]*64
+CASTLING_KEEP[60] = 15 & ~(WHITE_KINGSIDE | WHITE_QUEENSIDE) #e1
+CASTLING_KEEP[63] = 15 & ~WHITE_KINGSIDE #h1
+CASTLING_KEEP[56] = 15 & ~WHITE_QUEENSIDE #a1
+CASTLING_KEEP[4] = 15 & ~(BLACK_KINGSIDE | BLACK_QUEENSIDE) #e8
+CASTLING_KEEP[7] = 15 & ~BLACK_KINGSIDE #h8
+CASTLING_KEEP[0] = 15 & ~BLACK_QUEENSIDE #a8
+#(right, king start, king end, squares that must be empty, squares that must not be attacked)
+CASTLING_MOVES = (
+    (WHITE_KINGSIDE,60,62,(1 << 61) | (1 << 62),(1 << 61) | (1 << 62)),
+    (WHITE_QUEENSIDE,60,58,(1 << 57) | (1 << 58) | (1 << 59),(1 << 58) | (1 << 59)),
+    (BLACK_KINGSIDE,4,6,(1 << 5) | (1 << 6),(1 << 5) | (1 << 6)),
+    (BLACK_QUEENSIDE,4,2,(1 << 1) | (1 << 2) | (1 << 3),(1 << 2) | (1 << 3)),
+)
+
+#zobrist hashing keys, a fixed seed keeps the keys identical in every process and every run
+#so stored keys (transposition tables, opening books) stay valid
+_zobristRandom = random.Random(0x5EED)
+ZOBRIST_PIECES = [[_zobristRandom.getrandbits(64) for sq in range(64)] for piece in PIECES]
+ZOBRIST_BLACK_TO_MOVE = _zobristRandom.getrandbits(64)
+ZOBRIST_CASTLING = [_zobristRandom.getrandbits(64) for rights in range(16)] #indexed by a 4 bit castling rights mask
+ZOBRIST_EN_PASSANT = [_zobristRandom.getrandbits(64) for col in range(8)] #indexed by the en-passant file
+
 class GameState():
-    def __init__(self):
+    '''
+    useBitboards selects the move generator used by getValidMoves, the bitboards themselves are always kept in sync with self.board
+    '''
+    def __init__(self,useBitboards=True):
         #-board is 8x8 2d list
         #-first character represents color of piece, b or w
         #-the second character represents type of piece
@@ -14,91 +81,442 @@ class GameState():
             ["wP","wP","wP","wP","wP","wP","wP","wP"],
             ["wR","wN","wB","wQ","wK","wB","wN","wR"]
         ]
-        self.moveFunctions = {'P':self.getPawnMoves,'B':self.getBishopMoves,'K':self.getKingMoves,
-                              'N':self.getKnightMoves, 'Q':self.getQueenMoves,'R':self.getRookMoves}
+        self.bindMoveFunctions()
         self.whiteToMove=True
         self.moveLog=[]
         self.whiteKingLocation=(7,4)
         self.blackKingLocation=(0,4)
         self.inCheck = False
-        self.pins = [] #any pieces that are pinned, need this for advanced algorithm ffg
-        self.checks = [] #any piece that is putting king in check, need this for advanced algorithm ffg
+        self.legalMaps = None #computeAttackMaps() of the position the board walking generators work on
+        self.useBitboards = useBitboards
+        self.pieceBitboards = [0]*12 #one bitboard per piece in PIECES order
+        self.colorBitboards = [0,0] #white pieces, black pieces
+        self.occupied = 0
+        self.mailbox = [NO_PIECE]*64 #PIECES index on every square, lets move generation read captures without self.board
+        self.castlingRights = WHITE_KINGSIDE | WHITE_QUEENSIDE | BLACK_KINGSIDE | BLACK_QUEENSIDE
+        self.enPassantSquare = -1 #square a pawn can capture en-passant on, -1 if none
+        self.halfmoveClock = 0 #plies since the last capture or pawn move, for the fifty-move rule
+        self.fullmoveNumber = 1
+        self.zobristKey = 0 #64 bit hash of the position, updated incrementally by makeMove/undoMove
+        self.pawnKey = 0 #zobrist hash of the pawns alone, the key of ChessEval's pawn structure cache
+        #material plus piece-square scores (white minus black) for the middlegame and the endgame, and the game phase
+        #the evaluation tapers between them with, all updated incrementally, see ChessEval
+        self.mgScore = 0
+        self.egScore = 0
+        self.phase = 0
+        #one (move code, castling rights, en-passant square, halfmove clock, zobrist key, mgScore, egScore, phase, pawnKey)
+        #tuple per move made with pushMove, including the ones made through makeMove.
+        #The state is saved from before the move so popMove just restores it
+        self.moveStack = []
+        self.keyHistory = [] #zobrist key of every position since the game (or FEN) started, for repetitions
+        self.moveBuffers = [[] for ply in range(MAX_PLY)] #reused move lists, one per ply, see generateMoves
+        self.quietBuffers = [[] for ply in range(MAX_PLY)] #the same for the quiet moves of a staged generation
+        self.refreshState()
+
+    '''
+    Rebuild everything derived from self.board (bitboards, mailbox, king locations, hash keys, key history and evaluation terms),
+    call this after editing the board directly
+    '''
+    def refreshState(self):
+        self.pieceBitboards = [0]*12
+        self.colorBitboards = [0,0]
+        self.mailbox = [NO_PIECE]*64
+        for r in range(8):
+            for c in range(8):
+                piece = self.board[r][c]
+                if piece != '--':
+                    bit = 1 << (r*8+c)
+                    self.mailbox[r*8+c] = PIECE_INDEX[piece]
+                    self.pieceBitboards[PIECE_INDEX[piece]] |= bit
+                    self.colorBitboards[0 if piece[0] == 'w' else 1] |= bit
+                    if piece == 'wK':
+                        self.whiteKingLocation = (r,c)
+                    elif piece == 'bK':
+                        self.blackKingLocation = (r,c)
+        self.occupied = self.colorBitboards[0] | self.colorBitboards[1]
+        #drop castling rights whose king or rook isn't home and en-passant squares no pawn can capture on,
+        #so equal positions get equal keys and the generators can trust them
+        for right,kingStart,kingEnd,empty,safe in CASTLING_MOVES:
+            rook = 3 if kingStart == 60 else 9
+            rookSq = kingStart + 3 if kingEnd > kingStart else kingStart - 4
+            if self.mailbox[kingStart] != rook + 2 or self.mailbox[rookSq] != rook:
+                self.castlingRights &= ~right
+        if self.enPassantSquare >= 0 and not self.enPassantCapturers(self.enPassantSquare):
+            self.enPassantSquare = -1
+        self.zobristKey = self.computeZobristKey()
+        self.keyHistory = [self.zobristKey]
+        self.pawnKey = self.computePawnKey()
+        self.mgScore,self.egScore,self.phase = evalTerms(self.board)
+
+    '''
+    Our pawns that could capture en-passant on sq, the pawn that just moved two squares has to be there too
+    '''
+    def enPassantCapturers(self,sq):
+        if self.whiteToMove:
+            pushed,pawn,enemyPawn = sq + 8,0,6
+        else:
+            pushed,pawn,enemyPawn = sq - 8,6,0
+        if sq >> 3 != (2 if self.whiteToMove else 5) or self.mailbox[pushed] != enemyPawn or self.occupied >> sq & 1:
+            return 0
+        return PAWN_ATTACKS[1-pawn//6][sq] & self.pieceBitboards[pawn]
+
+    '''
+    Set up the position from a FEN string and clear the move log. Raises ValueError for malformed FEN.
+    Castling rights without the king and rook at home and en-passant squares nobody can capture on are dropped
+    '''
+    def loadFen(self,fen):
+        fields = fen.split()
+        if len(fields) < 2:
+            raise ValueError('FEN needs at least piece placement and side to move: %r' % fen)
+        ranks = fields[0].split('/')
+        if len(ranks) != 8:
+            raise ValueError('FEN placement needs 8 ranks: %r' % fen)
+        board = []
+        for rank in ranks:
+            row = []
+            for ch in rank:
+                if ch in '12345678':
+                    row.extend(['--']*int(ch))
+                elif ch in 'PNBRQK':
+                    row.append('w' + ch)
+                elif ch in 'pnbrqk':
+                    row.append('b' + ch.upper())
+                else:
+                    raise ValueError('bad FEN piece %r: %r' % (ch,fen))
+            if len(row) != 8:
+                raise ValueError('FEN rank %r is not 8 squares: %r' % (rank,fen))
+            board.append(row)
+        if fields[1] not in ('w','b'):
+            raise ValueError('bad FEN side to move %r: %r' % (fields[1],fen))
+        if len(fields) > 2 and not (fields[2] == '-' or set(fields[2]) <= set('KQkq')):
+            raise ValueError('bad FEN castling rights %r: %r' % (fields[2],fen))
+        if len(fields) > 3 and not (fields[3] == '-' or (len(fields[3]) == 2 and fields[3][0] in 'abcdefgh' and fields[3][1] in '36')):
+            raise ValueError('bad FEN en-passant square %r: %r' % (fields[3],fen))
+        clocks = fields[4:6]
+        if not all(field.isdigit() for field in clocks):
+            raise ValueError('bad FEN move counters %r: %r' % (' '.join(clocks),fen))
+        flat = [piece for row in board for piece in row]
+        if flat.count('wK') != 1 or flat.count('bK') != 1:
+            raise ValueError('FEN needs exactly one king per side: %r' % fen)
+        self.board = board
+        self.whiteToMove = fields[1] == 'w'
+        castling = fields[2] if len(fields) > 2 else '-'
+        self.castlingRights = sum(right for right,letter in CASTLING_LETTERS if letter in castling)
+        enPassant = fields[3] if len(fields) > 3 else '-'
+        self.enPassantSquare = -1 if enPassant == '-' else Move.ranksToRows[enPassant[1]]*8 + Move.filesToCols[enPassant[0]]
+        self.halfmoveClock = int(clocks[0]) if clocks else 0
+        self.fullmoveNumber = max(int(clocks[1]),1) if len(clocks) > 1 else 1
+        self.moveLog = []
+        self.moveStack = []
+        self.refreshState()
+
+    '''
+    Piece letter -> board walking move generator, looked up again from the class so the methods can be swapped (see ChessProfile)
+    '''
+    def bindMoveFunctions(self):
+        self.moveFunctions = {'P':self.getPawnMoves,'B':self.getBishopMoves,'K':self.getKingMoves,
+                              'N':self.getKnightMoves, 'Q':self.getQueenMoves,'R':self.getRookMoves}
+
+    @classmethod
+    def fromFen(cls,fen,useBitboards=True):
+        gs = cls(useBitboards)
+        gs.loadFen(fen)
+        return gs
+
+    '''
+    FEN string of the current position
+    '''
+    def getFen(self):
+        ranks = []
+        for row in self.board:
+            rank = ''
+            empty = 0
+            for piece in row:
+                if piece == '--':
+                    empty += 1
+                    continue
+                if empty:
+                    rank += str(empty)
+                    empty = 0
+                rank += piece[1] if piece[0] == 'w' else piece[1].lower()
+            if empty:
+                rank += str(empty)
+            ranks.append(rank)
+        castling = ''.join(letter for right,letter in CASTLING_LETTERS if self.castlingRights & right) or '-'
+        if self.enPassantSquare >= 0:
+            r,c = SQUARES[self.enPassantSquare]
+            enPassant = Move.colsToFile[c] + Move.rowToRanks[r]
+        else:
+            enPassant = '-'
+        return '%s %s %s %s %d %d' % ('/'.join(ranks),'w' if self.whiteToMove else 'b',castling,enPassant,
+                                      self.halfmoveClock,self.fullmoveNumber)
+
+    '''
+    Compact picklable copy of the position (64 byte mailbox, side to move, castling rights, en-passant square and
+    move counters), what worker processes get instead of a pickled GameState with its move history and bound methods.
+    Rebuild it with GameState.fromSnapshot. The key history isn't included, so repetitions before the snapshot are not seen
+    '''
+    def snapshot(self):
+        return (bytes(self.mailbox),self.whiteToMove,self.castlingRights,self.enPassantSquare,self.halfmoveClock,self.fullmoveNumber)
+
+    @classmethod
+    def fromSnapshot(cls,snapshot,useBitboards=True):
+        mailbox,whiteToMove,castlingRights,enPassantSquare,halfmoveClock,fullmoveNumber = snapshot
+        gs = cls(useBitboards)
+        gs.board = [[PIECES[piece] if piece != NO_PIECE else '--' for piece in mailbox[r*8:r*8+8]] for r in range(8)]
+        gs.whiteToMove = whiteToMove
+        gs.castlingRights = castlingRights
+        gs.enPassantSquare = enPassantSquare
+        gs.halfmoveClock = halfmoveClock
+        gs.fullmoveNumber = fullmoveNumber
+        gs.refreshState()
+        return gs
+
+    '''
+    Hash the position from scratch, makeMove/undoMove keep self.zobristKey equal to this without rescanning the board.
+    The castling rights are always hashed through ZOBRIST_CASTLING, the en-passant file only when there is a square
+    '''
+    def computeZobristKey(self):
+        key = 0
+        for piece in range(12):
+            bb = self.pieceBitboards[piece]
+            while bb:
+                b = bb & -bb
+                key ^= ZOBRIST_PIECES[piece][b.bit_length()-1]
+                bb ^= b
+        if not self.whiteToMove:
+            key ^= ZOBRIST_BLACK_TO_MOVE
+        key ^= ZOBRIST_CASTLING[self.castlingRights]
+        if self.enPassantSquare >= 0:
+            key ^= ZOBRIST_EN_PASSANT[self.enPassantSquare & 7]
+        return key
+
+    '''
+    Hash of the pawns only, pushMove/popMove keep self.pawnKey equal to this
+    '''
+    def computePawnKey(self):
+        key = 0
+        for piece in (0,6):
+            bb = self.pieceBitboards[piece]
+            while bb:
+                b = bb & -bb
+                key ^= ZOBRIST_PIECES[piece][b.bit_length()-1]
+                bb ^= b
+        return key
+
+    '''
+    Number of earlier positions, with the same side to move, equal to the current one since the last capture or pawn move
+    '''
+    def repetitionCount(self):
+        keys = self.keyHistory
+        key = self.zobristKey
+        last = len(keys) - 1
+        count = 0
+        for i in range(last-2,last-1-min(self.halfmoveClock,last),-2):
+            if keys[i] == key:
+                count += 1
+        return count
+
+    '''
+    Draw by the fifty-move rule or by repetition. repetitions is how many earlier occurrences count,
+    2 gives the threefold rule, search uses 1 since a position that repeats once can be repeated again
+    '''
+    def isDraw(self,repetitions=2):
+        return self.halfmoveClock >= 100 or self.repetitionCount() >= repetitions
     
     '''
-    Takes a move as a parameter and executes it
-    will not work for castling,pawn promotion, and en-passant
+    Takes a move as a parameter and executes it, including castling, en-passant and promotion
     '''
     def makeMove(self,move):
-        self.board[move.startRow][move.startCol] = '--'
-        self.board[move.endRow][move.endCol] = move.pieceMoved
+        self.pushMove(move.code)
         self.moveLog.append(move)
-        self.whiteToMove = not self.whiteToMove
-        #update the king's location if moved
-        if move.pieceMoved == 'wK':
-            self.whiteKingLocation = (move.endRow,move.endCol)
-        if move.pieceMoved == 'bK':
-            self.blackKingLocation = (move.endRow,move.endCol)
 
     '''
     Undo the last move made
     '''
     def undoMove(self):
         if len(self.moveLog) > 0:
-            move=self.moveLog.pop()
-            self.board[move.startRow][move.startCol] = move.pieceMoved
-            self.board[move.endRow][move.endCol] = move.pieceCaptured
-            self.whiteToMove = not self.whiteToMove
-        if move.pieceMoved == 'wK':
-            self.whiteKingLocation = (move.startRow,move.startCol)
-        if move.pieceMoved == 'bK':
-            self.blackKingLocation = (move.startRow,move.startCol)
+            self.moveLog.pop()
+            self.popMove()
+
+    '''
+    Make a move given as an int code (see encodeMove), the allocation free version of makeMove used by search and perft.
+    Moves made this way are not added to moveLog, undo them with popMove.
+    The irreversible state (castling rights, en-passant square, halfmove clock), the hash keys and the evaluation terms
+    are pushed on moveStack as they were before the move, so popMove restores them instead of working them out again
+    '''
+    def pushMove(self,code):
+        start = code & 63
+        end = code >> 6 & 63
+        moved = code >> 12 & 15
+        captured = code >> 16 & 15
+        bbs = self.pieceBitboards
+        colors = self.colorBitboards
+        mailbox = self.mailbox
+        board = self.board
+        self.moveStack.append((code,self.castlingRights,self.enPassantSquare,self.halfmoveClock,self.zobristKey,
+                               self.mgScore,self.egScore,self.phase,self.pawnKey))
+        startBit = 1 << start
+        endBit = 1 << end
+        color = 0 if moved < 6 else 1
+        key = self.zobristKey ^ ZOBRIST_BLACK_TO_MOVE
+        if self.enPassantSquare >= 0:
+            key ^= ZOBRIST_EN_PASSANT[self.enPassantSquare & 7]
+            self.enPassantSquare = -1
+        if captured != NO_PIECE:
+            capturedSq = end
+            if code & MOVE_ENPASSANT: #the captured pawn is behind the end square
+                capturedSq = end + 8 if color == 0 else end - 8
+                r,c = SQUARES[capturedSq]
+                board[r][c] = '--'
+                mailbox[capturedSq] = NO_PIECE
+            capturedBit = 1 << capturedSq
+            bbs[captured] ^= capturedBit
+            colors[1-color] ^= capturedBit
+            key ^= ZOBRIST_PIECES[captured][capturedSq]
+            self.mgScore -= PST_MG[captured][capturedSq]
+            self.egScore -= PST_EG[captured][capturedSq]
+            self.phase -= PHASE_WEIGHTS[captured]
+            if captured == 0 or captured == 6:
+                self.pawnKey ^= ZOBRIST_PIECES[captured][capturedSq]
+            self.halfmoveClock = 0
+        elif moved == 0 or moved == 6:
+            self.halfmoveClock = 0
+        else:
+            self.halfmoveClock += 1
+        placed = moved + (code >> 20 & 7) #the promoted piece, or the moved one
+        bbs[moved] ^= startBit
+        bbs[placed] ^= endBit
+        colors[color] ^= startBit | endBit
+        key ^= ZOBRIST_PIECES[moved][start] ^ ZOBRIST_PIECES[placed][end]
+        self.mgScore += PST_MG[placed][end] - PST_MG[moved][start]
+        self.egScore += PST_EG[placed][end] - PST_EG[moved][start]
+        if moved == 0 or moved == 6:
+            if placed == moved:
+                self.pawnKey ^= ZOBRIST_PIECES[moved][start] ^ ZOBRIST_PIECES[moved][end]
+            else:
+                self.pawnKey ^= ZOBRIST_PIECES[moved][start]
+                self.phase += PHASE_WEIGHTS[placed]
+        mailbox[start] = NO_PIECE
+        mailbox[end] = placed
+        startRow,startCol = SQUARES[start]
+        endRow,endCol = SQUARES[end]
+        board[startRow][startCol] = '--'
+        board[endRow][endCol] = PIECES[placed]
+        if code & MOVE_CASTLE: #move the rook too
+            rookStart,rookEnd = (start+3,start+1) if end > start else (start-4,start-1)
+            rook = moved - 2
+            rookBits = (1 << rookStart) | (1 << rookEnd)
+            bbs[rook] ^= rookBits
+            colors[color] ^= rookBits
+            key ^= ZOBRIST_PIECES[rook][rookStart] ^ ZOBRIST_PIECES[rook][rookEnd]
+            self.mgScore += PST_MG[rook][rookEnd] - PST_MG[rook][rookStart]
+            self.egScore += PST_EG[rook][rookEnd] - PST_EG[rook][rookStart]
+            mailbox[rookStart] = NO_PIECE
+            mailbox[rookEnd] = rook
+            board[startRow][rookStart & 7] = '--'
+            board[startRow][rookEnd & 7] = PIECES[rook]
+        rights = self.castlingRights
+        if rights:
+            newRights = rights & CASTLING_KEEP[start] & CASTLING_KEEP[end]
+            if newRights != rights:
+                key ^= ZOBRIST_CASTLING[rights] ^ ZOBRIST_CASTLING[newRights]
+                self.castlingRights = newRights
+        if (moved == 0 or moved == 6) and (start - end == 16 or end - start == 16):
+            #only a square an enemy pawn can capture on, so the key doesn't depend on an unusable en-passant square
+            if (((endBit >> 1) & ~FILE_H) | ((endBit << 1) & ~FILE_A)) & bbs[6-moved]:
+                self.enPassantSquare = (start + end) >> 1
+                key ^= ZOBRIST_EN_PASSANT[start & 7]
+        self.zobristKey = key
+        self.occupied = colors[0] | colors[1]
+        #update the king's location if moved
+        if moved == 5:
+            self.whiteKingLocation = (endRow,endCol)
+        elif moved == 11:
+            self.blackKingLocation = (endRow,endCol)
+        if color:
+            self.fullmoveNumber += 1
+        self.whiteToMove = not self.whiteToMove
+        self.keyHistory.append(key)
+
+    '''
+    Undo the last move made with pushMove (or makeMove)
+    '''
+    def popMove(self):
+        (code,self.castlingRights,self.enPassantSquare,self.halfmoveClock,self.zobristKey,
+         self.mgScore,self.egScore,self.phase,self.pawnKey) = self.moveStack.pop()
+        self.keyHistory.pop()
+        start = code & 63
+        end = code >> 6 & 63
+        moved = code >> 12 & 15
+        captured = code >> 16 & 15
+        bbs = self.pieceBitboards
+        colors = self.colorBitboards
+        mailbox = self.mailbox
+        board = self.board
+        startBit = 1 << start
+        endBit = 1 << end
+        color = 0 if moved < 6 else 1
+        placed = moved + (code >> 20 & 7)
+        bbs[moved] ^= startBit
+        bbs[placed] ^= endBit
+        colors[color] ^= startBit | endBit
+        startRow,startCol = SQUARES[start]
+        endRow,endCol = SQUARES[end]
+        mailbox[start] = moved
+        board[startRow][startCol] = PIECES[moved]
+        mailbox[end] = NO_PIECE
+        board[endRow][endCol] = '--'
+        if captured != NO_PIECE:
+            capturedSq = end
+            if code & MOVE_ENPASSANT:
+                capturedSq = end + 8 if color == 0 else end - 8
+            capturedBit = 1 << capturedSq
+            bbs[captured] ^= capturedBit
+            colors[1-color] ^= capturedBit
+            mailbox[capturedSq] = captured
+            r,c = SQUARES[capturedSq]
+            board[r][c] = PIECES[captured]
+        elif code & MOVE_CASTLE:
+            rookStart,rookEnd = (start+3,start+1) if end > start else (start-4,start-1)
+            rook = moved - 2
+            rookBits = (1 << rookStart) | (1 << rookEnd)
+            bbs[rook] ^= rookBits
+            colors[color] ^= rookBits
+            mailbox[rookStart] = rook
+            mailbox[rookEnd] = NO_PIECE
+            board[startRow][rookStart & 7] = PIECES[rook]
+            board[startRow][rookEnd & 7] = '--'
+        self.occupied = colors[0] | colors[1]
+        if moved == 5:
+            self.whiteKingLocation = (startRow,startCol)
+        elif moved == 11:
+            self.blackKingLocation = (startRow,startCol)
+        if color:
+            self.fullmoveNumber -= 1
+        self.whiteToMove = not self.whiteToMove
 
     '''
     All moves considering checks
     '''
     def getValidMoves(self):
-        moves = []
-
-        self.inCheck, self.pins, self.checks = self.checkForPinsAndChecks()
-        if self.whiteToMove:
-            kingRow=self.whiteKingLocation[0]
-            kingCol=self.whiteKingLocation[1]
-        else:
-            kingRow=self.blackKingLocation[0]
-            kingCol=self.blackKingLocation[1]
-        if self.inCheck:
-            if len(self.checks): #only 1 check, block check or move king
-                moves=self.getAllPossibleMoves()
-                #to block a check you must move a piece into one of the square between the enemy piece and the king
-                check=self.checks[0] #check information
-                checkRow=check[0]
-                checkCol=check[1]
-                pieceChecking=self.board[checkRow][checkCol]#enemy piece causing the check
-                validSquares=[]#squares that pieces can move to
-                #if knight, must capture knight or move king, other piueces can be blocked
-                if pieceChecking[1]=='N':
-                    validSquares = [(checkRow,checkCol)]
-                else:
-                    for i in range(1,8):
-                        validSquare=(kingRow+check[2]*i,kingCol+check[3]*i)#check[2] and check[3] are the check directions
-                        validSquares.append(validSquare)
-                        if validSquare[0]==checkRow and validSquare[1]==checkCol:#once you get piece end checks
-                            break
-                #get rid of any moves that don't block check or move king
-                for i in range(len(moves)-1,-1,-1):#go backwards when you are removing from a list
-                    if moves[i].pieceMoved[1]!='K': #move doesn't move king so it must block or capture
-                        if not (moves[i].endRow,moves[i].endCol) in validSquares:#move doesn't block check or capture piece
-                            moves.remove(moves[i])
-            else:#double check,king has to move
-                self.getKingMoves(kingRow,kingCol,moves)
-        else: #not in check so all moves are fine
-            moves=self.getAllPossibleMoves()
-        return moves
+        if self.useBitboards:
+            return self.getBitboardMoves()
+        maps = self.computeAttackMaps()
+        if not maps[2]: #double check, only the king can move
+            self.legalMaps = maps
+            moves = []
+            self.getKingMoves(maps[0] >> 3,maps[0] & 7,moves)
+            return moves
+        return self.getAllPossibleMoves(maps)
 
     '''
-    All moves without considering checks
+    All legal moves, walking the board. The attack maps are worked out once per position (computeAttackMaps, or maps
+    when already known) and every generator only emits targets inside its piece's check mask and pin ray and king steps
+    to unattacked squares, so nothing is filtered afterwards
     '''
-    def getAllPossibleMoves(self):
+    def getAllPossibleMoves(self,maps=None):
+        self.legalMaps = maps or self.computeAttackMaps()
         moves = []
         for r in range(len(self.board)): #number of rows
             for c in range(len(self.board[r])): #number of cols in given row
@@ -108,235 +526,397 @@ class GameState():
                     self.moveFunctions[piece](r,c,moves) #calls the appropriate move function based on piece type
         return moves
 
+    '''
+    Squares the piece on square sq may move to without leaving its king in check, from self.legalMaps
+    '''
+    def legalTargets(self,sq):
+        kingSq,attacked,checkMask,pinRays = self.legalMaps
+        return checkMask & pinRays.get(sq,FULL)
+
     '''
     Get all the pawn moves for the pawn located at row, col and add these moves to the list
     '''
     def getPawnMoves(self,r,c,moves):
-        piecePinned=False
-        pinDirection=()
-        for i in range(len(self.pins)-1,-1,-1):
-            if self.pins[i][0]==r and self.pins[i][1]==c:
-                piecePinned=True
-                pinDirection=(self.pins[i][2],self.pins[i][3])
-                self.pins.remove(self.pins[i])
-                break
-                
-        if self.whiteToMove: #whte pawn moves
-            if self.board[r-1][c] == "--": #check to see if one square above is empty
-                if not piecePinned or pinDirection == (-1,0):
-                    moves.append(Move((r,c),(r-1,c),self.board))
-                    if r==6 and self.board[r-2][c] == "--": #Check to see if first move and if 2 squares above is empty.
-                        moves.append(Move((r,c),(r-2,c),self.board))
-            #captures
-            if c-1 >=0: #Looking to capture to left, but make sure you don't go off board
-                if self.board[r-1][c-1][0] == 'b': #enemy capture
-                    if not piecePinned or pinDirection == (-1,-1):
-                        moves.append(Move((r,c),(r-1,c-1),self.board))
-            if c+1 <= 7: #Right capture
-                if self.board[r-1][c+1][0] == 'b': #enemy capture
-                    if not piecePinned or pinDirection == (-1,1):
-                        moves.append(Move((r,c),(r-1,c+1),self.board))
-
-        else: #black pawn moves
-            if self.board[r+1][c] == "--": #check to see if one square below is empty
-                if not piecePinned or pinDirection == (1,0):
-                    moves.append(Move((r,c),(r+1,c),self.board))
-                    if r==1 and self.board[r+2][c] == "--": #check to see if the square 2 below is empty
-                        moves.append(Move((r,c),(r+2,c),self.board))
-            #captures            
-            if c-1 >= 0: #capture to left
-                if self.board[r+1][c-1][0] == 'w':
-                    if not piecePinned or pinDirection == (1,-1):
-                        moves.append(Move((r,c),(r+1,c-1),self.board))
-            if c+1 <= 7: #capture to right
-                if self.board[r+1][c+1][0] == 'w':
-                    if not piecePinned or pinDirection == (1,1):
-                        moves.append(Move((r,c),(r+1,c+1),self.board))
-
-    '''
-    Get all the rook moves for the pawn located at row, col and add these moves to the list
+        allowed = self.legalTargets(r*8+c)
+        if self.whiteToMove:
+            step,firstRow,enemyColor = -1,6,'b'
+        else:
+            step,firstRow,enemyColor = 1,1,'w'
+        endRow = r+step
+        if self.board[endRow][c] == "--": #one square forward is empty
+            if allowed >> (endRow*8+c) & 1:
+                self.addPawnMove((r,c),(endRow,c),moves)
+            #the double push can block a check the single push doesn't, so it is tested on its own
+            if r == firstRow and self.board[endRow+step][c] == "--" and allowed >> ((endRow+step)*8+c) & 1:
+                moves.append(Move((r,c),(endRow+step,c),self.board))
+        for endCol in (c-1,c+1): #captures
+            if 0 <= endCol <= 7:
+                if self.board[endRow][endCol][0] == enemyColor:
+                    if allowed >> (endRow*8+endCol) & 1:
+                        self.addPawnMove((r,c),(endRow,endCol),moves)
+                elif endRow*8+endCol == self.enPassantSquare and self.isEnPassantLegal(r*8+c):
+                    moves.append(Move((r,c),(endRow,endCol),self.board))
+
     '''
-    def getRookMoves(self,r,c,moves):
-        piecePinned=False
-        pinDirection=()
-        for i in range(len(self.pins)-1,-1,-1):
-            if self.pins[i][0]==r and self.pins[i][1]==c:
-                piecePinned=True
-                pinDirection=(self.pins[i][2],self.pins[i][3])
-                if self.board[r][c][1] != 'Q':#can't remove  queen from pin on rook moves, only remove it on bishop moves
-                    self.pins.remove(self.pins[i])
-                break
-        directions=((-1,0),(0,-1),(1,0),(0,1)) #up,left,down,right
-        enemyColor = 'b' if self.whiteToMove else 'w'
+    Add a pawn move, or one move per promotion piece if it reaches the last rank
+    '''
+    def addPawnMove(self,startSq,endSq,moves):
+        if endSq[0] == 0 or endSq[0] == 7:
+            for piece in 'QRBN':
+                moves.append(Move(startSq,endSq,self.board,piece))
+        else:
+            moves.append(Move(startSq,endSq,self.board))
+
+    '''
+    Can the pawn on square start capture en-passant without leaving the king in check. Rare enough to test by making
+    the occupancy change, which also catches the two pawns leaving a rank between the king and a rook
+    '''
+    def isEnPassantLegal(self,start):
+        us = 0 if self.whiteToMove else 1
+        ep = self.enPassantSquare
+        capturedBit = 1 << (ep + 8 if us == 0 else ep - 8)
+        occ = (self.occupied ^ (1 << start) ^ capturedBit) | (1 << ep)
+        return not self.squareAttacked(self.pieceBitboards[5+6*us].bit_length()-1,occ,us,capturedBit)
+
+    '''
+    Add the moves of the slider on row, col along directions. Blocked squares end a ray, squares outside the
+    piece's legal targets are skipped but the ray goes on since a square further out can still block a check
+    '''
+    def addSliderMoves(self,r,c,directions,moves):
+        allowed = self.legalTargets(r*8+c)
+        if not allowed:
+            return
+        allyColor = 'w' if self.whiteToMove else 'b'
         for d in directions:
             for i in range(1,8): #checking 7 moves in this particular direction
                 endRow = r+d[0]*i
                 endCol = c+d[1]*i
-                if 0 <= endRow < 8 and 0 <= endCol < 8:
-                    if not piecePinned or pinDirection == d or pinDirection ==(-d[0],-d[1]):
-                        endPiece = self.board[endRow][endCol]
-                        if endPiece == "--": #empty space, valid and keep going
-                            moves.append(Move((r,c),(endRow,endCol),self.board))
-                        elif endPiece[0] == enemyColor: #enemy piece, valid, and must stop here
-                            moves.append(Move((r,c),(endRow,endCol),self.board))
-                            break
-                        else: #friendly piece, invalid, must stop here
-                            break
-                else: #off board, invalid, must stop here
+                if not (0 <= endRow < 8 and 0 <= endCol < 8): #off board, must stop here
+                    break
+                endPiece = self.board[endRow][endCol]
+                if endPiece[0] == allyColor: #friendly piece, invalid, must stop here
+                    break
+                if allowed >> (endRow*8+endCol) & 1:
+                    moves.append(Move((r,c),(endRow,endCol),self.board))
+                if endPiece != "--": #enemy piece, must stop here
                     break
 
     '''
-    Get all the knight moves for the pawn located at row, col and add these moves to the list
+    Get all the rook moves for the rook located at row, col and add these moves to the list
+    '''
+    def getRookMoves(self,r,c,moves):
+        self.addSliderMoves(r,c,DIRECTIONS[:4],moves)
+
+    '''
+    Get all the knight moves for the knight located at row, col and add these moves to the list
     '''
     def getKnightMoves(self,r,c,moves):
-        piecePinned=False
-        pinDirection=()
-        for i in range(len(self.pins)-1,-1,-1):
-            if self.pins[i][0]==r and self.pins[i][1]==c:
-                piecePinned=True
-                pinDirection=(self.pins[i][2],self.pins[i][3])
-                self.pins.remove(self.pins[i])
-                break
+        allowed = self.legalTargets(r*8+c)
+        if not allowed: #pinned knights can never move
+            return
         lmoves=((-2,-1),(-2,1),(-1,-2),(-1,2),(1,-2),(1,2),(2,-1),(2,1)) #L shaped move in all directions
         allyColor = 'w' if self.whiteToMove else 'b'
         for m in lmoves:
             endRow=r+m[0]
             endCol=c+m[1]
-            if 0 <= endRow < 8 and 0 <= endCol < 8:
-                if not piecePinned:
-                    endPiece=self.board[endRow][endCol]
-                    if endPiece[0] != allyColor: #valid move,if it isn't ally then its either enemy or empty
-                        moves.append(Move((r,c),(endRow,endCol),self.board))
+            if 0 <= endRow < 8 and 0 <= endCol < 8 and allowed >> (endRow*8+endCol) & 1:
+                if self.board[endRow][endCol][0] != allyColor: #if it isn't ally then its either enemy or empty
+                    moves.append(Move((r,c),(endRow,endCol),self.board))
 
     '''
-    Get all the bishop moves for the pawn located at row, col and add these moves to the list
+    Get all the bishop moves for the bishop located at row, col and add these moves to the list
     '''
     def getBishopMoves(self,r,c,moves):
-        piecePinned=False
-        pinDirection=()
-        for i in range(len(self.pins)-1,-1,-1):
-            if self.pins[i][0]==r and self.pins[i][1]==c:
-                piecePinned=True
-                pinDirection=(self.pins[i][2],self.pins[i][3])
-                self.pins.remove(self.pins[i])
-                break
-        directions=((-1,-1),(-1,1),(1,-1),(1,1)) #4 diagonals
-        enemyColor = 'b' if self.whiteToMove else 'w'
-        for d in directions:
-            for i in range(1,8): #checking 7 moves in this particular direction
-                endRow = r+d[0]*i
-                endCol = c+d[1]*i
-                if 0 <= endRow < 8 and 0 <= endCol < 8:
-                    if not piecePinned or pinDirection == d or pinDirection ==(-d[0],-d[1]):
-                        endPiece = self.board[endRow][endCol]
-                        if endPiece == "--": #empty space, valid and keep going
-                            moves.append(Move((r,c),(endRow,endCol),self.board))
-                        elif endPiece[0] == enemyColor: #enemy piece, valid, and must stop here
-                            moves.append(Move((r,c),(endRow,endCol),self.board))
-                            break
-                        else: #friendly piece, invalid, must stop here
-                            break
-                else: #off board, invalid, must stop here
-                    break
+        self.addSliderMoves(r,c,DIRECTIONS[4:],moves)
 
     '''
-    Get all the queen moves for the pawn located at row, col and add these moves to the list
+    Get all the queen moves for the queen located at row, col and add these moves to the list
     '''
     def getQueenMoves(self,r,c,moves):
         #queen can do same moves as rooks and bishops
-        self.getRookMoves(r,c,moves)
-        self.getBishopMoves(r,c,moves)
+        self.addSliderMoves(r,c,DIRECTIONS,moves)
 
     '''
-    Get all the king moves for the pawn located at row, col and add these moves to the list
+    Get all the king moves for the king located at row, col and add these moves to the list
     '''
     def getKingMoves(self,r,c,moves):
         rowMoves = (-1,-1,-1,0,0,1,1,1)
         colMoves = (-1,0,1,-1,1,-1,0,1)
         allyColor='w' if self.whiteToMove else 'b'
+        attacked=self.legalMaps[1] #the enemy attack map of the position instead of a pin/check scan per king step
         for i in range(8):
             endRow=r+rowMoves[i]
             endCol=c+colMoves[i]
             if 0<=endRow<8 and 0<=endCol<8:
                 endPiece=self.board[endRow][endCol]
-                if endPiece[0] != allyColor: # not ally piece (empty or enemy piece)
-                    #place king on end square and check for checks
-                    if allyColor=='w':
-                        self.whiteKingLocation=(endRow,endCol)
-                    else:
-                        self.blackKingLocation=(endRow,endCol)
-                    inCheck,pins,checks=self.checkForPinsAndChecks()
-                    if not inCheck:
-                        moves.append(Move((r,c),(endRow,endCol),self.board))
-                    #place king back on original location
-                    if allyColor=='w':
-                        self.whiteKingLocation=(r,c)
-                    else:
-                        self.blackKingLocation=(r,c)
-
-    def checkForPinsAndChecks(self):
-            pins=[] #squares where the allied pinned piece is and direction pinned from
-            checks = []#squares where enemy is applying a check
-            inCheck=False
-            if self.whiteToMove:
-                enemyColor='b'
-                allyColor='w'
-                startRow=self.whiteKingLocation[0]
-                startCol=self.whiteKingLocation[1]
+                if endPiece[0] != allyColor and not attacked >> (endRow*8+endCol) & 1: # not ally piece and not attacked
+                    moves.append(Move((r,c),(endRow,endCol),self.board))
+        #castling, the king can't castle out of, through or into check
+        if not self.inCheck:
+            for right,kingStart,kingEnd,empty,safe in CASTLING_MOVES:
+                if self.castlingRights & right and kingStart == r*8+c and not self.occupied & empty and not attacked & safe:
+                    moves.append(Move((r,c),SQUARES[kingEnd],self.board))
+
+    '''
+    Is square sq attacked by the opponent of color (0 white, 1 black) given the occupancy occ.
+    captured is the bit of an enemy piece that should be ignored because it was just captured
+    '''
+    def squareAttacked(self,sq,occ,color,captured=0):
+        bbs = self.pieceBitboards
+        e = 6 if color == 0 else 0 #index of the enemy pawns
+        keep = ~captured
+        if KNIGHT_ATTACKS[sq] & bbs[e+1] & keep or PAWN_ATTACKS[color][sq] & bbs[e] & keep or KING_ATTACKS[sq] & bbs[e+5]:
+            return True
+        rooks = (bbs[e+3] | bbs[e+4]) & keep #rooks and queens
+        if rooks and (RANK_ATTACKS[sq][occ & RANK_MASK[sq]] | FILE_ATTACKS[sq][occ & FILE_MASK[sq]]) & rooks:
+            return True
+        bishops = (bbs[e+2] | bbs[e+4]) & keep #bishops and queens
+        if bishops and (DIAG_ATTACKS[sq][occ & DIAG_MASK[sq]] | ANTI_ATTACKS[sq][occ & ANTI_MASK[sq]]) & bishops:
+            return True
+        return False
+
+    '''
+    Everything needed to emit only legal moves, worked out once per position from the bitboards.
+    Returns (king square, attacked, check mask, pin rays):
+    attacked are the squares the enemy attacks with our king lifted off the board, so the king can't step back along a checking line,
+    the check mask holds the squares that capture or block the only checker (every square when not in check, none in double check),
+    pin rays maps the square of each pinned piece to the squares it may still move to.
+    Also sets self.inCheck
+    '''
+    def computeAttackMaps(self):
+        bbs = self.pieceBitboards
+        occ = self.occupied
+        us,e = (0,6) if self.whiteToMove else (1,0)
+        kingBit = bbs[5+6*us]
+        kingSq = kingBit.bit_length() - 1
+        withoutKing = occ ^ kingBit
+        enemy = self.colorBitboards[1-us]
+
+        pawns = bbs[e]
+        if us == 0:
+            attacked = (((pawns & ~FILE_A) << 7) | ((pawns & ~FILE_H) << 9)) & FULL
+        else:
+            attacked = ((pawns & ~FILE_A) >> 9) | ((pawns & ~FILE_H) >> 7)
+        pieces = bbs[e+1]
+        while pieces:
+            b = pieces & -pieces
+            pieces ^= b
+            attacked |= KNIGHT_ATTACKS[b.bit_length()-1]
+        diagonal = bbs[e+2] | bbs[e+4]
+        pieces = diagonal
+        while pieces:
+            b = pieces & -pieces
+            pieces ^= b
+            sq = b.bit_length() - 1
+            attacked |= DIAG_ATTACKS[sq][withoutKing & DIAG_MASK[sq]] | ANTI_ATTACKS[sq][withoutKing & ANTI_MASK[sq]]
+        orthogonal = bbs[e+3] | bbs[e+4]
+        pieces = orthogonal
+        while pieces:
+            b = pieces & -pieces
+            pieces ^= b
+            sq = b.bit_length() - 1
+            attacked |= RANK_ATTACKS[sq][withoutKing & RANK_MASK[sq]] | FILE_ATTACKS[sq][withoutKing & FILE_MASK[sq]]
+        attacked |= KING_ATTACKS[bbs[e+5].bit_length()-1]
+
+        checkMask = FULL
+        self.inCheck = bool(attacked & kingBit)
+        if self.inCheck:
+            checkers = ((KNIGHT_ATTACKS[kingSq] & bbs[e+1]) | (PAWN_ATTACKS[us][kingSq] & bbs[e]) |
+                        ((RANK_ATTACKS[kingSq][occ & RANK_MASK[kingSq]] | FILE_ATTACKS[kingSq][occ & FILE_MASK[kingSq]]) & orthogonal) |
+                        ((DIAG_ATTACKS[kingSq][occ & DIAG_MASK[kingSq]] | ANTI_ATTACKS[kingSq][occ & ANTI_MASK[kingSq]]) & diagonal))
+            if checkers & (checkers-1): #double check, only the king can move
+                checkMask = 0
             else:
-                enemyColor='w'
-                allyColor='b'
-                startRow=self.blackKingLocation[0]
-                startCol=self.blackKingLocation[1]
-            #check outward from king for pins and checks, keep track of pins
-            directions=((-1,0),(0,-1),(1,0),(0,1),(-1,-1),(-1,1),(1,-1),(1,1))
-            for j in range(len(directions)):
-                d=directions[j]
-                possiblePin=() #reset possible pins
-                for i in range(1,8):
-                    endRow=startRow+d[0]*i
-                    endCol=startCol+d[1]*i
-                    if 0<=endRow<8 and 0<=endCol<8:
-                        endPiece=self.board[endRow][endCol]
-                        if endPiece[0] == allyColor and endPiece[1] != 'K':
-                            if possiblePin ==():#1st allied piece could be pinned
-                                possiblePin=(endRow,endCol,d[0],d[1])
-                            else:#2nd allied piece, so no pin or check possible in this direction
-                                break
-                        elif endPiece[0] == enemyColor:
-                            type=endPiece[1]
-                            #5 possiblities here in this complex conditional
-                            #1.) orthogonally away from king and piece is a rook
-                            #2.) diagonally away from king and piece is a bishop
-                            #3.) 1 square away diagonally from king and piece is a pawn
-                            #4.) any direction and piece is a queen
-                            #5.) any direction 1 square away and piece is a king (this is necessary to prevent a king move to a square controlled by another king)
-                            if(0<=j<=3 and type=='R') or \
-                              (4<=j<=7 and type=='B') or \
-                              (i==1 and type=='P' and ((enemyColor=='w' and 6<=j<=7) or (enemyColor=='b' and 4<=j<=5))) or \
-                              (type=='Q') or (i==1 and type=='K'):
-                                if possiblePin==():#no piece blocking, so check
-                                    inCheck=True
-                                    checks.append((endRow,endCol,d[0],d[1]))
-                                    break
-                                else:#piece blocking so pin
-                                    pins.append(possiblePin)
-                                    break
-                            else:#enemy piece not applying check:
-                                break
+                checkMask = checkers | BETWEEN[kingSq][checkers.bit_length()-1]
+
+        #pins, an enemy slider sees the king through exactly one of our pieces
+        pinRays = {}
+        snipers = (((RANK_ATTACKS[kingSq][enemy & RANK_MASK[kingSq]] | FILE_ATTACKS[kingSq][enemy & FILE_MASK[kingSq]]) & orthogonal) |
+                   ((DIAG_ATTACKS[kingSq][enemy & DIAG_MASK[kingSq]] | ANTI_ATTACKS[kingSq][enemy & ANTI_MASK[kingSq]]) & diagonal))
+        while snipers:
+            b = snipers & -snipers
+            snipers ^= b
+            between = BETWEEN[kingSq][b.bit_length()-1]
+            blockers = between & occ
+            if blockers and not blockers & (blockers-1) and blockers & self.colorBitboards[us]:
+                pinRays[blockers.bit_length()-1] = between | b
+        return kingSq,attacked,checkMask,pinRays
+
+    '''
+    All moves considering checks, generated from the bitboards. Gives the same moves as the board walking generators
+    '''
+    def getBitboardMoves(self):
+        fromCode = Move.fromCode
+        return [fromCode(code) for code in self.generateMoves()]
+
+    '''
+    Legal moves as int codes (see encodeMove). ply picks one of the preallocated self.moveBuffers, which is cleared and
+    refilled, so the list is only valid until the next call for the same ply. With ply None a new list is returned.
+    kinds is CAPTURES (captures, en-passant and promotions), QUIETS (every other move) or ALL_MOVES,
+    the captures and quiets of one ply have their own buffers so a node can generate one after the other.
+    maps can pass the computeAttackMaps() result of this position when it is already known.
+    Only legal moves are emitted: targets are limited by the check mask, pinned pieces by their pin ray
+    and the king by the enemy attack map, so nothing has to be made and tested
+    '''
+    def generateMoves(self,ply=None,kinds=ALL_MOVES,maps=None):
+        if ply is None:
+            moves = []
+        else:
+            moves = self.moveBuffers[ply] if kinds != QUIETS else self.quietBuffers[ply]
+            moves.clear()
+        append = moves.append
+        kingSq,attacked,checkMask,pinRays = maps or self.computeAttackMaps()
+        bbs = self.pieceBitboards
+        occ = self.occupied
+        mailbox = self.mailbox
+        us = 0 if self.whiteToMove else 1
+        base = 6*us
+        enemy = self.colorBitboards[1-us]
+        empty = FULL ^ occ
+        if kinds == ALL_MOVES:
+            kindMask = FULL
+        else:
+            kindMask = enemy if kinds == CAPTURES else empty
+        targets = (FULL ^ self.colorBitboards[us]) & checkMask & kindMask
+        lastRank = ROWS[0] if us == 0 else ROWS[7]
+
+        if checkMask:
+            #pawns, generated set wise, delta takes the end square back to the start square.
+            #Pushes to the last rank are promotions, so they count as captures
+            pawns = bbs[base]
+            pawnCode = base << 12
+            if kinds == ALL_MOVES:
+                pushMask = FULL
+            else:
+                pushMask = lastRank if kinds == CAPTURES else FULL ^ lastRank
+            if us == 0:
+                single = (pawns >> 8) & empty
+                pawnSets = [(single & pushMask,8)]
+                if kinds & QUIETS:
+                    pawnSets.append((((single & ROWS[5]) >> 8) & empty,16))
+                if kinds & CAPTURES:
+                    pawnSets += ((((pawns & ~FILE_A) >> 9) & enemy,9),(((pawns & ~FILE_H) >> 7) & enemy,7))
+            else:
+                single = (pawns << 8) & empty
+                pawnSets = [(single & pushMask,-8)]
+                if kinds & QUIETS:
+                    pawnSets.append((((single & ROWS[2]) << 8) & empty,-16))
+                if kinds & CAPTURES:
+                    pawnSets += ((((pawns & ~FILE_A) << 7) & enemy,-7),(((pawns & ~FILE_H) << 9) & enemy,-9))
+            for ends,delta in pawnSets:
+                ends &= checkMask
+                while ends:
+                    b = ends & -ends
+                    ends ^= b
+                    end = b.bit_length() - 1
+                    start = end + delta
+                    if pinRays and start in pinRays and not b & pinRays[start]:
+                        continue
+                    code = start | end << 6 | pawnCode | mailbox[end] << 16
+                    if b & lastRank:
+                        for promotion in PROMOTION_OFFSETS:
+                            append(code | promotion << 20)
+                    else:
+                        append(code)
+            #en-passant, rare enough to test each capture on the occupancy after it
+            if self.enPassantSquare >= 0 and kinds & CAPTURES:
+                ep = self.enPassantSquare
+                capturers = PAWN_ATTACKS[1-us][ep] & pawns
+                while capturers:
+                    b = capturers & -capturers
+                    capturers ^= b
+                    start = b.bit_length() - 1
+                    if self.isEnPassantLegal(start):
+                        append(start | ep << 6 | pawnCode | (6-base) << 16 | MOVE_ENPASSANT)
+
+            #knights, bishops, rooks and queens
+            for offset in (1,2,3,4):
+                pieces = bbs[base+offset]
+                while pieces:
+                    b = pieces & -pieces
+                    pieces ^= b
+                    start = b.bit_length() - 1
+                    if offset == 1:
+                        if start in pinRays: #a pinned knight can never move
+                            continue
+                        attacks = KNIGHT_ATTACKS[start]
+                    elif offset == 2:
+                        attacks = DIAG_ATTACKS[start][occ & DIAG_MASK[start]] | ANTI_ATTACKS[start][occ & ANTI_MASK[start]]
+                    elif offset == 3:
+                        attacks = RANK_ATTACKS[start][occ & RANK_MASK[start]] | FILE_ATTACKS[start][occ & FILE_MASK[start]]
                     else:
-                        break#off board
-            #check for knight checks
-            knightMoves=((-2,-1),(-2,1),(-1,-2),(-1,2),(1,-2),(1,2),(2,-1),(2,1))
-            for m in knightMoves:
-                endRow=startRow+m[0]
-                endCol=startCol+m[1]
-                if 0<=endRow<8 and 0<=endCol<8:
-                    endPiece=self.board[endRow][endCol]
-                    if endPiece[0]==enemyColor and endPiece[1]=='N':#enemy knight attacking king
-                        inCheck=True
-                        checks.append((endRow,endCol,m[0],m[1]))
-            return inCheck,pins,checks
+                        attacks = (DIAG_ATTACKS[start][occ & DIAG_MASK[start]] | ANTI_ATTACKS[start][occ & ANTI_MASK[start]] |
+                                   RANK_ATTACKS[start][occ & RANK_MASK[start]] | FILE_ATTACKS[start][occ & FILE_MASK[start]])
+                    attacks &= targets
+                    if start in pinRays:
+                        attacks &= pinRays[start]
+                    startCode = start | (base+offset) << 12
+                    while attacks:
+                        a = attacks & -attacks
+                        attacks ^= a
+                        end = a.bit_length() - 1
+                        append(startCode | end << 6 | mailbox[end] << 16)
+
+        #king, any square the enemy doesn't attack
+        attacks = KING_ATTACKS[kingSq] & ~self.colorBitboards[us] & ~attacked & kindMask
+        startCode = kingSq | (base+5) << 12
+        while attacks:
+            a = attacks & -attacks
+            attacks ^= a
+            end = a.bit_length() - 1
+            append(startCode | end << 6 | mailbox[end] << 16)
+        #castling, the king can't castle out of, through or into check
+        if self.castlingRights and checkMask == FULL and kinds & QUIETS:
+            for right,kingStart,kingEnd,empty,safe in CASTLING_MOVES:
+                if self.castlingRights & right and kingStart == kingSq and not occ & empty and not attacked & safe:
+                    append(startCode | kingEnd << 6 | QUIET | MOVE_CASTLE)
+        return moves
+
+    '''
+    Is the move code legal in this position, for moves that come from elsewhere (the hash move, killer moves of
+    a sibling) and must be checked before they are made. maps is computeAttackMaps() of this position.
+    Plain moves are checked against the pieces, the attack tables and the legality maps, the rare special moves
+    by generating the moves of their kind
+    '''
+    def isMoveLegal(self,code,maps):
+        start = code & 63
+        end = code >> 6 & 63
+        moved = code >> 12 & 15
+        mailbox = self.mailbox
+        base = 0 if self.whiteToMove else 6
+        if mailbox[start] != moved or not base <= moved < base + 6:
+            return False
+        if code & (MOVE_ENPASSANT | MOVE_CASTLE | 7 << MOVE_PROMOTION_SHIFT):
+            return code in self.generateMoves(None,QUIETS if code & MOVE_CASTLE else CAPTURES,maps)
+        captured = code >> 16 & 15
+        if mailbox[end] != captured or base <= captured < base + 6:
+            return False
+        kingSq,attacked,checkMask,pinRays = maps
+        b = 1 << end
+        piece = moved - base
+        if piece == 5:
+            return bool(KING_ATTACKS[start] & b) and not attacked & b
+        if not checkMask & b or (start in pinRays and not pinRays[start] & b):
+            return False
+        occ = self.occupied
+        if piece == 0:
+            if b & (ROWS[0] | ROWS[7]): #would have to be a promotion
+                return False
+            if mailbox[end] != NO_PIECE:
+                return bool(PAWN_ATTACKS[0 if base == 0 else 1][start] & b)
+            step = -8 if base == 0 else 8
+            return end == start + step or (end == start + 2*step and start >> 3 == (6 if base == 0 else 1) and
+                                           not occ >> (start + step) & 1)
+        if piece == 1:
+            attacks = KNIGHT_ATTACKS[start]
+        elif piece == 2:
+            attacks = DIAG_ATTACKS[start][occ & DIAG_MASK[start]] | ANTI_ATTACKS[start][occ & ANTI_MASK[start]]
+        elif piece == 3:
+            attacks = RANK_ATTACKS[start][occ & RANK_MASK[start]] | FILE_ATTACKS[start][occ & FILE_MASK[start]]
+        else:
+            attacks = (DIAG_ATTACKS[start][occ & DIAG_MASK[start]] | ANTI_ATTACKS[start][occ & ANTI_MASK[start]] |
+                       RANK_ATTACKS[start][occ & RANK_MASK[start]] | FILE_ATTACKS[start][occ & FILE_MASK[start]])
+        return bool(attacks & b)
 
 class Move():
     # maps keys to values
@@ -347,16 +927,54 @@ class Move():
     filesToCols ={'a':0,'b':1,'c':2,'d':3,
                   'e':4,'f':5,'g':6,'h':7}
     colsToFile = {v:k for k,v in filesToCols.items()}
+    #slots keep moves small, they are only built at the API boundary (getValidMoves, notation), search and perft use the int code
+    __slots__ = ('startRow','startCol','endRow','endCol','pieceMoved','pieceCaptured','isPawnPromotion','promotionPiece',
+                 'isEnpassantMove','isCastleMove','moveID','code')
 
-    def __init__(self,startSq,endSq,board):
+    '''
+    promotionPiece is the piece type a pawn reaching the last rank becomes, queen unless told otherwise.
+    En-passant and castling are recognised from the board: a pawn moving diagonally to an empty square, a king moving two columns
+    '''
+    def __init__(self,startSq,endSq,board,promotionPiece='Q'):
         self.startRow = startSq[0]
         self.startCol = startSq[1]
         self.endRow = endSq[0]
         self.endCol = endSq[1]
         self.pieceMoved = board[self.startRow][self.startCol]
         self.pieceCaptured = board[self.endRow][self.endCol]
-        self.moveID = self.startRow * 1000 + self.startCol *100 + self.endRow*10 + self.endCol
-    
+        isPawn = self.pieceMoved[1] == 'P'
+        self.isPawnPromotion = isPawn and (self.endRow == 0 or self.endRow == 7)
+        self.promotionPiece = promotionPiece if self.isPawnPromotion else None
+        self.isEnpassantMove = isPawn and self.startCol != self.endCol and self.pieceCaptured == '--'
+        if self.isEnpassantMove:
+            self.pieceCaptured = 'bP' if self.pieceMoved == 'wP' else 'wP'
+        self.isCastleMove = self.pieceMoved[1] == 'K' and abs(self.endCol - self.startCol) == 2
+        promotion = PROMOTION_PIECES.index(promotionPiece) if self.isPawnPromotion else 0
+        self.moveID = promotion*10000 + self.startRow * 1000 + self.startCol *100 + self.endRow*10 + self.endCol
+        self.code = encodeMove(self.startRow*8+self.startCol,self.endRow*8+self.endCol,PIECE_INDEX.get(self.pieceMoved,NO_PIECE),
+                               PIECE_INDEX.get(self.pieceCaptured,NO_PIECE),promotion,
+                               (MOVE_ENPASSANT if self.isEnpassantMove else 0) | (MOVE_CASTLE if self.isCastleMove else 0))
+
+    '''
+    Build a Move from an int move code without looking at a board
+    '''
+    @classmethod
+    def fromCode(cls,code):
+        move = cls.__new__(cls)
+        move.startRow,move.startCol = SQUARES[code & 63]
+        move.endRow,move.endCol = SQUARES[code >> 6 & 63]
+        move.pieceMoved = PIECES[code >> 12 & 15]
+        captured = code >> 16 & 15
+        move.pieceCaptured = PIECES[captured] if captured != NO_PIECE else '--'
+        promotion = code >> 20 & 7
+        move.isPawnPromotion = promotion != 0
+        move.promotionPiece = PROMOTION_PIECES[promotion] if promotion else None
+        move.isEnpassantMove = bool(code & MOVE_ENPASSANT)
+        move.isCastleMove = bool(code & MOVE_CASTLE)
+        move.moveID = promotion*10000 + move.startRow * 1000 + move.startCol *100 + move.endRow*10 + move.endCol
+        move.code = code
+        return move
+
     '''
     Overriding the equals method
     '''
@@ -365,8 +983,15 @@ class Move():
             return self.moveID == other.moveID
         return False
 
+    '''
+    Equal moves must hash equal, so hash the same moveID __eq__ compares
+    '''
+    def __hash__(self):
+        return self.moveID
+
     def getChessNotation(self):
-        return self.getRankFile(self.startRow,self.startCol) + self.getRankFile(self.endRow,self.endCol)
+        notation = self.getRankFile(self.startRow,self.startCol) + self.getRankFile(self.endRow,self.endCol)
+        return notation + self.promotionPiece.lower() if self.isPawnPromotion else notation
 
     def getRankFile(self,r,c):
         return self.colsToFile[c] + self.rowToRanks[r]
@@ -0,0 +1,270 @@
+'''
+Static evaluation for the search. Material and tapered middlegame/endgame piece-square scores are kept up to date by
+GameState.pushMove/popMove (mgScore, egScore, phase), pawn structure is cached by pawn hash key (GameState.pawnKey),
+so evaluating a leaf is a few reads and one cache probe instead of a scan of the board.
+evaluateFull recomputes everything from GameState.board, an Evaluator built with verify=True checks every
+evaluation against it.
+
+Usage:
+    python ChessEval.py --games 200          verify incremental against full evaluation over random games
+'''
+import argparse
+import random
+import sys
+import time
+
+from ChessBitboard import FILE_A
+
+MAX_PHASE = 24 #all minor pieces, rooks and queens on the board, the middlegame end of the taper
+PHASE_WEIGHTS = [0,1,1,2,4,0]*2 #per piece in ChessEngine.PIECES order
+MG_VALUES = (100,320,330,500,900,0) #pawn, knight, bishop, rook, queen, king
+EG_VALUES = (120,300,320,520,940,0)
+
+#piece-square tables from white's side, laid out like GameState.board (first row is the 8th rank). Black uses the mirror image
+_PAWN = (
+      0,  0,  0,  0,  0,  0,  0,  0,
+     50, 50, 50, 50, 50, 50, 50, 50,
+     10, 10, 20, 30, 30, 20, 10, 10,
+      5,  5, 10, 25, 25, 10,  5,  5,
+      0,  0,  0, 20, 20,  0,  0,  0,
+      5, -5,-10,  0,  0,-10, -5,  5,
+      5, 10, 10,-20,-20, 10, 10,  5,
+      0,  0,  0,  0,  0,  0,  0,  0)
+_PAWN_ENDGAME = tuple(value for row in (0,40,25,15,8,3,0,0) for value in [row]*8) #just the distance run
+_KNIGHT = (
+    -50,-40,-30,-30,-30,-30,-40,-50,
+    -40,-20,  0,  0,  0,  0,-20,-40,
+    -30,  0, 10, 15, 15, 10,  0,-30,
+    -30,  5, 15, 20, 20, 15,  5,-30,
+    -30,  0, 15, 20, 20, 15,  0,-30,
+    -30,  5, 10, 15, 15, 10,  5,-30,
+    -40,-20,  0,  5,  5,  0,-20,-40,
+    -50,-40,-30,-30,-30,-30,-40,-50)
+_BISHOP = (
+    -20,-10,-10,-10,-10,-10,-10,-20,
+    -10,  0,  0,  0,  0,  0,  0,-10,
+    -10,  0,  5, 10, 10,  5,  0,-10,
+    -10,  5,  5, 10, 10,  5,  5,-10,
+    -10,  0, 10, 10, 10, 10,  0,-10,
+    -10, 10, 10, 10, 10, 10, 10,-10,
+    -10,  5,  0,  0,  0,  0,  5,-10,
+    -20,-10,-10,-10,-10,-10,-10,-20)
+_ROOK = (
+      0,  0,  0,  0,  0,  0,  0,  0,
+      5, 10, 10, 10, 10, 10, 10,  5,
+     -5,  0,  0,  0,  0,  0,  0, -5,
+     -5,  0,  0,  0,  0,  0,  0, -5,
+     -5,  0,  0,  0,  0,  0,  0, -5,
+     -5,  0,  0,  0,  0,  0,  0, -5,
+     -5,  0,  0,  0,  0,  0,  0, -5,
+      0,  0,  0,  5,  5,  0,  0,  0)
+_QUEEN = (
+    -20,-10,-10, -5, -5,-10,-10,-20,
+    -10,  0,  0,  0,  0,  0,  0,-10,
+    -10,  0,  5,  5,  5,  5,  0,-10,
+     -5,  0,  5,  5,  5,  5,  0, -5,
+      0,  0,  5,  5,  5,  5,  0, -5,
+    -10,  5,  5,  5,  5,  5,  0,-10,
+    -10,  0,  5,  0,  0,  0,  0,-10,
+    -20,-10,-10, -5, -5,-10,-10,-20)
+_KING = (
+    -30,-40,-40,-50,-50,-40,-40,-30,
+    -30,-40,-40,-50,-50,-40,-40,-30,
+    -30,-40,-40,-50,-50,-40,-40,-30,
+    -30,-40,-40,-50,-50,-40,-40,-30,
+    -20,-30,-30,-40,-40,-30,-30,-20,
+    -10,-20,-20,-20,-20,-20,-20,-10,
+     20, 20,  0,  0,  0,  0, 20, 20,
+     20, 30, 10,  0,  0, 10, 30, 20)
+_KING_ENDGAME = (
+    -50,-40,-30,-20,-20,-30,-40,-50,
+    -30,-20,-10,  0,  0,-10,-20,-30,
+    -30,-10, 20, 30, 30, 20,-10,-30,
+    -30,-10, 30, 40, 40, 30,-10,-30,
+    -30,-10, 30, 40, 40, 30,-10,-30,
+    -30,-10, 20, 30, 30, 20,-10,-30,
+    -30,-30,  0,  0,  0,  0,-30,-30,
+    -50,-30,-30,-30,-30,-30,-30,-50)
+
+'''
+Signed value plus table entry of every piece on every square, white positive, in ChessEngine.PIECES order
+'''
+def _signedTables(values,tables):
+    signed = []
+    for sign in (1,-1):
+        for value,table in zip(values,tables):
+            signed.append([sign*(value + table[sq if sign == 1 else sq ^ 56]) for sq in range(64)])
+    return signed
+
+PST_MG = _signedTables(MG_VALUES,(_PAWN,_KNIGHT,_BISHOP,_ROOK,_QUEEN,_KING))
+PST_EG = _signedTables(EG_VALUES,(_PAWN_ENDGAME,_KNIGHT,_BISHOP,_ROOK,_QUEEN,_KING_ENDGAME))
+
+#pawn structure, (middlegame, endgame) per pawn
+DOUBLED = (-10,-20) #for every pawn after the first on a file
+ISOLATED = (-15,-10) #no friendly pawn on a neighbouring file
+PASSED_MG = (0,5,10,20,35,60,0,0) #passed pawn by rows advanced from its starting row
+PASSED_EG = (0,10,20,40,70,120,0,0)
+
+FILE_MASKS = [FILE_A << c for c in range(8)]
+NEIGHBOUR_FILES = [(FILE_MASKS[c-1] if c > 0 else 0) | (FILE_MASKS[c+1] if c < 7 else 0) for c in range(8)]
+#PASSED_MASKS[color][sq] are the squares in front of a pawn on its own and the neighbouring files, no enemy pawn there means passed
+PASSED_MASKS = [[0]*64,[0]*64]
+for _sq in range(64):
+    _r,_c = divmod(_sq,8)
+    _files = FILE_MASKS[_c] | NEIGHBOUR_FILES[_c]
+    PASSED_MASKS[0][_sq] = _files & ((1 << (_r*8)) - 1) #rows above, towards the 8th rank
+    PASSED_MASKS[1][_sq] = _files & ~((1 << ((_r+1)*8)) - 1) & ((1 << 64) - 1)
+
+'''
+(middlegame, endgame) pawn structure score, white minus black, from the two pawn bitboards
+'''
+def pawnStructure(whitePawns,blackPawns):
+    mg = eg = 0
+    for color,pawns,enemy in ((0,whitePawns,blackPawns),(1,blackPawns,whitePawns)):
+        sign = 1 if color == 0 else -1
+        for c in range(8):
+            onFile = (pawns & FILE_MASKS[c]).bit_count()
+            if onFile > 1:
+                mg += sign*DOUBLED[0]*(onFile-1)
+                eg += sign*DOUBLED[1]*(onFile-1)
+            if onFile and not pawns & NEIGHBOUR_FILES[c]:
+                mg += sign*ISOLATED[0]*onFile
+                eg += sign*ISOLATED[1]*onFile
+        bb = pawns
+        while bb:
+            b = bb & -bb
+            bb ^= b
+            sq = b.bit_length() - 1
+            if not PASSED_MASKS[color][sq] & enemy:
+                advanced = 6 - (sq >> 3) if color == 0 else (sq >> 3) - 1
+                mg += sign*PASSED_MG[advanced]
+                eg += sign*PASSED_EG[advanced]
+    return mg,eg
+
+def taper(mg,eg,phase):
+    if phase > MAX_PHASE: #early promotions
+        phase = MAX_PHASE
+    return (mg*phase + eg*(MAX_PHASE-phase)) // MAX_PHASE
+
+_BOARD_INDEX = {color+piece:i for i,(color,piece) in enumerate((c,p) for c in 'wb' for p in 'PNBRQK')}
+
+'''
+(mgScore, egScore, phase) from a GameState.board, the values pushMove/popMove keep up to date
+'''
+def evalTerms(board):
+    mg = eg = phase = 0
+    for r in range(8):
+        for c in range(8):
+            piece = board[r][c]
+            if piece != '--':
+                i = _BOARD_INDEX[piece]
+                mg += PST_MG[i][r*8+c]
+                eg += PST_EG[i][r*8+c]
+                phase += PHASE_WEIGHTS[i]
+    return mg,eg,phase
+
+'''
+Evaluation in centipawns for the side to move computed from scratch from gs.board, no incremental state or cache involved
+'''
+def evaluateFull(gs):
+    mg,eg,phase = evalTerms(gs.board)
+    whitePawns = blackPawns = 0
+    for r in range(8):
+        for c in range(8):
+            if gs.board[r][c] == 'wP':
+                whitePawns |= 1 << (r*8+c)
+            elif gs.board[r][c] == 'bP':
+                blackPawns |= 1 << (r*8+c)
+    pawnMg,pawnEg = pawnStructure(whitePawns,blackPawns)
+    score = taper(mg+pawnMg,eg+pawnEg,phase)
+    return score if gs.whiteToMove else -score
+
+class Evaluator():
+    '''
+    Evaluates positions from the incremental scores of a GameState and a pawn structure cache of pawnTableSize entries
+    (rounded down to a power of two). With verify set every result is checked against evaluateFull, and the
+    incremental terms against evalTerms, a mismatch raises RuntimeError
+    '''
+    def __init__(self,pawnTableSize=1 << 14,verify=False):
+        bits = max(pawnTableSize,1).bit_length() - 1
+        self.mask = (1 << bits) - 1
+        self.pawnTable = [None]*(1 << bits)
+        self.verify = verify
+        self.probes = 0
+        self.hits = 0
+
+    '''
+    Centipawns from the point of view of the side to move
+    '''
+    def evaluate(self,gs):
+        key = gs.pawnKey
+        self.probes += 1
+        entry = self.pawnTable[key & self.mask]
+        if entry is not None and entry[0] == key:
+            self.hits += 1
+            pawnMg,pawnEg = entry[1],entry[2]
+        else:
+            pawnMg,pawnEg = pawnStructure(gs.pieceBitboards[0],gs.pieceBitboards[6])
+            self.pawnTable[key & self.mask] = (key,pawnMg,pawnEg)
+        score = taper(gs.mgScore+pawnMg,gs.egScore+pawnEg,gs.phase)
+        if not gs.whiteToMove:
+            score = -score
+        if self.verify:
+            self.check(gs,score)
+        return score
+
+    def check(self,gs,score):
+        terms = evalTerms(gs.board)
+        if terms != (gs.mgScore,gs.egScore,gs.phase):
+            raise RuntimeError('incremental evaluation terms %r differ from %r in %s' % (
+                (gs.mgScore,gs.egScore,gs.phase),terms,gs.getFen()))
+        full = evaluateFull(gs)
+        if full != score:
+            raise RuntimeError('evaluation %d differs from full evaluation %d in %s' % (score,full,gs.getFen()))
+
+def main(argv=None):
+    import ChessEngine
+    parser = argparse.ArgumentParser(description='Check the incremental evaluation against a full evaluation')
+    parser.add_argument('--games',type=int,default=100,help='random games to play through')
+    parser.add_argument('--plies',type=int,default=200)
+    parser.add_argument('--seed',type=int,default=1)
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    evaluator = Evaluator(verify=True)
+    positions = 0
+    for game in range(args.games):
+        gs = ChessEngine.GameState()
+        for ply in range(args.plies):
+            evaluator.evaluate(gs)
+            positions += 1
+            moves = gs.generateMoves()
+            if not moves:
+                break
+            gs.pushMove(rng.choice(moves))
+        while gs.moveStack: #unwinding has to give the same scores back
+            gs.popMove()
+            evaluator.evaluate(gs)
+            positions += 1
+    print('verified %d positions, pawn cache hits %d / %d' % (positions,evaluator.hits,evaluator.probes))
+
+    states = []
+    gs = ChessEngine.GameState()
+    for ply in range(40):
+        moves = gs.generateMoves()
+        if not moves:
+            break
+        gs.pushMove(rng.choice(moves))
+        states.append(ChessEngine.GameState.fromSnapshot(gs.snapshot()))
+    fast = Evaluator()
+    for label,function in (('incremental',fast.evaluate),('full',evaluateFull)):
+        start = time.perf_counter()
+        for repeat in range(200):
+            for state in states:
+                function(state)
+        seconds = time.perf_counter() - start
+        print('%-12s %d evaluations/s' % (label,200*len(states)/seconds))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,11 +1,23 @@
+import os
 import pygame as p
+import ChessBook
 import ChessEngine
+import ChessSearch
+import ChessTablebase
+import ChessWorker
 
 WIDTH = HEIGHT = 512 #400 is another option can play around 
 DIMENSION = 8
 SQ_SIZE = HEIGHT // DIMENSION
 MAX_FPS = 15
 IMAGES = {}
+HUMAN_PLAYS_WHITE = True
+HUMAN_PLAYS_BLACK = False #the engine plays the sides no human plays
+ENGINE_TIME = 2.0 #seconds per engine move
+PONDER = True #let the engine think on the human's time
+ENGINE_EVENT = p.USEREVENT #results from the engine worker thread, see ChessWorker.EngineWorker
+BOOK_FILE = 'book.bin' #opening book the engine plays from when the file exists, build it with ChessBook.py
+TABLEBASE_DIR = 'tablebases' #endgame tablebases the engine plays from when the directory exists, see ChessTablebase.py
 
 '''
 Initialize a global dictionay of images. This will be called esactly once in main
@@ -16,26 +28,42 @@ def loadImages():
         IMAGES[piece]=p.transform.scale(p.image.load("images/"+piece+".png"),(SQ_SIZE,SQ_SIZE))
 
 '''
-The main driver for our code. This will handle user input and updating the graphics
+The main driver for our code. This will handle user input and updating the graphics.
+Nothing is drawn while nothing happens: the loop sleeps in p.event.wait, and after an event only the squares that
+changed (move from/to, castling rook, en-passant pawn, selection highlight) are redrawn and pushed with display.update.
+The engine runs in a ChessWorker thread, legal moves, search info and engine moves arrive as ENGINE_EVENTs
+so the loop never waits for it
 '''
 
 def main():
     p.init()
     screen=p.display.set_mode((WIDTH,HEIGHT))
     clock=p.time.Clock()
-    screen.fill(p.Color("white"))
+    #only wake up for the events handled below, mouse motion would otherwise keep the loop busy
+    p.event.set_blocked(None)
+    p.event.set_allowed([p.QUIT,p.MOUSEBUTTONDOWN,p.KEYDOWN,p.VIDEOEXPOSE,p.WINDOWEXPOSED,ENGINE_EVENT])
     gs=ChessEngine.GameState()
-    validMoves = gs.getValidMoves()
+    book = ChessBook.OpeningBook(BOOK_FILE) if os.path.exists(BOOK_FILE) else None
+    tablebases = ChessTablebase.Tablebases(TABLEBASE_DIR) if os.path.isdir(TABLEBASE_DIR) else None
+    worker = ChessWorker.EngineWorker(lambda kind,data: p.event.post(p.event.Event(ENGINE_EVENT,kind=kind,**data)),
+                                      book=book,tablebases=tablebases).start()
+    validMoves = [] #filled in by the worker, no move is accepted until they arrive
+    requestId = postPosition(worker,gs)
     moveMade = False
+    status = '' #game result or what the engine is thinking
 
     loadImages()
+    boardSurface = p.Surface((WIDTH,HEIGHT)) #the empty board never changes, draw it once and copy squares from it
+    drawBoard(boardSurface)
     running = True
     sqSelected = () #(row,col)
     playerClicks = [] #keep track of player clicks, 2 tuples
-    p.display.set_caption('Chess Game')
+    dirty = set() #squares to redraw
+    fullRedraw = True
+    caption = ''
 
     while running:
-        for e in p.event.get():
+        for e in [p.event.wait()] + p.event.get(): #block until something happens, then take everything queued
             if e.type == p.QUIT:
                 running = False
             #mouse handler
@@ -43,52 +71,134 @@ def main():
                 location = p.mouse.get_pos() #(x,y) location of mouse
                 col = location[0]//SQ_SIZE
                 row = location[1]//SQ_SIZE
+                if sqSelected:
+                    dirty.add(sqSelected) #clear the old highlight
                 if sqSelected == (row,col): #user clicked same square twice
                     sqSelected=()#unselect it
                     playerClicks=[]
                 else:
                     sqSelected=(row,col)
                     playerClicks.append(sqSelected)
+                    dirty.add(sqSelected)
                 if len(playerClicks) == 2:
                     move = ChessEngine.Move(playerClicks[0],playerClicks[1],gs.board)
-                    if move in validMoves:
+                    if move in validMoves and isHumanTurn(gs):
+                        before = [row[:] for row in gs.board]
                         gs.makeMove(move)
+                        dirty.update(changedSquares(before,gs.board))
                         moveMade = True
+                        requestId = None #engine events still queued in this batch belong to the old position
+                        validMoves = []
                         sqSelected = () #reset moves
                         playerClicks=[]
                     else:
-                        ('not valid moves')
-                        playerClicks=[sqSelected]
-                p.display.set_caption('Turn: '+playerturn+' Piece Selected: '+pieceSelected)
+                        playerClicks=[sqSelected] #not a valid move, the second click starts a new selection
 
             #keyboard handler
             elif e.type == p.KEYDOWN:
                 if e.key==p.K_z:
+                    worker.cancel() #stop any search of the position being taken back
+                    before = [row[:] for row in gs.board]
                     gs.undoMove()
+                    if not isHumanTurn(gs) and gs.moveLog: #take back the engine's reply too, not just the human move
+                        gs.undoMove()
+                    dirty.update(changedSquares(before,gs.board))
                     moveMade = True
-            playerturn='White' if gs.whiteToMove else 'Black'
-            if sqSelected:
-                pieceSelected = str(sqSelected[0])
-            else:
-                pieceSelected = 'None'
+                    requestId = None
+                    validMoves = []
+            #engine worker results, anything for an older position is stale
+            elif e.type == ENGINE_EVENT and e.requestId == requestId:
+                if e.kind == 'moves':
+                    validMoves = e.moves
+                    status = ('Checkmate' if e.inCheck else 'Stalemate') if not validMoves else ''
+                elif e.kind == 'info':
+                    iteration = e.iteration
+                    status = '%s depth %d %s' % ('pondering' if e.ponder else 'thinking',iteration['depth'],
+                                                 ChessSearch.formatScore(iteration['score']))
+                elif e.kind == 'bestmove' and e.move in validMoves and not isHumanTurn(gs):
+                    before = [row[:] for row in gs.board]
+                    gs.makeMove(e.move)
+                    dirty.update(changedSquares(before,gs.board))
+                    moveMade = True
+                    requestId = None
+                    validMoves = []
+            #window uncovered or restored, what was on screen is gone
+            elif e.type in (p.VIDEOEXPOSE,p.WINDOWEXPOSED):
+                fullRedraw = True
 
         if moveMade:
-            validMoves = gs.getValidMoves()
+            validMoves = []
+            status = ''
+            requestId = postPosition(worker,gs)
             moveMade = False
 
-        drawGameState(screen,gs)
-        if sqSelected:
-            p.draw.rect(screen,'red',p.Rect(sqSelected[1]*SQ_SIZE,sqSelected[0]*SQ_SIZE,SQ_SIZE,SQ_SIZE),1)
-        clock.tick(MAX_FPS)
-        p.display.flip()
+        playerturn='White' if gs.whiteToMove else 'Black'
+        pieceSelected = str(sqSelected[0]) if sqSelected else 'None'
+        newCaption = 'Turn: '+playerturn+' Piece Selected: '+pieceSelected+(' '+status if status else '')
+        if newCaption != caption:
+            caption = newCaption
+            p.display.set_caption(caption)
+
+        if fullRedraw:
+            drawGameState(screen,gs,boardSurface,sqSelected)
+            p.display.flip()
+            fullRedraw = False
+        elif dirty:
+            p.display.update(drawSquares(screen,boardSurface,gs.board,dirty,sqSelected))
+        dirty.clear()
+        clock.tick(MAX_FPS) #caps the redraw rate when events pour in, costs nothing while waiting
+    worker.close()
+
+def isHumanTurn(gs):
+    return HUMAN_PLAYS_WHITE if gs.whiteToMove else HUMAN_PLAYS_BLACK
+
+'''
+Send the current position to the engine worker: it searches when the engine is to move and ponders on the human's time
+in games against the engine. Returns the request id its events will carry
+'''
+def postPosition(worker,gs):
+    if not isHumanTurn(gs):
+        mode = ChessWorker.SEARCH
+    elif PONDER and not (HUMAN_PLAYS_WHITE and HUMAN_PLAYS_BLACK):
+        mode = ChessWorker.PONDER
+    else:
+        mode = ChessWorker.NO_SEARCH
+    return worker.analyze(gs,mode,timeLimit=ENGINE_TIME)
+
+'''
+Squares whose piece differs between two boards, covers castling, en-passant and promotion without special cases
+'''
+def changedSquares(before,after):
+    return [(r,c) for r in range(DIMENSION) for c in range(DIMENSION) if before[r][c] != after[r][c]]
 
 '''
 Responsible for all the graphics within a current game state.
 '''
-def drawGameState(screen,gs):
+def drawGameState(screen,gs,boardSurface,sqSelected=()):
     ##Order matters, board should be draw first then pieces
-    drawBoard(screen) #draw squares on the board
+    screen.blit(boardSurface,(0,0)) #draw squares on the board
     drawPieces(screen,gs.board) #draw piece
+    if sqSelected:
+        drawHighlight(screen,sqSelected)
+
+'''
+Redraw only the given squares (board square, piece and highlight) and return their rects for display.update
+'''
+def drawSquares(screen,boardSurface,board,squares,sqSelected=()):
+    rects = []
+    for r,c in squares:
+        rect = p.Rect(c*SQ_SIZE,r*SQ_SIZE,SQ_SIZE,SQ_SIZE)
+        screen.blit(boardSurface,rect,rect)
+        piece = board[r][c]
+        if piece != "--":
+            screen.blit(IMAGES[piece],rect)
+        if sqSelected == (r,c):
+            drawHighlight(screen,sqSelected)
+        rects.append(rect)
+    return rects
+
+def drawHighlight(screen,sqSelected):
+    p.draw.rect(screen,'red',p.Rect(sqSelected[1]*SQ_SIZE,sqSelected[0]*SQ_SIZE,SQ_SIZE,SQ_SIZE),1)
 
 '''
 Draw the squares on the board. The top left square is always light.
@@ -110,4 +220,4 @@ def drawPieces(screen,board):
                 screen.blit(IMAGES[piece],p.Rect(c*SQ_SIZE,r*SQ_SIZE,SQ_SIZE,SQ_SIZE))
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,156 @@
+'''
+PGN reading and SAN (standard algebraic notation) for ChessEngine.
+readGames streams games out of a text file one at a time so a collection of any size can be read in constant memory,
+parseSan/toSan convert between SAN strings and Move objects for a GameState, formatGame writes a game back out.
+'''
+import re
+
+RESULTS = ('1-0','0-1','1/2-1/2','*')
+_TAG = re.compile(r'^\[(\w+)\s+"(.*)"\]\s*$')
+_TOKEN = re.compile(r'[{}()]|;.*|[^\s{}();]+')
+_MOVE_NUMBER = re.compile(r'^\d+\.+')
+_SAN = re.compile(r'^([NBRQK])?([a-h])?([1-8])?(x)?([a-h][1-8])(?:=?([NBRQ]))?$')
+
+'''
+Yields (headers, sanMoves, result) for every game in a text stream (an open file, sys.stdin or any iterable of lines).
+Comments, variations and NAGs are skipped, only the mainline moves are returned
+'''
+def readGames(stream):
+    headers = {}
+    moves = []
+    commentOpen = False
+    variationDepth = 0
+    for line in stream:
+        line = line.strip()
+        if not commentOpen and line.startswith('['):
+            match = _TAG.match(line)
+            if match:
+                if moves: #new game started without a result token
+                    yield headers,moves,'*'
+                    headers,moves,variationDepth = {},[],0
+                headers[match.group(1)] = match.group(2)
+                continue
+        for token in _TOKEN.findall(line):
+            if commentOpen:
+                if token == '}':
+                    commentOpen = False
+                continue
+            if token == '{':
+                commentOpen = True
+            elif token[0] == ';':
+                break #rest of line comment
+            elif token == '(':
+                variationDepth += 1
+            elif token == ')':
+                variationDepth = max(variationDepth-1,0)
+            elif variationDepth or token[0] == '$':
+                continue
+            elif token in RESULTS:
+                yield headers,moves,token
+                headers,moves,variationDepth = {},[],0
+            else:
+                token = _MOVE_NUMBER.sub('',token)
+                if token:
+                    moves.append(token)
+    if moves or headers:
+        yield headers,moves,'*'
+
+'''
+Find the legal move of gs written as san. moves can pass gs.getValidMoves() if it is already known.
+Raises ValueError if the move is malformed, illegal or ambiguous
+'''
+def parseSan(gs,san,moves=None):
+    if moves is None:
+        moves = gs.getValidMoves()
+    text = san.rstrip('+#!?')
+    if text in ('O-O','0-0','O-O-O','0-0-0'):
+        endCol = 6 if len(text) == 3 else 2
+        matches = [move for move in moves if move.isCastleMove and move.endCol == endCol]
+    else:
+        match = _SAN.match(text)
+        if not match:
+            raise ValueError('malformed SAN move %r' % san)
+        piece,fromFile,fromRank,capture,dest,promotion = match.groups()
+        piece = piece or 'P'
+        endCol = 'abcdefgh'.index(dest[0])
+        endRow = 8 - int(dest[1])
+        matches = []
+        for move in moves:
+            if move.pieceMoved[1] != piece or move.endRow != endRow or move.endCol != endCol:
+                continue
+            if fromFile and move.startCol != 'abcdefgh'.index(fromFile):
+                continue
+            if fromRank and move.startRow != 8 - int(fromRank):
+                continue
+            if move.promotionPiece != promotion:
+                continue
+            matches.append(move)
+    if len(matches) != 1:
+        raise ValueError('%s SAN move %r' % ('illegal' if not matches else 'ambiguous',san))
+    return matches[0]
+
+'''
+SAN string of a legal move of gs, including the check/mate suffix
+'''
+def toSan(gs,move,moves=None):
+    if moves is None:
+        moves = gs.getValidMoves()
+    dest = move.getRankFile(move.endRow,move.endCol)
+    piece = move.pieceMoved[1]
+    if move.isCastleMove:
+        san = 'O-O' if move.endCol == 6 else 'O-O-O'
+    elif piece == 'P':
+        san = (move.colsToFile[move.startCol] + 'x' + dest) if move.startCol != move.endCol else dest
+        if move.isPawnPromotion:
+            san += '=' + move.promotionPiece
+    else:
+        others = [m for m in moves if m.pieceMoved == move.pieceMoved and m.endRow == move.endRow and
+                  m.endCol == move.endCol and m != move]
+        disambiguation = ''
+        if others:
+            if all(m.startCol != move.startCol for m in others):
+                disambiguation = move.colsToFile[move.startCol]
+            elif all(m.startRow != move.startRow for m in others):
+                disambiguation = move.rowToRanks[move.startRow]
+            else:
+                disambiguation = move.getRankFile(move.startRow,move.startCol)
+        san = piece + disambiguation + ('x' if move.pieceCaptured != '--' else '') + dest
+    gs.makeMove(move)
+    replies = gs.getValidMoves()
+    if gs.inCheck:
+        san += '#' if not replies else '+'
+    gs.undoMove()
+    return san
+
+'''
+PGN text of one game, ending in a blank line. headers is an ordered mapping of tag -> value (the seven tag roster first),
+comments an optional list with a comment or None for every move. Movetext is wrapped at 80 columns
+'''
+def formatGame(headers,sanMoves,result,comments=None,whiteFirst=True,firstMove=1):
+    lines = ['[%s "%s"]' % (tag,str(value).replace('\\','\\\\').replace('"','\\"')) for tag,value in headers.items()]
+    tokens = []
+    number = firstMove
+    white = whiteFirst
+    for i,san in enumerate(sanMoves):
+        if white:
+            tokens.append('%d.' % number)
+        elif i == 0:
+            tokens.append('%d...' % number)
+        tokens.append(san)
+        comment = comments[i] if comments else None
+        if comment:
+            tokens.append('{%s}' % comment.replace('}',')'))
+        if not white:
+            number += 1
+        white = not white
+    tokens.append(result)
+    text = ''
+    movetext = []
+    for token in tokens:
+        if text and len(text) + 1 + len(token) > 80:
+            movetext.append(text)
+            text = token
+        else:
+            text = text + ' ' + token if text else token
+    movetext.append(text)
+    return '\n'.join(lines) + '\n\n' + '\n'.join(movetext) + '\n\n'
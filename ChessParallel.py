@@ -0,0 +1,226 @@
+'''
+Multi-process perft and search. The work below the root is split into independent subtrees that run in a
+concurrent.futures process pool, each worker gets a compact GameState.snapshot instead of a pickled GameState.
+Results are merged in a fixed order so the output doesn't depend on which worker finishes first.
+
+Usage:
+    python ChessParallel.py perft 5 --workers 8
+    python ChessParallel.py search --depth 5 --workers 8 --serial
+--serial also runs the single process version and prints the speedup.
+'''
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import ChessEngine
+import ChessPerft
+import ChessSearch
+from ChessEngine import START_FEN
+
+'''
+Worker side of parallelPerft, returns the perft count below a snapshot
+'''
+def _perftTask(snapshot,depth):
+    return ChessPerft.perft(ChessEngine.GameState.fromSnapshot(snapshot),depth)
+
+'''
+Expand the tree from gs until there are at least minTasks subtrees or splitting further would reach the leaves.
+Returns (root move code, snapshot, remaining depth) tasks in generation order
+'''
+def _splitPerft(gs,depth,minTasks):
+    paths = [[code] for code in gs.generateMoves()] #moves from the root to each subtree
+    while len(paths) < minTasks and depth - len(paths[0]) > 1:
+        expanded = []
+        for path in paths:
+            for code in path:
+                gs.pushMove(code)
+            expanded.extend(path + [child] for child in gs.generateMoves())
+            for code in path:
+                gs.popMove()
+        paths = expanded
+        if not paths:
+            break
+    tasks = []
+    for path in paths:
+        for code in path:
+            gs.pushMove(code)
+        tasks.append((path[0],gs.snapshot(),depth-len(path)))
+        for code in path:
+            gs.popMove()
+    return tasks
+
+'''
+Perft of gs split across a process pool. Returns (nodes, divide) where divide is a list of (move notation, nodes)
+sorted by notation. workers defaults to the number of cores
+'''
+def parallelPerft(gs,depth,workers=None,pool=None):
+    workers = workers or os.cpu_count() or 1
+    if depth <= 1:
+        moves = gs.getValidMoves() if depth == 1 else []
+        return (len(moves) if depth == 1 else 1),sorted((move.getChessNotation(),1) for move in moves)
+    tasks = _splitPerft(gs,depth,workers*8) #several tasks per worker evens out subtrees of different sizes
+    ownPool = pool is None
+    if ownPool:
+        pool = ProcessPoolExecutor(workers)
+    try:
+        counts = pool.map(_perftTask,[task[1] for task in tasks],[task[2] for task in tasks],
+                          chunksize=max(1,len(tasks)//(workers*16)))
+        perMove = {}
+        for task,nodes in zip(tasks,counts):
+            perMove[task[0]] = perMove.get(task[0],0) + nodes
+    finally:
+        if ownPool:
+            pool.shutdown()
+    split = sorted((ChessEngine.Move.fromCode(code).getChessNotation(),nodes) for code,nodes in perMove.items())
+    return sum(nodes for _,nodes in split),split
+
+'''
+Worker side of parallelSearch, searches the position after one root move inside the window (alpha, beta).
+Returns (score, completed depth, nodes, principal variation codes) from the point of view of the side to move there
+'''
+def _searchTask(snapshot,depth,timeLimit,ttSize,alpha,beta):
+    gs = ChessEngine.GameState.fromSnapshot(snapshot)
+    searcher = ChessSearch.Searcher(ttSize) #fresh searcher so the result doesn't depend on which tasks ran before
+    result = searcher.search(gs,depth,timeLimit,alpha=alpha,beta=beta)
+    #the search also ends early when it finds a mate within the searched depth, only the budget makes it incomplete
+    timedOut = searcher.stopRequested or (searcher.deadline is not None and time.perf_counter() >= searcher.deadline)
+    completed = depth if result.bestMove is None or not timedOut else result.depth
+    return result.score,completed,result.nodes,[move.code for move in result.pv]
+
+'''
+Root scores are the negated child scores, mates are one ply further away seen from the root
+'''
+def _rootScore(childScore):
+    score = -childScore
+    if score > ChessSearch.MATE_BOUND:
+        return score - 1
+    if score < -ChessSearch.MATE_BOUND:
+        return score + 1
+    return score
+
+'''
+Root splitting search with young brothers wait: every iteration the best move of the previous one is searched first,
+then all other root moves are searched in parallel with a null window around its score, and only the moves that
+fail high are searched again with an open window. Ties go to the earlier move so the result is deterministic.
+Returns a ChessSearch.SearchResult, info is called after each completed iteration like Searcher.search
+'''
+def parallelSearch(gs,maxDepth=64,timeLimit=None,workers=None,ttSize=1 << 16,info=None,pool=None):
+    workers = workers or os.cpu_count() or 1
+    start = time.perf_counter()
+    deadline = start + timeLimit if timeLimit is not None else None
+    infinity = ChessSearch.INFINITY
+    result = ChessSearch.SearchResult()
+    rootMoves = list(gs.generateMoves())
+    if not rootMoves:
+        result.score = -ChessSearch.MATE_SCORE if gs.inCheck else 0
+        return result
+    result.bestMove = ChessEngine.Move.fromCode(rootMoves[0])
+    snapshots = {}
+    for code in rootMoves:
+        gs.pushMove(code)
+        snapshots[code] = gs.snapshot()
+        gs.popMove()
+
+    ownPool = pool is None
+    if ownPool:
+        pool = ProcessPoolExecutor(workers)
+    try:
+        nodes = 0
+        def run(codes,depth,alpha,beta):
+            nonlocal nodes
+            remaining = deadline - time.perf_counter() if deadline is not None else None
+            futures = [pool.submit(_searchTask,snapshots[code],depth,remaining,ttSize,alpha,beta) for code in codes]
+            results = [future.result() for future in futures]
+            nodes += sum(r[2] for r in results)
+            return results,all(r[1] >= depth for r in results)
+
+        for depth in range(2,max(maxDepth,2)+1): #children need at least one ply of their own
+            if deadline is not None and time.perf_counter() >= deadline:
+                break
+            childDepth = depth - 1
+            first = rootMoves[0]
+            (firstResult,),complete = run([first],childDepth,-infinity,infinity)
+            scores = {first:_rootScore(firstResult[0])}
+            pvs = {first:firstResult[3]}
+            others = rootMoves[1:]
+            if complete and others:
+                if abs(scores[first]) > ChessSearch.MATE_BOUND:
+                    window = (-infinity,infinity) #mate scores shift by a ply at the root, don't bother with a null window
+                else:
+                    window = (-scores[first]-1,-scores[first]) #child score below -score means the move beats the first one
+                results,complete = run(others,childDepth,*window)
+                failHigh = []
+                for code,childResult in zip(others,results):
+                    scores[code] = _rootScore(childResult[0])
+                    pvs[code] = childResult[3]
+                    if scores[code] > scores[first] and window[0] != -infinity:
+                        failHigh.append(code)
+                if complete and failHigh:
+                    results,complete = run(failHigh,childDepth,-infinity,infinity)
+                    for code,childResult in zip(failHigh,results):
+                        scores[code] = _rootScore(childResult[0])
+                        pvs[code] = childResult[3]
+            best = first
+            for code in others: #first maximum in order, so ties keep the earlier move
+                if scores.get(code,-infinity) > scores[best]:
+                    best = code
+            if not complete:
+                break #ran out of time, keep the last complete iteration
+            #best first, the rest by score (only bounds for null window moves) with ties in the previous order
+            rootMoves.sort(key=lambda code: (code != best,-scores[code]))
+            result.score = scores[best]
+            result.bestMove = ChessEngine.Move.fromCode(best)
+            result.pv = [result.bestMove] + [ChessEngine.Move.fromCode(code) for code in pvs[best]]
+            result.depth = depth
+            seconds = time.perf_counter() - start
+            iteration = {'depth':depth,'score':result.score,'nodes':nodes,'seconds':seconds,
+                         'nps':int(nodes/seconds) if seconds > 0 else 0,'pv':list(result.pv)}
+            result.iterations.append(iteration)
+            if info:
+                info(iteration)
+            if abs(result.score) > ChessSearch.MATE_BOUND:
+                break
+        result.nodes = nodes
+    finally:
+        if ownPool:
+            pool.shutdown(cancel_futures=True)
+    result.seconds = time.perf_counter() - start
+    return result
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Parallel perft and search')
+    parser.add_argument('mode',choices=('perft','search'))
+    parser.add_argument('depth',nargs='?',type=int,default=None)
+    parser.add_argument('--depth',dest='depthOption',type=int,default=None)
+    parser.add_argument('--time',type=float,default=None,help='search time limit in seconds')
+    parser.add_argument('--fen',default=START_FEN)
+    parser.add_argument('--workers',type=int,default=None,help='number of processes (default: number of cores)')
+    parser.add_argument('--divide',action='store_true')
+    parser.add_argument('--serial',action='store_true',help='also run single process and report the speedup')
+    args = parser.parse_args(argv)
+    depth = args.depth or args.depthOption or (5 if args.mode == 'perft' else 4)
+    workers = args.workers or os.cpu_count() or 1
+
+    if args.mode == 'perft':
+        start = time.perf_counter()
+        nodes,split = parallelPerft(ChessEngine.GameState.fromFen(args.fen),depth,workers)
+        seconds = time.perf_counter() - start
+        if args.divide:
+            for move,count in split:
+                print('  %s: %d' % (move,count))
+        print('perft %d  nodes %d  time %.3fs  %d nps  workers %d' % (depth,nodes,seconds,nodes/seconds,workers))
+        if args.serial:
+            serial = ChessPerft.runPerft(ChessEngine.GameState.fromFen(args.fen),depth)
+            print('serial   nodes %d  time %.3fs  speedup %.2fx' % (serial['nodes'],serial['seconds'],serial['seconds']/seconds))
+    else:
+        result = parallelSearch(ChessEngine.GameState.fromFen(args.fen),depth,args.time,workers,info=ChessSearch.printIteration)
+        print('bestmove %s  depth %d  nodes %d  time %.2fs  workers %d' % (
+            result.bestMove.getChessNotation() if result.bestMove else '(none)',result.depth,result.nodes,result.seconds,workers))
+        if args.serial:
+            serial = ChessSearch.Searcher().search(ChessEngine.GameState.fromFen(args.fen),depth,args.time)
+            print('serial   bestmove %s  nodes %d  time %.2fs  speedup %.2fx' % (
+                serial.bestMove.getChessNotation() if serial.bestMove else '(none)',serial.nodes,serial.seconds,serial.seconds/result.seconds))
+
+if __name__ == '__main__':
+    main()
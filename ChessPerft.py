@@ -0,0 +1,163 @@
+'''
+Perft (performance test) driver for ChessEngine. Counts the leaf nodes of the legal move tree to a fixed depth,
+which both checks the move generator against known node counts and measures how fast
+getValidMoves + makeMove/undoMove run.
+
+Usage:
+    python ChessPerft.py 4                      perft 4 from the start position
+    python ChessPerft.py 3 --fen "<fen>" --divide
+    python ChessPerft.py --suite                run the standard positions and check the counts
+Every run appends one JSON line per position to the results file (perft_results.jsonl by default).
+'''
+import argparse
+import json
+import platform
+import sys
+import time
+
+import ChessEngine
+from ChessEngine import START_FEN
+
+#(name, fen, {depth: nodes}), counts from the chessprogramming wiki perft results.
+#Between them these positions cover castling, en-passant (including the discovered check cases) and every promotion
+SUITE = [
+    ('start',START_FEN,{1:20,2:400,3:8902,4:197281,5:4865609}),
+    ('kiwipete','r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1',{1:48,2:2039,3:97862,4:4085603}),
+    ('position3','8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1',{1:14,2:191,3:2812,4:43238,5:674624}),
+    ('position4','r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1',{1:6,2:264,3:9467,4:422333}),
+    ('position5','rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8',{1:44,2:1486,3:62379,4:2103487}),
+    ('position6','r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10',{1:46,2:2079,3:89890,4:3894594}),
+]
+
+'''
+Number of leaf nodes depth plies below the current position. The last ply is counted without being made (bulk counting).
+The bitboard backend runs on int move codes with pushMove/popMove, the legacy generator goes through getValidMoves
+'''
+def perft(gs,depth):
+    if depth == 0:
+        return 1
+    if gs.useBitboards:
+        return _perftCodes(gs,depth,0)
+    return _perftMoves(gs,depth)
+
+def _perftCodes(gs,depth,ply):
+    moves = gs.generateMoves(ply)
+    if depth == 1:
+        return len(moves)
+    nodes = 0
+    for code in moves:
+        gs.pushMove(code)
+        nodes += _perftCodes(gs,depth-1,ply+1)
+        gs.popMove()
+    return nodes
+
+def _perftMoves(gs,depth):
+    moves = gs.getValidMoves()
+    if depth == 1:
+        return len(moves)
+    nodes = 0
+    for move in moves:
+        gs.makeMove(move)
+        nodes += _perftMoves(gs,depth-1)
+        gs.undoMove()
+    return nodes
+
+'''
+Perft split by root move, returns a list of (move notation, nodes) sorted by notation
+'''
+def divide(gs,depth):
+    results = []
+    for move in gs.getValidMoves():
+        gs.makeMove(move)
+        results.append((move.getChessNotation(),perft(gs,depth-1)))
+        gs.undoMove()
+    results.sort()
+    return results
+
+'''
+Time a perft run and return a dictionary with the node count, wall time and nodes per second,
+plus the per root move counts if withDivide is set
+'''
+def runPerft(gs,depth,withDivide=False):
+    start = time.perf_counter()
+    if withDivide:
+        split = divide(gs,depth)
+        nodes = sum(n for _,n in split)
+    else:
+        split = None
+        nodes = perft(gs,depth)
+    seconds = time.perf_counter() - start
+    result = {'depth':depth,'nodes':nodes,'seconds':round(seconds,6),
+              'nps':int(nodes/seconds) if seconds > 0 else 0}
+    if split is not None:
+        result['divide'] = dict(split)
+    return result
+
+'''
+Run every suite position up to maxDepth, returns a list of result dictionaries with the expected count and a pass flag
+'''
+def runSuite(maxDepth=None,useBitboards=True,withDivide=False,report=print):
+    results = []
+    for name,fen,expected in SUITE:
+        for depth in sorted(expected):
+            if maxDepth is not None and depth > maxDepth:
+                break
+            result = runPerft(ChessEngine.GameState.fromFen(fen,useBitboards),depth,withDivide)
+            result.update(name=name,fen=fen,expected=expected[depth],passed=result['nodes'] == expected[depth])
+            results.append(result)
+            if report:
+                report(formatResult(result))
+    return results
+
+def formatResult(result):
+    line = '%-10s depth %d  nodes %10d  time %8.3fs  %9d nps' % (result.get('name','position'),result['depth'],
+                                                                  result['nodes'],result['seconds'],result['nps'])
+    if 'expected' in result:
+        line += '  ok' if result['passed'] else '  FAILED (expected %d)' % result['expected']
+    return line
+
+'''
+Append results as JSON lines so runs from different versions can be compared
+'''
+def writeResults(path,results,label):
+    stamp = time.strftime('%Y-%m-%dT%H:%M:%S')
+    with open(path,'a') as f:
+        for result in results:
+            record = {'label':label,'time':stamp,'python':platform.python_version()}
+            record.update(result)
+            f.write(json.dumps(record) + '\n')
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Perft node counts and move generation speed')
+    parser.add_argument('depth',nargs='?',type=int,default=4)
+    parser.add_argument('--fen',default=START_FEN,help='position to search (default start position)')
+    parser.add_argument('--suite',action='store_true',help='run the standard positions up to depth and check the counts')
+    parser.add_argument('--divide',action='store_true',help='print the node count below every root move')
+    parser.add_argument('--legacy',action='store_true',help='use the board walking move generator instead of the bitboards')
+    parser.add_argument('--output',default='perft_results.jsonl',help='results file, one JSON object per line')
+    parser.add_argument('--label',default='',help='tag stored with the results, e.g. a version or commit')
+    args = parser.parse_args(argv)
+    useBitboards = not args.legacy
+
+    if args.suite:
+        results = runSuite(args.depth,useBitboards,args.divide)
+    else:
+        result = runPerft(ChessEngine.GameState.fromFen(args.fen,useBitboards),args.depth,args.divide)
+        result['fen'] = args.fen
+        results = [result]
+        print(formatResult(result))
+    if args.divide:
+        for result in results:
+            print('divide %s depth %d' % (result.get('name',result['fen']),result['depth']))
+            for move,nodes in result['divide'].items():
+                print('  %s: %d' % (move,nodes))
+    totalNodes = sum(r['nodes'] for r in results)
+    totalSeconds = sum(r['seconds'] for r in results)
+    print('total nodes %d  time %.3fs  %d nps' % (totalNodes,totalSeconds,totalNodes/totalSeconds if totalSeconds else 0))
+    if args.output:
+        writeResults(args.output,results,args.label)
+    failed = [r for r in results if not r.get('passed',True)]
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
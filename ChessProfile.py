@@ -0,0 +1,250 @@
+'''
+Opt-in instrumentation of the engine hot paths. Nothing is instrumented until a Profiler is enabled: enabling swaps
+counting and timing wrappers in for the class methods listed in HOT_PATHS and disabling puts the originals back,
+so when no profiler is running the engine runs its normal code with no extra cost at all.
+Times are inclusive, getValidMoves includes the generators it calls, and every wrapped call pays the wrapper's own
+overhead (well under a microsecond), so compare calls and the split between functions rather than absolute times.
+GameState keeps bound board walking generators in moveFunctions: states created while a profiler is enabled pick up
+the wrappers, call gs.bindMoveFunctions() to switch an existing state over or back.
+For a function level picture of a run use the cProfile mode, its stats file can be opened with pstats or snakeviz.
+
+Usage:
+    python ChessProfile.py perft 4                       counters and timers for a perft run
+    python ChessProfile.py perft 3 --legacy --fen "<fen>"
+    python ChessProfile.py search --depth 5              counters, timers and cache hit rates for a search
+    python ChessProfile.py search --time 5 --pstats search.pstats   cProfile the search and save the stats
+In code:
+    with ChessProfile.Profiler() as profiler:
+        searcher.search(gs,5)
+    print(profiler.report())
+'''
+import argparse
+import cProfile
+import io
+import pstats
+import sys
+import time
+
+import ChessBook
+import ChessEngine
+import ChessEval
+import ChessPerft
+import ChessSearch
+import ChessTablebase
+from ChessEngine import START_FEN
+
+'''
+(class, method, hit test) of every instrumented method. The hit test is None for plain counters,
+'result' to count calls returning something other than None, or the name of a counter the method increments on a hit
+'''
+HOT_PATHS = [
+    (ChessEngine.GameState,'getValidMoves',None),
+    (ChessEngine.GameState,'getAllPossibleMoves',None),
+    (ChessEngine.GameState,'getPawnMoves',None),
+    (ChessEngine.GameState,'getKnightMoves',None),
+    (ChessEngine.GameState,'getBishopMoves',None),
+    (ChessEngine.GameState,'getRookMoves',None),
+    (ChessEngine.GameState,'getQueenMoves',None),
+    (ChessEngine.GameState,'getKingMoves',None),
+    (ChessEngine.GameState,'getBitboardMoves',None),
+    (ChessEngine.GameState,'computeAttackMaps',None),
+    (ChessEngine.GameState,'generateMoves',None),
+    (ChessEngine.GameState,'isMoveLegal',None),
+    (ChessEngine.GameState,'makeMove',None),
+    (ChessEngine.GameState,'undoMove',None),
+    (ChessEngine.GameState,'pushMove',None),
+    (ChessEngine.GameState,'popMove',None),
+    (ChessEval.Evaluator,'evaluate','hits'),
+    (ChessSearch.TranspositionTable,'probe','hits'),
+    (ChessBook.OpeningBook,'pickMove','result'),
+    (ChessTablebase.Tablebases,'probe','result'),
+]
+
+_active = None #the enabled profiler, methods can only be wrapped once
+
+class Profiler():
+    '''
+    Counts calls, time and cache hits of the HOT_PATHS methods between enable and disable, or inside a with block.
+    Counts add up over several enabled periods until reset
+    '''
+    def __init__(self,paths=HOT_PATHS):
+        self.paths = list(paths)
+        self.counters = {} #'Class.method' -> [calls, seconds, hits]
+        self.originals = []
+        self.seconds = 0.0 #time spent enabled
+        self.started = None
+
+    def __enter__(self):
+        self.enable()
+        return self
+
+    def __exit__(self,*exc):
+        self.disable()
+
+    @property
+    def enabled(self):
+        return self.started is not None
+
+    '''
+    Wrap the methods, raises RuntimeError when another profiler is already enabled
+    '''
+    def enable(self):
+        global _active
+        if self.enabled:
+            return
+        if _active is not None:
+            raise RuntimeError('another profiler is already enabled')
+        _active = self
+        for cls,name,hit in self.paths:
+            original = cls.__dict__[name]
+            counter = self.counters.setdefault('%s.%s' % (cls.__name__,name),[0,0.0,0])
+            self.originals.append((cls,name,original))
+            setattr(cls,name,_wrap(original,counter,hit))
+        self.started = time.perf_counter()
+
+    def disable(self):
+        global _active
+        if not self.enabled:
+            return
+        for cls,name,original in reversed(self.originals):
+            setattr(cls,name,original)
+        self.originals = []
+        self.seconds += time.perf_counter() - self.started
+        self.started = None
+        _active = None
+
+    def reset(self):
+        for counter in self.counters.values():
+            counter[:] = [0,0.0,0]
+        self.seconds = 0.0
+        if self.enabled:
+            self.started = time.perf_counter()
+
+    '''
+    {'Class.method': {'calls', 'seconds', 'hits'}} of the methods that were called, hits is None when not tracked
+    '''
+    def stats(self):
+        tracked = {'%s.%s' % (cls.__name__,name) for cls,name,hit in self.paths if hit is not None}
+        return {label:{'calls':calls,'seconds':seconds,'hits':hits if label in tracked else None}
+                for label,(calls,seconds,hits) in self.counters.items() if calls}
+
+    '''
+    Table of the called methods, slowest first
+    '''
+    def report(self):
+        wall = self.seconds + (time.perf_counter() - self.started if self.enabled else 0.0)
+        lines = ['%-36s %11s %11s %8s %9s %9s' % ('function','calls','total ms','% wall','us/call','hit rate')]
+        rows = sorted(self.stats().items(),key=lambda item: -item[1]['seconds'])
+        for label,entry in rows:
+            calls,seconds,hits = entry['calls'],entry['seconds'],entry['hits']
+            lines.append('%-36s %11d %11.1f %8.1f %9.2f %9s' % (
+                label,calls,seconds*1000,100*seconds/wall if wall else 0,seconds*1e6/calls,
+                '' if hits is None else '%.1f%%' % (100.0*hits/calls)))
+        lines.append('profiled for %.3fs, times are inclusive' % wall)
+        return '\n'.join(lines)
+
+def _wrap(fn,counter,hit):
+    clock = time.perf_counter
+    if hit is None:
+        def wrapper(*args,**kwargs):
+            start = clock()
+            try:
+                return fn(*args,**kwargs)
+            finally:
+                counter[0] += 1
+                counter[1] += clock() - start
+    elif hit == 'result':
+        def wrapper(*args,**kwargs):
+            start = clock()
+            result = None
+            try:
+                result = fn(*args,**kwargs)
+                return result
+            finally:
+                counter[0] += 1
+                counter[1] += clock() - start
+                if result is not None:
+                    counter[2] += 1
+    else:
+        def wrapper(self,*args,**kwargs):
+            before = getattr(self,hit)
+            start = clock()
+            try:
+                return fn(self,*args,**kwargs)
+            finally:
+                counter[0] += 1
+                counter[1] += clock() - start
+                counter[2] += getattr(self,hit) - before
+    wrapper.__name__ = fn.__name__
+    wrapper.__doc__ = fn.__doc__
+    wrapper.__wrapped__ = fn
+    return wrapper
+
+'''
+Run fn() under cProfile, returns (fn's result, pstats.Stats). path saves the raw stats for pstats/snakeviz
+'''
+def profileCall(fn,path=None):
+    profile = cProfile.Profile()
+    result = profile.runcall(fn)
+    if path:
+        profile.dump_stats(path)
+    return result,pstats.Stats(profile,stream=io.StringIO())
+
+'''
+The top limit functions of a pstats.Stats as text, sorted by sortBy (a pstats sort key)
+'''
+def formatStats(stats,sortBy='cumulative',limit=25):
+    stream = io.StringIO()
+    stats.stream = stream
+    stats.sort_stats(sortBy).print_stats(limit)
+    return stream.getvalue()
+
+def _runPerft(args):
+    gs = ChessEngine.GameState.fromFen(args.fen,not args.legacy)
+    result = ChessPerft.runPerft(gs,args.depth)
+    return ChessPerft.formatResult(result)
+
+def _runSearch(args):
+    gs = ChessEngine.GameState.fromFen(args.fen)
+    searcher = ChessSearch.Searcher(args.tt)
+    result = searcher.search(gs,args.depth,args.time,args.nodes)
+    return 'bestmove %s  depth %d  nodes %d  time %.2fs  %d nps' % (
+        result.bestMove.getChessNotation() if result.bestMove else '(none)',result.depth,result.nodes,result.seconds,
+        result.nodes/result.seconds if result.seconds else 0)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Profile a perft or search run')
+    commands = parser.add_subparsers(dest='command',required=True)
+    perft = commands.add_parser('perft',help='count the nodes of a perft run')
+    perft.add_argument('depth',nargs='?',type=int,default=4)
+    perft.add_argument('--legacy',action='store_true',help='use the board walking move generator')
+    search = commands.add_parser('search',help='search a position')
+    search.add_argument('--depth',type=int,default=64)
+    search.add_argument('--time',type=float,default=None,help='seconds')
+    search.add_argument('--nodes',type=int,default=None)
+    search.add_argument('--tt',type=int,default=1 << 18,help='transposition table entries')
+    for command in (perft,search):
+        command.add_argument('--fen',default=START_FEN)
+        command.add_argument('--cprofile',action='store_true',help='profile every function with cProfile instead of counting the hot paths')
+        command.add_argument('--pstats',default=None,help='save the cProfile stats to this file (implies --cprofile)')
+        command.add_argument('--sort',default='cumulative',help='pstats sort key of the printed cProfile table')
+        command.add_argument('--limit',type=int,default=25,help='functions in the printed cProfile table')
+    args = parser.parse_args(argv)
+    if args.command == 'search' and args.time is None and args.nodes is None and args.depth == 64:
+        args.time = 5.0
+    run = _runPerft if args.command == 'perft' else _runSearch
+
+    if args.cprofile or args.pstats:
+        summary,stats = profileCall(lambda: run(args),args.pstats)
+        print(summary)
+        print(formatStats(stats,args.sort,args.limit))
+        if args.pstats:
+            print('stats saved to %s' % args.pstats)
+    else:
+        with Profiler() as profiler:
+            summary = run(args)
+        print(summary)
+        print(profiler.report())
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,393 @@
+'''
+Alpha-beta search for ChessEngine.GameState.
+Negamax with iterative deepening under a depth, time and/or node budget, a bounded transposition table
+and staged move generation: the hash move, then MVV-LVA captures, then killer moves, and only then the quiet moves
+ordered by the history heuristic, each stage generated when the one before it didn't cut off.
+Leaves are scored by ChessEval from the incrementally updated evaluation terms of the GameState.
+A searcher given an opening book (ChessBook.OpeningBook) or endgame tablebases (ChessTablebase.Tablebases)
+plays their moves without searching.
+
+Usage:
+    python ChessSearch.py --time 5
+    python ChessSearch.py --depth 5 --fen "<fen>"
+    python ChessSearch.py --depth 5 --verify-eval      check every leaf evaluation against a full evaluation
+    python ChessSearch.py --book book.bin --tablebases tablebases
+'''
+import argparse
+import time
+
+import ChessBook
+import ChessEngine
+import ChessEval
+import ChessTablebase
+from ChessEngine import CAPTURES,NO_PIECE,QUIETS,START_FEN
+
+MATE_SCORE = 100000
+MATE_BOUND = MATE_SCORE - 1000 #scores above this are mates, the difference is the distance in plies
+INFINITY = MATE_SCORE + 1
+MAX_PLY = ChessEngine.MAX_PLY
+PIECE_VALUES = {'P':100,'N':320,'B':330,'R':500,'Q':900,'K':0}
+#piece values in ChessEngine.PIECES order (plus 0 for NO_PIECE), used with bitboards and move codes
+_CODE_VALUES = [PIECE_VALUES[piece[1]] for piece in ChessEngine.PIECES] + [0]
+QUIET_CODE = NO_PIECE << 16 #captured and promotion fields of a move code (mask 0x7F0000) for a quiet move
+
+#transposition table bound types
+EXACT = 0
+LOWER = 1 #score is at least this (beta cutoff)
+UPPER = 2 #score is at most this (failed low)
+
+class TranspositionTable():
+    '''
+    Fixed size table of (key, depth, score, bound, move code, generation) tuples indexed by the low bits of the zobrist key.
+    size is rounded down to a power of two. A slot is replaced when it holds the same position, an entry from an
+    older search, or a shallower search, so deep results survive while stale ones get recycled
+    '''
+    def __init__(self,size=1 << 18):
+        bits = max(size,1).bit_length() - 1
+        self.size = 1 << bits
+        self.mask = self.size - 1
+        self.table = [None]*self.size
+        self.generation = 0
+        self.probes = 0
+        self.hits = 0
+
+    def clear(self):
+        self.table = [None]*self.size
+        self.generation = 0
+
+    '''
+    Start a new search, entries from earlier searches become the first to be replaced
+    '''
+    def newSearch(self):
+        self.generation = (self.generation + 1) & 0xFF
+
+    def probe(self,key):
+        self.probes += 1
+        entry = self.table[key & self.mask]
+        if entry is not None and entry[0] == key:
+            self.hits += 1
+            return entry
+        return None
+
+    def store(self,key,depth,score,bound,move):
+        index = key & self.mask
+        entry = self.table[index]
+        if entry is None or entry[0] == key or entry[5] != self.generation or entry[1] <= depth:
+            if entry is not None and entry[0] == key and move is None:
+                move = entry[4] #keep the old best move when this search didn't find one
+            self.table[index] = (key,depth,score,bound,move,self.generation)
+
+class SearchResult():
+    def __init__(self):
+        self.bestMove = None #a Move equal to one of gs.getValidMoves(), None if there are no legal moves
+        self.score = 0 #centipawns for the side to move
+        self.depth = 0 #deepest completed iteration
+        self.pv = [] #principal variation, list of Move
+        self.nodes = 0
+        self.seconds = 0.0
+        self.iterations = [] #one dictionary per completed depth, see Searcher.search
+        self.source = 'search' #or 'book' / 'tablebase' when bestMove came from the opening book / endgame tablebases
+
+class Searcher():
+    '''
+    ttSize is the number of transposition table entries. The table, pawn cache and history survive between calls to search
+    so a searcher can be reused move after move in a game. verifyEval checks every evaluation against a full one.
+    book is an object with pickMove(gs) (see ChessBook.OpeningBook) consulted before every search, None for no book,
+    tablebases one with bestMove(gs) (see ChessTablebase.Tablebases) consulted next
+    '''
+    def __init__(self,ttSize=1 << 18,verifyEval=False,book=None,tablebases=None):
+        self.tt = TranspositionTable(ttSize)
+        self.book = book
+        self.tablebases = tablebases
+        self.evaluator = ChessEval.Evaluator(verify=verifyEval)
+        self.stopRequested = False
+        self.nodes = 0
+        self.history = [[0]*64 for piece in ChessEngine.PIECES]
+        self.killers = [[None,None] for ply in range(MAX_PLY)]
+
+    '''
+    Ask a running search to return as soon as possible, safe to call from another thread
+    '''
+    def stop(self):
+        self.stopRequested = True
+
+    '''
+    Clear the stop flag and start the clock of the next search, timeLimit seconds from now (None for no limit)
+    '''
+    def start(self,timeLimit=None):
+        self.stopRequested = False
+        self.startTime = time.perf_counter()
+        self.deadline = self.startTime + timeLimit if timeLimit is not None else None
+
+    '''
+    Iterative deepening search of gs, which is left unchanged.
+    Stops after maxDepth, when timeLimit seconds have passed or nodeLimit nodes were searched, whichever comes first.
+    info is called after every completed iteration with a dictionary of depth, score, nodes, seconds, nps and pv.
+    alpha/beta narrow the root window, a score outside it is only a bound (fail soft).
+    A book move, when there is one, is returned straight away with depth 0 and score 0,
+    a tablebase move with depth 0 and the exact score.
+    started skips start(), for callers that already called it so a stop or new deadline from another thread
+    that arrives before the search gets going isn't wiped out
+    '''
+    def search(self,gs,maxDepth=64,timeLimit=None,nodeLimit=None,info=None,alpha=-INFINITY,beta=INFINITY,started=False):
+        if not started:
+            self.start(timeLimit)
+        self.nodes = 0
+        self.nodeLimit = nodeLimit
+        self.tt.newSearch()
+        self.killers = [[None,None] for ply in range(MAX_PLY)]
+        for row in self.history: #age the history so old games don't dominate the ordering
+            for sq in range(64):
+                row[sq] >>= 3
+
+        result = SearchResult()
+        rootMoves = gs.generateMoves()
+        if not rootMoves:
+            result.score = -MATE_SCORE if gs.inCheck else 0
+            return result
+        if self.book is not None:
+            move = self.book.pickMove(gs)
+            if move is not None:
+                result.bestMove = move
+                result.pv = [move]
+                result.source = 'book'
+                return result
+        if self.tablebases is not None:
+            found = self.tablebases.bestMove(gs)
+            if found is not None:
+                move,wdl,dtm = found
+                result.bestMove = move
+                result.pv = [move]
+                result.score = wdl*(MATE_SCORE - dtm) if wdl else 0
+                result.source = 'tablebase'
+                return result
+        result.bestMove = ChessEngine.Move.fromCode(rootMoves[0])
+        for depth in range(1,min(maxDepth,MAX_PLY-1)+1):
+            self.pv = [[] for ply in range(MAX_PLY+1)]
+            score = self.negamax(gs,depth,alpha,beta,0)
+            if self.stopRequested and not self.pv[0]:
+                break #stopped before the first root move finished, nothing usable from this iteration
+            if self.pv[0]: #empty when every move failed low against alpha
+                result.pv = [ChessEngine.Move.fromCode(code) for code in self.pv[0]] #Moves only at the API boundary
+                result.bestMove = result.pv[0]
+            if self.stopRequested:
+                #partial iteration, the best move so far was searched after the previous best so it is at least as good.
+                #score is the 0 the stopped search unwound with, the last complete iteration's score is kept
+                break
+            result.score = score
+            result.depth = depth
+            seconds = time.perf_counter() - self.startTime
+            iteration = {'depth':depth,'score':score,'nodes':self.nodes,'seconds':seconds,
+                         'nps':int(self.nodes/seconds) if seconds > 0 else 0,'pv':list(result.pv)}
+            result.iterations.append(iteration)
+            if info:
+                info(iteration)
+            if abs(score) > MATE_BOUND and MATE_SCORE - abs(score) <= depth:
+                break #found a forced mate within the searched depth
+            if self.deadline is not None and time.perf_counter() >= self.deadline:
+                break
+        result.nodes = self.nodes
+        result.seconds = time.perf_counter() - self.startTime
+        return result
+
+    '''
+    Poll the budget, called every 1024 nodes so the clock isn't read at every node
+    '''
+    def checkLimits(self):
+        if self.deadline is not None and time.perf_counter() >= self.deadline:
+            self.stopRequested = True
+        if self.nodeLimit is not None and self.nodes >= self.nodeLimit:
+            self.stopRequested = True
+
+    '''
+    Yields the legal move codes of gs in search order, generating each stage only when it is reached:
+    the hash move, captures and promotions by most valuable victim / least valuable attacker, the two killer moves
+    of this ply, then the remaining quiet moves by history. The hash and killer moves come from other positions
+    so they are checked with isMoveLegal instead of generating everything. capturesOnly yields only the captures
+    (a promotion without a capture isn't one) and stops there, for the quiescence search.
+    gs must be back in the same position whenever the generator is resumed
+    '''
+    def pickMoves(self,gs,hashMove,ply,capturesOnly=False):
+        maps = gs.computeAttackMaps()
+        if hashMove is not None and not capturesOnly and gs.isMoveLegal(hashMove,maps):
+            yield hashMove
+        else:
+            hashMove = None
+        captures = gs.generateMoves(ply,CAPTURES,maps)
+        if captures:
+            values = _CODE_VALUES
+            #promotions add what the pawn gains, so a queen promotion comes before an underpromotion
+            captures.sort(key=lambda code: 10*(values[code >> 16 & 15] + values[(code >> 12 & 15) + (code >> 20 & 7)] -
+                                               values[code >> 12 & 15]) - values[code >> 12 & 15],reverse=True)
+            if capturesOnly:
+                for move in captures:
+                    if move >> 16 & 15 != NO_PIECE:
+                        yield move
+                return
+            for move in captures:
+                if move != hashMove:
+                    yield move
+        if capturesOnly:
+            return
+        killer1,killer2 = self.killers[ply]
+        if killer1 is not None and killer1 != hashMove and gs.isMoveLegal(killer1,maps):
+            yield killer1
+        else:
+            killer1 = None
+        if killer2 is not None and killer2 != hashMove and gs.isMoveLegal(killer2,maps):
+            yield killer2
+        else:
+            killer2 = None
+        quiets = gs.generateMoves(ply,QUIETS,maps)
+        if quiets:
+            history = self.history
+            quiets.sort(key=lambda code: history[code >> 12 & 15][code >> 6 & 63],reverse=True)
+            for move in quiets:
+                if move != hashMove and move != killer1 and move != killer2:
+                    yield move
+
+    def negamax(self,gs,depth,alpha,beta,ply):
+        self.nodes += 1
+        if self.nodes & 1023 == 0:
+            self.checkLimits()
+        if self.stopRequested:
+            return 0
+        self.pv[ply] = []
+        if ply > 0 and gs.isDraw(1): #fifty-move rule or a repetition, one earlier occurrence is enough inside the tree
+            return 0
+        if depth <= 0:
+            return self.quiescence(gs,alpha,beta,ply)
+
+        key = gs.zobristKey
+        entry = self.tt.probe(key)
+        hashMove = None
+        if entry is not None:
+            hashMove = entry[4]
+            if ply > 0 and entry[1] >= depth:
+                score = scoreFromTT(entry[2],ply)
+                bound = entry[3]
+                if bound == EXACT or (bound == LOWER and score >= beta) or (bound == UPPER and score <= alpha):
+                    return score
+
+        originalAlpha = alpha
+        bestScore = -INFINITY
+        bestMove = None
+        for move in self.pickMoves(gs,hashMove,ply):
+            gs.pushMove(move)
+            score = -self.negamax(gs,depth-1,-beta,-alpha,ply+1)
+            gs.popMove()
+            if self.stopRequested:
+                return 0
+            if score > bestScore:
+                bestScore = score
+                bestMove = move
+                if score > alpha:
+                    alpha = score
+                    self.pv[ply] = [move] + self.pv[ply+1]
+                    if score >= beta:
+                        if move & 0x7F0000 == QUIET_CODE: #quiet move, no capture or promotion
+                            killers = self.killers[ply]
+                            if move != killers[0]:
+                                killers[1] = killers[0]
+                                killers[0] = move
+                            self.history[move >> 12 & 15][move >> 6 & 63] += depth*depth
+                        break
+        if bestMove is None: #no legal moves
+            return -MATE_SCORE + ply if gs.inCheck else 0
+        if bestScore >= beta:
+            bound = LOWER
+        elif bestScore > originalAlpha:
+            bound = EXACT
+        else:
+            bound = UPPER
+        self.tt.store(key,depth,scoreToTT(bestScore,ply),bound,bestMove if bound != UPPER else None)
+        return bestScore
+
+    '''
+    Captures only search at the leaves so the evaluation isn't taken in the middle of an exchange
+    '''
+    def quiescence(self,gs,alpha,beta,ply):
+        standPat = self.evaluator.evaluate(gs)
+        if standPat >= beta:
+            return standPat
+        if standPat > alpha:
+            alpha = standPat
+        if ply >= MAX_PLY - 1:
+            return standPat
+        for move in self.pickMoves(gs,None,ply,True):
+            self.nodes += 1
+            if self.nodes & 1023 == 0:
+                self.checkLimits()
+            gs.pushMove(move)
+            score = -self.quiescence(gs,-beta,-alpha,ply+1)
+            gs.popMove()
+            if self.stopRequested:
+                return 0
+            if score >= beta:
+                return score
+            if score > alpha:
+                alpha = score
+        return alpha
+
+'''
+Mate scores are stored relative to the node instead of the root so they stay correct when reached through another path
+'''
+def scoreToTT(score,ply):
+    if score > MATE_BOUND:
+        return score + ply
+    if score < -MATE_BOUND:
+        return score - ply
+    return score
+
+def scoreFromTT(score,ply):
+    if score > MATE_BOUND:
+        return score - ply
+    if score < -MATE_BOUND:
+        return score + ply
+    return score
+
+'''
+Convenience wrapper, search gs with a fresh Searcher and return the best Move
+'''
+def findBestMove(gs,maxDepth=64,timeLimit=None,nodeLimit=None):
+    return Searcher().search(gs,maxDepth,timeLimit,nodeLimit).bestMove
+
+def formatScore(score):
+    if score > MATE_BOUND:
+        return 'mate %d' % ((MATE_SCORE - score + 1) // 2)
+    if score < -MATE_BOUND:
+        return 'mate -%d' % ((MATE_SCORE + score) // 2)
+    return 'cp %d' % score
+
+def printIteration(iteration):
+    print('depth %2d  score %-9s  nodes %9d  time %7.2fs  nps %7d  pv %s' % (
+        iteration['depth'],formatScore(iteration['score']),iteration['nodes'],iteration['seconds'],
+        iteration['nps'],' '.join(move.getChessNotation() for move in iteration['pv'])))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Search a position for the best move')
+    parser.add_argument('--fen',default=START_FEN)
+    parser.add_argument('--depth',type=int,default=64)
+    parser.add_argument('--time',type=float,default=None,help='seconds')
+    parser.add_argument('--nodes',type=int,default=None)
+    parser.add_argument('--tt',type=int,default=1 << 18,help='transposition table entries')
+    parser.add_argument('--verify-eval',action='store_true',help='check the incremental evaluation at every leaf (slow)')
+    parser.add_argument('--book',default=None,help='opening book file, see ChessBook')
+    parser.add_argument('--tablebases',default=None,help='endgame tablebase directory, see ChessTablebase')
+    args = parser.parse_args(argv)
+    if args.time is None and args.nodes is None and args.depth == 64:
+        args.time = 5.0
+    book = None
+    if args.book:
+        book = ChessBook.OpeningBook(args.book)
+    tablebases = ChessTablebase.Tablebases(args.tablebases) if args.tablebases else None
+    searcher = Searcher(args.tt,args.verify_eval,book,tablebases)
+    result = searcher.search(ChessEngine.GameState.fromFen(args.fen),args.depth,args.time,args.nodes,printIteration)
+    print('bestmove %s  depth %d  nodes %d  time %.2fs%s' % (
+        result.bestMove.getChessNotation() if result.bestMove else '(none)',result.depth,result.nodes,result.seconds,
+        '  (%s, %s)' % (result.source,formatScore(result.score)) if result.source != 'search' else ''))
+    print('tt hits %d / %d probes' % (searcher.tt.hits,searcher.tt.probes))
+    print('pawn cache hits %d / %d probes' % (searcher.evaluator.hits,searcher.evaluator.probes))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,659 @@
+'''
+Endgame tablebases for positions with 3 and 4 pieces (kings included), generated locally by retrograde analysis.
+Every table holds win/draw/loss and distance to mate for one material, e.g. KQvKR, for both sides to move.
+A table is indexed by the squares of its pieces after symmetry reduction: without pawns the board is turned and
+mirrored until the white king is in the a1-d1-d4 triangle (10 squares), with pawns it is only mirrored left to right
+so the white king is on files a-d (32 squares). Identical pieces are kept in square order so a position has one index.
+Each position is a single byte: 0 draw, 255 illegal or unused, otherwise the distance to mate in plies plus one,
+an odd distance is a win for the side to move and an even one a loss.
+Captures and promotions lead into smaller tables, so tables are built in order and every build uses the ones before it.
+The first pass and each ply of the backward search are split into chunks that run in a process pool.
+
+The tables ignore castling (probed only without castling rights), en-passant captures and the fifty-move rule.
+
+Usage:
+    python ChessTablebase.py build --pieces 4 --dir tablebases --workers 8
+    python ChessTablebase.py build KQvK KRvK KQvKR --dir tablebases
+    python ChessTablebase.py probe --fen "<fen>" --dir tablebases
+    python ChessTablebase.py verify KQvKR --dir tablebases     check every position against its moves
+'''
+import argparse
+import array
+import itertools
+import mmap
+import os
+import struct
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import ChessEngine
+from ChessBitboard import KING_ATTACKS,KNIGHT_ATTACKS,PAWN_ATTACKS,bishopAttacks,queenAttacks,rookAttacks
+
+KINDS = 'QRBNP' #piece letters strongest first, the order they are listed in a material name
+PROMOTIONS = 'QRBN'
+MAX_PIECES = 4
+MAGIC = b'CETB\x00\x00\x00\x01'
+HEADER = struct.Struct('>8s16sQ') #magic, material name, positions per side to move
+EXTENSION = '.ctb'
+DRAW = 0
+ILLEGAL = 255
+MAX_DTM = 253 #longest distance to mate a value byte can hold
+
+WIN = 1
+LOSS = -1
+
+#the 8 symmetries of the board as square lookup tables. Squares are row*8+col with row 0 the 8th rank
+def _transform(flipRows,flipCols,diagonal):
+    table = []
+    for sq in range(64):
+        r,c = divmod(sq,8)
+        if diagonal:
+            r,c = 7-c,7-r #mirror in the a1-h8 diagonal
+        if flipRows:
+            r = 7-r
+        if flipCols:
+            c = 7-c
+        table.append(r*8+c)
+    return tuple(table)
+
+_SYMMETRIES = sorted({_transform(*flags) for flags in itertools.product((False,True),repeat=3)})
+TRIANGLE = [sq for sq in range(64) if sq % 8 <= 3 and sq // 8 >= 4 and 7 - sq // 8 <= sq % 8] #a1-d1-d4
+HALF = [sq for sq in range(64) if sq % 8 <= 3] #files a-d
+_TRIANGLE_INDEX = {sq:i for i,sq in enumerate(TRIANGLE)}
+_HALF_INDEX = {sq:i for i,sq in enumerate(HALF)}
+#the symmetries that put a white king on a square into the triangle, two for the images on the diagonal
+_TRIANGLE_SYMMETRIES = [[t for t in _SYMMETRIES if t[sq] in _TRIANGLE_INDEX] for sq in range(64)]
+
+'''
+Material name of the white and black piece letters (kings left out), e.g. ('Q','R') -> 'KQvKR'
+'''
+def materialName(white,black):
+    order = lambda kinds: ''.join(sorted(kinds,key=KINDS.index))
+    return 'K' + order(white) + 'vK' + order(black)
+
+def _strength(kinds):
+    return (len(kinds),[len(KINDS) - KINDS.index(kind) for kind in kinds])
+
+'''
+The name tables are stored under for a material and whether colors are swapped to get there.
+The stronger side is always white, so KRvKQ is looked up in KQvKR with colors and ranks swapped
+'''
+def canonicalMaterial(name):
+    white,black = name.split('v')
+    white,black = white[1:],black[1:]
+    if _strength(black) > _strength(white):
+        return materialName(black,white),True
+    return materialName(white,black),False
+
+'''
+Every table with 3 up to maxPieces pieces, in build order: fewer pieces first, then fewer pawns,
+so the tables reached by captures and promotions always come before
+'''
+def allMaterials(maxPieces=MAX_PIECES):
+    names = set()
+    for count in range(1,maxPieces-1):
+        for kinds in itertools.combinations_with_replacement(KINDS,count):
+            for split in range(count+1):
+                for white in set(itertools.combinations(kinds,split)):
+                    black = list(kinds)
+                    for kind in white:
+                        black.remove(kind)
+                    names.add(canonicalMaterial(materialName(white,black))[0])
+    return sorted(names,key=lambda name: (len(name) - 1,name.count('P'),name))
+
+class TableSpec():
+    '''
+    Layout of one table: pieces in index order (white king, white pieces, black king, black pieces) as colors and kinds
+    '''
+    def __init__(self,name):
+        white,black = name.split('v')
+        self.name = name
+        self.kinds = ['K'] + list(white[1:]) + ['K'] + list(black[1:])
+        self.colors = [0]*len(white) + [1]*len(black)
+        self.kings = (0,len(white))
+        self.sides = (range(0,len(white)),range(len(white),len(self.kinds)))
+        self.pawns = [i for i,kind in enumerate(self.kinds) if kind == 'P']
+        self.hasPawns = bool(self.pawns)
+        self.kingSquares = HALF if self.hasPawns else TRIANGLE
+        self.size = len(self.kingSquares) * 64**(len(self.kinds)-1)
+        #runs of identical pieces, their squares are sorted when indexing
+        self.groups = []
+        start = 0
+        for i in range(1,len(self.kinds)+1):
+            if i == len(self.kinds) or self.kinds[i] != self.kinds[start] or self.colors[i] != self.colors[start]:
+                if i - start > 1:
+                    self.groups.append((start,i))
+                start = i
+
+    def _rawIndex(self,squares):
+        for a,b in self.groups:
+            squares[a:b] = sorted(squares[a:b])
+        index = _TRIANGLE_INDEX[squares[0]] if not self.hasPawns else _HALF_INDEX[squares[0]]
+        for sq in squares[1:]:
+            index = index*64 + sq
+        return index
+
+    '''
+    Index of a position given the square of every piece in table order, the same for all its symmetric images
+    '''
+    def index(self,squares,side):
+        if self.hasPawns:
+            if squares[0] & 7 > 3:
+                squares = [sq ^ 7 for sq in squares]
+            else:
+                squares = list(squares)
+            return side*self.size + self._rawIndex(squares)
+        best = None
+        for t in _TRIANGLE_SYMMETRIES[squares[0]]:
+            index = self._rawIndex([t[sq] for sq in squares])
+            if best is None or index < best:
+                best = index
+        return side*self.size + best
+
+    '''
+    (squares, side) of an index, the inverse of index for canonical positions
+    '''
+    def position(self,index):
+        side,index = divmod(index,self.size)
+        squares = []
+        for i in range(len(self.kinds)-1):
+            index,sq = divmod(index,64)
+            squares.append(sq)
+        squares.append(self.kingSquares[index])
+        squares.reverse()
+        return squares,side
+
+def _attacks(kind,color,sq,occ):
+    if kind == 'N':
+        return KNIGHT_ATTACKS[sq]
+    if kind == 'K':
+        return KING_ATTACKS[sq]
+    if kind == 'P':
+        return PAWN_ATTACKS[color][sq]
+    if kind == 'R':
+        return rookAttacks(sq,occ)
+    if kind == 'B':
+        return bishopAttacks(sq,occ)
+    return queenAttacks(sq,occ)
+
+'''
+Is target attacked by a piece of color, skipping the piece with index skip (just captured)
+'''
+def _attacked(spec,squares,target,color,occ,skip=-1):
+    kinds = spec.kinds
+    for i in spec.sides[color]:
+        if i != skip and _attacks(kinds[i],color,squares[i],occ) >> target & 1:
+            return True
+    return False
+
+'''
+Is a decoded position legal: no two pieces on a square, no pawn on the first or last rank,
+and the side not to move not in check
+'''
+def _legal(spec,squares,side):
+    occ = 0
+    for sq in squares:
+        if occ >> sq & 1:
+            return False
+        occ |= 1 << sq
+    for i in spec.pawns:
+        if squares[i] < 8 or squares[i] >= 56:
+            return False
+    return not _attacked(spec,squares,squares[spec.kings[1-side]],side,occ)
+
+'''
+Yields the legal moves of side as (piece index, target square, captured piece index or -1, promotion kind or None)
+'''
+def _moves(spec,squares,side):
+    kinds = spec.kinds
+    occ = own = 0
+    for i,sq in enumerate(squares):
+        occ |= 1 << sq
+        if spec.colors[i] == side:
+            own |= 1 << sq
+    enemy = occ ^ own
+    kingIndex = spec.kings[side]
+    for i in spec.sides[side]:
+        sq = squares[i]
+        kind = kinds[i]
+        if kind == 'P':
+            step = -8 if side == 0 else 8
+            targets = PAWN_ATTACKS[side][sq] & enemy
+            if not occ >> (sq + step) & 1:
+                targets |= 1 << (sq + step)
+                if (sq >> 3 == 6 if side == 0 else sq >> 3 == 1) and not occ >> (sq + 2*step) & 1:
+                    targets |= 1 << (sq + 2*step)
+        else:
+            targets = _attacks(kind,side,sq,occ) & ~own
+        while targets:
+            b = targets & -targets
+            targets ^= b
+            target = b.bit_length() - 1
+            captured = -1
+            if enemy & b:
+                captured = squares.index(target)
+            moved = list(squares)
+            moved[i] = target
+            after = (occ ^ (1 << sq)) | b
+            if _attacked(spec,moved,target if i == kingIndex else squares[kingIndex],1-side,after,captured):
+                continue
+            if kind == 'P' and (target < 8 or target >= 56):
+                for promotion in PROMOTIONS:
+                    yield i,target,captured,promotion
+            else:
+                yield i,target,captured,None
+
+class Tablebases():
+    '''
+    Read access to the tables in a directory. Tables are opened with mmap the first time they are needed,
+    so any number of processes share their pages. A missing table just makes its positions unknown (None)
+    '''
+    def __init__(self,directory):
+        self.directory = directory
+        self.tables = {} #name -> (TableSpec, mmap) or None when there is no file
+
+    def close(self):
+        for table in self.tables.values():
+            if table is not None:
+                table[1].close()
+        self.tables = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*exc):
+        self.close()
+
+    def table(self,name):
+        if name not in self.tables:
+            path = os.path.join(self.directory,name + EXTENSION)
+            table = None
+            if os.path.exists(path):
+                with open(path,'rb') as f:
+                    data = mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ)
+                spec = TableSpec(name)
+                magic,stored,size = HEADER.unpack_from(data,0)
+                if magic != MAGIC or stored.rstrip(b'\0').decode() != name or size != spec.size or \
+                   len(data) != HEADER.size + 2*size:
+                    data.close()
+                    raise ValueError('%s is not a %s table' % (path,name))
+                table = (spec,data)
+            self.tables[name] = table
+        return self.tables[name]
+
+    '''
+    Value byte of a position given as (color, kind, square) pieces, None if its table isn't there.
+    Two bare kings are a draw without a table
+    '''
+    def value(self,pieces,side):
+        if len(pieces) == 2:
+            return DRAW
+        white = [kind for color,kind,sq in pieces if color == 0 and kind != 'K']
+        black = [kind for color,kind,sq in pieces if color == 1 and kind != 'K']
+        name,swapped = canonicalMaterial(materialName(white,black))
+        table = self.table(name)
+        if table is None:
+            return None
+        spec,data = table
+        bySquare = {}
+        for color,kind,sq in pieces:
+            if swapped:
+                color,sq = 1 - color,sq ^ 56
+            bySquare.setdefault((color,kind),[]).append(sq)
+        squares = [bySquare[(color,kind)].pop() for color,kind in zip(spec.colors,spec.kinds)]
+        return data[HEADER.size + spec.index(squares,side ^ swapped)]
+
+    def _gameValue(self,gs):
+        pieces = []
+        for piece,bb in enumerate(gs.pieceBitboards):
+            while bb:
+                b = bb & -bb
+                bb ^= b
+                pieces.append((piece // 6,ChessEngine.PIECES[piece][1],b.bit_length() - 1))
+                if len(pieces) > MAX_PIECES:
+                    return None
+        return self.value(pieces,0 if gs.whiteToMove else 1)
+
+    '''
+    (wdl, dtm) for the side to move of gs: wdl is WIN, DRAW or LOSS and dtm the plies to mate with best play (0 for a draw).
+    None when the position has too many pieces, castling or en-passant rights, or its table isn't there
+    '''
+    def probe(self,gs):
+        if gs.castlingRights or gs.enPassantSquare >= 0:
+            return None
+        value = self._gameValue(gs)
+        if value is None or value == ILLEGAL:
+            return None
+        return _wdl(value)
+
+    '''
+    (Move, wdl, dtm) for gs: the fastest mate when winning, a move that keeps the draw, the longest resistance when losing.
+    The Move is one of gs.getValidMoves(). None when probe(gs) is None or there are no legal moves
+    '''
+    def bestMove(self,gs):
+        result = self.probe(gs)
+        if result is None:
+            return None
+        best = bestKey = None
+        for move in gs.getValidMoves():
+            gs.makeMove(move)
+            value = self._gameValue(gs) #a pawn's double step may leave an en-passant square, the tables don't see it
+            gs.undoMove()
+            if value is None or value == ILLEGAL:
+                return None
+            wdl,dtm = _wdl(value)
+            key = (-wdl,-dtm if wdl == LOSS else dtm) #the child is from the opponent's side
+            if bestKey is None or key > bestKey:
+                best,bestKey = move,key
+        if best is None:
+            return None
+        return (best,) + result
+
+def _wdl(value):
+    if value == DRAW:
+        return DRAW,0
+    dtm = value - 1
+    return (WIN if dtm & 1 else LOSS),dtm
+
+#per process state of a build: the table being built and the tables below it
+_worker = {}
+
+def _initWorker(name,directory):
+    _worker['spec'] = TableSpec(name)
+    _worker['tables'] = Tablebases(directory)
+
+'''
+First pass over the indexes start..stop: marks illegal positions and returns, per position, the number of distinct
+positions of this table its moves lead to plus one for every move out of the table that doesn't lose (counts), the longest
+loss out of the table (maxLoss), and positions already decided by mate or by captures and promotions (seeds as (dtm, index))
+'''
+def _firstPass(start,stop):
+    spec = _worker['spec']
+    tables = _worker['tables']
+    values = bytearray(stop - start)
+    counts = bytearray(stop - start)
+    maxLosses = bytearray(stop - start)
+    seedIndexes = array.array('I')
+    seedDtms = array.array('B')
+    for index in range(start,stop):
+        squares,side = spec.position(index)
+        offset = index - start
+        if not _legal(spec,squares,side) or spec.index(squares,side) != index:
+            values[offset] = ILLEGAL
+            continue
+        children = set()
+        count = bestWin = maxLoss = 0
+        anyMove = False
+        for i,target,captured,promotion in _moves(spec,squares,side):
+            anyMove = True
+            if captured < 0 and promotion is None:
+                moved = list(squares)
+                moved[i] = target
+                children.add(spec.index(moved,1-side))
+                continue
+            pieces = [(spec.colors[j],spec.kinds[j],target if j == i else sq) for j,sq in enumerate(squares) if j != captured]
+            if promotion is not None:
+                pieces[pieces.index((side,'P',target))] = (side,promotion,target)
+            value = tables.value(pieces,1-side)
+            if value is None:
+                raise RuntimeError('%s needs the %s table, build it first' % (spec.name,materialName(
+                    *[[kind for color,kind,sq in pieces if color == c and kind != 'K'] for c in (0,1)])))
+            if value == DRAW or value & 1: #value & 1: the opponent is mated in value-1 plies, we mate in value
+                count += 1 #the position can't be lost, its counter never runs out
+                if value and (not bestWin or value < bestWin):
+                    bestWin = value
+            else:
+                maxLoss = max(maxLoss,value)
+        count += len(children)
+        #a position seeded with a win stays undecided until its turn comes and is counted down meanwhile
+        counts[offset] = count
+        maxLosses[offset] = maxLoss
+        if not anyMove:
+            if _attacked(spec,squares,squares[spec.kings[side]],1-side,sum(1 << sq for sq in squares)):
+                seedIndexes.append(index)
+                seedDtms.append(0)
+            #stalemate stays a draw
+        elif bestWin:
+            seedIndexes.append(index)
+            seedDtms.append(bestWin)
+        elif count == 0:
+            seedIndexes.append(index)
+            seedDtms.append(maxLoss)
+    return start,bytes(values),bytes(counts),bytes(maxLosses),seedIndexes.tobytes(),seedDtms.tobytes()
+
+'''
+Indexes of the positions one move before each of the given ones (moves that stay in the table), without duplicates
+per position. Legality of the predecessors is left to the caller, illegal ones are marked in the table already
+'''
+def _predecessors(data):
+    spec = _worker['spec']
+    found = array.array('I')
+    for index in array.array('I',data):
+        squares,side = spec.position(index)
+        mover = 1 - side
+        occ = 0
+        for sq in squares:
+            occ |= 1 << sq
+        previous = set()
+        for i in spec.sides[mover]:
+            sq = squares[i]
+            kind = spec.kinds[i]
+            if kind == 'P':
+                step = 8 if mover == 0 else -8 #back where the pawn came from
+                origins = 0
+                origin = sq + step
+                if 8 <= origin < 56 and not occ >> origin & 1:
+                    origins = 1 << origin
+                    if sq >> 3 == (4 if mover == 0 else 3) and not occ >> (origin + step) & 1:
+                        origins |= 1 << (origin + step)
+            else:
+                origins = _attacks(kind,mover,sq,occ) & ~occ
+            while origins:
+                b = origins & -origins
+                origins ^= b
+                moved = list(squares)
+                moved[i] = b.bit_length() - 1
+                previous.add(spec.index(moved,mover))
+        found.extend(previous)
+    return found.tobytes()
+
+def _chunks(total,workers,limit=1 << 16):
+    size = max(1024,min(limit,-(-total // (workers*8))))
+    return [(start,min(start + size,total)) for start in range(0,total,size)]
+
+'''
+Build one table into directory, the tables its captures and promotions lead to must be there already.
+workers processes share the work, 1 runs everything in this process. Returns the longest distance to mate in plies
+'''
+def generate(name,directory,workers=1,log=None):
+    spec = TableSpec(name)
+    total = 2*spec.size
+    started = time.perf_counter()
+    pool = None
+    if workers > 1:
+        pool = ProcessPoolExecutor(workers,initializer=_initWorker,initargs=(name,directory))
+        run = pool.map
+    else:
+        _initWorker(name,directory)
+        run = map
+    try:
+        values = bytearray(total)
+        counts = bytearray(total)
+        maxLosses = bytearray(total)
+        buckets = {}
+        ranges = _chunks(total,workers)
+        for start,chunkValues,chunkCounts,chunkLosses,seedIndexes,seedDtms in run(_firstPass,*zip(*ranges)):
+            stop = start + len(chunkValues)
+            values[start:stop] = chunkValues
+            counts[start:stop] = chunkCounts
+            maxLosses[start:stop] = chunkLosses
+            for index,dtm in zip(array.array('I',seedIndexes),array.array('B',seedDtms)):
+                buckets.setdefault(dtm,array.array('I')).append(index)
+        if log:
+            log('%s: first pass %.1fs' % (name,time.perf_counter() - started))
+
+        #backward search, one ply at a time: every position decided at distance dtm decides or counts down its predecessors
+        current = array.array('I')
+        dtm = longest = 0
+        while current or buckets:
+            for index in buckets.pop(dtm,()):
+                if values[index] == DRAW:
+                    values[index] = dtm + 1
+                    current.append(index)
+            if current:
+                longest = dtm
+                if dtm >= MAX_DTM:
+                    raise RuntimeError('%s: distance to mate over %d plies' % (name,MAX_DTM))
+            data = current.tobytes()
+            step = max(4096,min(1 << 16,-(-len(data) // (workers*4*8)) * 4))
+            following = array.array('I')
+            for found in run(_predecessors,[data[i:i+step] for i in range(0,len(data),step)]):
+                for index in array.array('I',found):
+                    if values[index] != DRAW:
+                        continue
+                    if dtm & 1 == 0: #current positions are lost, moving into one wins
+                        values[index] = dtm + 2
+                        following.append(index)
+                    else:
+                        count = counts[index] - 1
+                        counts[index] = count
+                        if count == 0: #every move loses
+                            lossDtm = max(dtm + 1,maxLosses[index])
+                            if lossDtm == dtm + 1:
+                                values[index] = dtm + 2
+                                following.append(index)
+                            else:
+                                buckets.setdefault(lossDtm,array.array('I')).append(index)
+            current = following
+            dtm += 1
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    os.makedirs(directory,exist_ok=True)
+    path = os.path.join(directory,name + EXTENSION)
+    with open(path + '.tmp','wb') as f:
+        f.write(HEADER.pack(MAGIC,name.encode(),spec.size))
+        f.write(values)
+    os.replace(path + '.tmp',path)
+    if log:
+        log('%s: %d positions, longest mate %d plies, %.1fs' % (name,total,longest,time.perf_counter() - started))
+    return longest
+
+'''
+Check positions start..stop of a built table against their moves, returns the indexes that don't match
+'''
+def _verifyChunk(start,stop):
+    spec = _worker['spec']
+    tables = _worker['tables']
+    data = tables.table(spec.name)[1]
+    wrong = []
+    for index in range(start,stop):
+        stored = data[HEADER.size + index]
+        if stored == ILLEGAL:
+            continue
+        squares,side = spec.position(index)
+        best = None #best value for the side to move, as (wdl, -dtm for wins / dtm for losses)
+        expected = DRAW
+        for i,target,captured,promotion in _moves(spec,squares,side):
+            pieces = [(spec.colors[j],spec.kinds[j],target if j == i else sq) for j,sq in enumerate(squares) if j != captured]
+            if promotion is not None:
+                pieces[pieces.index((side,'P',target))] = (side,promotion,target)
+            wdl,dtm = _wdl(tables.value(pieces,1-side))
+            key = (-wdl,-dtm if wdl == LOSS else dtm)
+            if best is None or key > best:
+                best = key
+                expected = DRAW if wdl == DRAW else dtm + 2
+        if best is None and _attacked(spec,squares,squares[spec.kings[side]],1-side,sum(1 << sq for sq in squares)):
+            expected = 1
+        if stored != expected:
+            wrong.append(index)
+    return wrong
+
+def verify(name,directory,workers=1):
+    spec = TableSpec(name)
+    if workers > 1:
+        with ProcessPoolExecutor(workers,initializer=_initWorker,initargs=(name,directory)) as pool:
+            results = list(pool.map(_verifyChunk,*zip(*_chunks(2*spec.size,workers))))
+    else:
+        _initWorker(name,directory)
+        results = [_verifyChunk(start,stop) for start,stop in _chunks(2*spec.size,1)]
+    return [index for wrong in results for index in wrong]
+
+'''
+The materials one capture or promotion away from name
+'''
+def _children(name):
+    white,black = name.split('v')
+    sides = [list(white[1:]),list(black[1:])]
+    for side in (0,1):
+        for kind in set(sides[side]):
+            rest = list(sides[side])
+            rest.remove(kind)
+            for option in [rest] + ([rest + [promotion] for promotion in PROMOTIONS] if kind == 'P' else []):
+                if option or sides[1-side]:
+                    yield canonicalMaterial(materialName(*((option,sides[1]) if side == 0 else (sides[0],option))))[0]
+
+'''
+Can a game with material name lead to the material target through captures and promotions
+'''
+def _reaches(name,target):
+    return name == target or any(_reaches(child,target) for child in _children(name))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Build, probe and verify endgame tablebases')
+    commands = parser.add_subparsers(dest='command',required=True)
+    build = commands.add_parser('build',help='generate tables, missing smaller tables are built first')
+    build.add_argument('materials',nargs='*',help='tables like KQvKR (default: every table up to --pieces)')
+    build.add_argument('--pieces',type=int,default=3,choices=(3,4))
+    build.add_argument('--force',action='store_true',help='rebuild tables that already exist')
+    probe = commands.add_parser('probe',help='look a position up')
+    probe.add_argument('--fen',required=True)
+    check = commands.add_parser('verify',help='check tables against their moves')
+    check.add_argument('materials',nargs='+')
+    for command in (build,probe,check):
+        command.add_argument('--dir',default='tablebases')
+        command.add_argument('--workers',type=int,default=os.cpu_count() or 1)
+    args = parser.parse_args(argv)
+    log = lambda text: print(text,file=sys.stderr)
+
+    if args.command == 'build':
+        if args.materials:
+            wanted = {canonicalMaterial(name)[0] for name in args.materials}
+            pieces = max(len(name) - 1 for name in wanted)
+            if pieces > MAX_PIECES:
+                parser.error('at most %d pieces' % MAX_PIECES)
+            #everything a wanted table can reach, in build order
+            names = [name for name in allMaterials(pieces) if name in wanted or
+                     any(_reaches(target,name) for target in wanted)]
+        else:
+            names = allMaterials(args.pieces)
+        for name in names:
+            if not args.force and os.path.exists(os.path.join(args.dir,name + EXTENSION)):
+                continue
+            generate(name,args.dir,args.workers,log)
+    elif args.command == 'probe':
+        gs = ChessEngine.GameState.fromFen(args.fen)
+        with Tablebases(args.dir) as tables:
+            result = tables.probe(gs)
+            if result is None:
+                print('not in the tablebases')
+            else:
+                wdl,dtm = result
+                print('%s, %s' % ({WIN:'win',DRAW:'draw',LOSS:'loss'}[wdl],'mate in %d plies' % dtm if wdl else 'no mate'))
+                found = tables.bestMove(gs)
+                if found is not None:
+                    print('best move %s' % found[0].getChessNotation())
+    else:
+        failed = False
+        for name in args.materials:
+            name = canonicalMaterial(name)[0]
+            wrong = verify(name,args.dir,args.workers)
+            print('%s: %s' % (name,'ok' if not wrong else '%d positions wrong, first %r' % (
+                len(wrong),TableSpec(name).position(wrong[0]))))
+            failed = failed or bool(wrong)
+        if failed:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,420 @@
+'''
+Headless engine against engine tournaments for regression testing strength and speed changes. Every pair of engine
+configurations plays each opening of a suite twice, once with each colour, for a number of rounds. Games run in a
+process pool with only a bounded number queued, and each finished game is appended to the PGN file (every move
+commented with score/depth, time and nodes) and to the optional JSON lines file as soon as it ends, so memory use
+doesn't depend on how many games are played. The summary has the Elo difference of every pair with its 95% error
+margin and the average nodes per second and depth of every configuration.
+
+Usage:
+    python ChessTournament.py --engine name=base --engine name=smalltt,tt=4096 --openings openings.pgn --plies 8 \
+        --tc 10+0.1 --rounds 50 --workers 4 --pgn games.pgn --results games.jsonl
+    python ChessTournament.py --engine name=d4,depth=4 --engine name=d5,depth=5 --openings suite.fen --rounds 10
+An engine is a comma separated list of name=<name> and any of tt (entries), tc (base+increment in seconds),
+movetime (seconds), depth, nodes, book (ChessBook file) and tablebases (ChessTablebase directory).
+Engines that set none of tc, movetime, depth or nodes play at --tc. Clocks run on wall time,
+so keep --workers at or below the number of cores for timed games.
+Openings are FEN/EPD lines or PGN games, of which the first --plies moves are played before the engines take over.
+'''
+import argparse
+import itertools
+import json
+import math
+import os
+import random
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED,ProcessPoolExecutor,wait
+
+import ChessBook
+import ChessEngine
+import ChessPGN
+import ChessSearch
+import ChessTablebase
+import ChessUCI
+from ChessEngine import START_FEN
+from ChessSearch import MATE_BOUND,MATE_SCORE
+
+DEFAULT_TT = 1 << 16 #transposition table entries of an engine that doesn't set tt
+MAX_PLIES = 400 #games still running after this many plies are adjudicated drawn
+ENGINE_KEYS = {'name':str,'tt':int,'tc':str,'movetime':float,'depth':int,'nodes':int,'book':str,'tablebases':str}
+
+'''
+(base seconds, increment seconds) of a time control like '60', '10+0.1'. Raises ValueError
+'''
+def parseTimeControl(text):
+    base,_,increment = text.partition('+')
+    base,increment = float(base),float(increment or 0)
+    if base <= 0 or increment < 0:
+        raise ValueError('bad time control %r' % text)
+    return base,increment
+
+'''
+Engine configuration dictionary of a 'name=x,key=value,...' string, see ENGINE_KEYS. Raises ValueError
+'''
+def parseEngine(text):
+    config = {}
+    for field in text.split(','):
+        key,sep,value = field.partition('=')
+        key = key.strip()
+        if not sep or key not in ENGINE_KEYS:
+            raise ValueError('bad engine option %r' % field)
+        try:
+            config[key] = ENGINE_KEYS[key](value.strip())
+        except ValueError:
+            raise ValueError('bad value for %s: %r' % (key,value)) from None
+    if not config.get('name'):
+        raise ValueError('engine %r has no name' % text)
+    if 'tc' in config:
+        parseTimeControl(config['tc'])
+    return config
+
+'''
+The opening suite of a file as a list of (fen, moves) with moves in long algebraic notation.
+PGN games (by extension) give their first plies moves, other files are read as FEN or EPD lines.
+Raises ValueError for a position or move that can't be read
+'''
+def readOpenings(path,plies=8):
+    openings = []
+    with open(path) as stream:
+        if path.lower().endswith('.pgn'):
+            for number,(headers,sanMoves,result) in enumerate(ChessPGN.readGames(stream),1):
+                try:
+                    gs = ChessEngine.GameState.fromFen(headers.get('FEN',START_FEN))
+                    fen = gs.getFen()
+                    moves = []
+                    for san in sanMoves[:plies]:
+                        move = ChessPGN.parseSan(gs,san)
+                        moves.append(move.getChessNotation())
+                        gs.makeMove(move)
+                except ValueError as e:
+                    raise ValueError('%s game %d: %s' % (path,number,e)) from None
+                openings.append((fen,tuple(moves)))
+        else:
+            for number,line in enumerate(stream,1):
+                fields = line.split(';')[0].split()
+                if not fields or fields[0].startswith('#'):
+                    continue
+                #EPD lines have operations instead of the clocks after the first four fields
+                clocks = len(fields) >= 6 and fields[4].isdigit() and fields[5].isdigit()
+                try:
+                    gs = ChessEngine.GameState.fromFen(' '.join(fields[:6] if clocks else fields[:4]))
+                except ValueError as e:
+                    raise ValueError('%s line %d: %s' % (path,number,e)) from None
+                openings.append((gs.getFen(),()))
+    return openings
+
+'''
+Yields the game tasks of a round robin: every pair of engines plays every opening with both colours, rounds times
+'''
+def iterGames(engines,openings,rounds=1,event='ChessEngine tournament'):
+    gameId = 0
+    for roundNumber in range(1,rounds+1):
+        for index,(fen,moves) in enumerate(openings,1):
+            for a,b in itertools.combinations(range(len(engines)),2):
+                for white,black in ((a,b),(b,a)):
+                    gameId += 1
+                    yield {'id':gameId,'round':roundNumber,'opening':index,'fen':fen,'moves':moves,
+                           'white':engines[white],'black':engines[black],'event':event}
+
+'''
+Neither side can mate: kings with at most one knight or bishop between them
+'''
+def insufficientMaterial(gs):
+    bb = gs.pieceBitboards
+    if bb[0] | bb[3] | bb[4] | bb[6] | bb[9] | bb[10]: #pawns, rooks, queens
+        return False
+    return bin(bb[1] | bb[2] | bb[7] | bb[8]).count('1') <= 1
+
+def pgnScore(score):
+    if score > MATE_BOUND:
+        return '+M%d' % ((MATE_SCORE - score + 1) // 2)
+    if score < -MATE_BOUND:
+        return '-M%d' % ((MATE_SCORE + score) // 2)
+    return '%+.2f' % (score/100.0)
+
+_books = {} #opened once per worker process, the mmap pages are shared between processes anyway
+_tablebases = {}
+
+class _BookPlayer():
+    '''
+    One side's view of a shared opening book, picking with its own random stream
+    '''
+    def __init__(self,book,rng):
+        self.book = book
+        self.rng = rng
+
+    def pickMove(self,gs):
+        return self.book.pickMove(gs,rng=self.rng)
+
+'''
+Searcher for one side of a game, seed makes its book choices the same whichever worker plays the game
+'''
+def _player(config,seed):
+    book = tablebases = None
+    if config.get('book'):
+        if config['book'] not in _books:
+            _books[config['book']] = ChessBook.OpeningBook(config['book'])
+        book = _BookPlayer(_books[config['book']],random.Random(seed))
+    if config.get('tablebases'):
+        if config['tablebases'] not in _tablebases:
+            _tablebases[config['tablebases']] = ChessTablebase.Tablebases(config['tablebases'])
+        tablebases = _tablebases[config['tablebases']]
+    return ChessSearch.Searcher(config.get('tt',DEFAULT_TT),book=book,tablebases=tablebases)
+
+'''
+Play one game task of iterGames, returns a dictionary with the result, the reason it ended, a record of
+(side, move, san, seconds, nodes, depth, score, source) for every engine move and the game as PGN text
+'''
+def playGame(task,maxPlies=MAX_PLIES):
+    gs = ChessEngine.GameState.fromFen(task['fen'])
+    whiteFirst,firstMove = gs.whiteToMove,gs.fullmoveNumber
+    sans,comments,records = [],[],[]
+    for text in task['moves']:
+        moves = gs.getValidMoves()
+        move = next(m for m in moves if m.getChessNotation() == text)
+        sans.append(ChessPGN.toSan(gs,move,moves))
+        comments.append('book')
+        gs.makeMove(move)
+
+    configs = {True:task['white'],False:task['black']}
+    players = {side:_player(configs[side],task['id']*2 + (0 if side else 1)) for side in configs}
+    clocks,increments = {},{}
+    for side,config in configs.items():
+        if 'tc' in config:
+            clocks[side],increments[side] = parseTimeControl(config['tc'])
+    termination = 'normal'
+    while True:
+        moves = gs.getValidMoves()
+        white = gs.whiteToMove
+        if not moves:
+            result,reason = ('0-1' if white else '1-0','checkmate') if gs.inCheck else ('1/2-1/2','stalemate')
+            break
+        if gs.halfmoveClock >= 100:
+            result,reason = '1/2-1/2','fifty moves'
+            break
+        if gs.repetitionCount() >= 2:
+            result,reason = '1/2-1/2','threefold repetition'
+            break
+        if insufficientMaterial(gs):
+            result,reason = '1/2-1/2','insufficient material'
+            break
+        if len(sans) >= maxPlies:
+            result,reason,termination = '1/2-1/2','move limit','adjudication'
+            break
+        config = configs[white]
+        timeLimit = config.get('movetime')
+        if white in clocks:
+            budget = ChessUCI.allocateTime(clocks[white]*1000,increments[white]*1000)
+            timeLimit = budget if timeLimit is None else min(timeLimit,budget)
+        start = time.perf_counter()
+        searched = players[white].search(gs,config.get('depth',64),timeLimit,config.get('nodes'))
+        seconds = time.perf_counter() - start
+        if white in clocks:
+            clocks[white] -= seconds
+            if clocks[white] < 0:
+                result,reason,termination = '0-1' if white else '1-0','time forfeit','time forfeit'
+                break
+            clocks[white] += increments[white]
+        move = searched.bestMove
+        san = ChessPGN.toSan(gs,move,moves)
+        records.append({'side':'w' if white else 'b','move':move.getChessNotation(),'san':san,'seconds':round(seconds,4),'nodes':searched.nodes,
+                        'depth':searched.depth,'score':searched.score,'source':searched.source})
+        sans.append(san)
+        if searched.source == 'book':
+            comments.append('book %.2fs' % seconds)
+        else:
+            comments.append('%s/%d %.2fs %dn' % (pgnScore(searched.score),searched.depth,seconds,searched.nodes))
+        gs.makeMove(move)
+
+    white,black = task['white'],task['black']
+    headers = {'Event':task['event'],'Site':'?','Date':time.strftime('%Y.%m.%d'),
+               'Round':'%d.%d' % (task['round'],task['opening']),'White':white['name'],'Black':black['name'],
+               'Result':result}
+    if task['fen'] != START_FEN:
+        headers['SetUp'] = '1'
+        headers['FEN'] = task['fen']
+    if white.get('tc') == black.get('tc') and white.get('tc'):
+        headers['TimeControl'] = white['tc']
+    headers['Termination'] = termination
+    headers['PlyCount'] = len(sans)
+    return {'id':task['id'],'round':task['round'],'opening':task['opening'],'white':white['name'],
+            'black':black['name'],'result':result,'reason':reason,'plies':len(sans),'moves':records,
+            'pgn':ChessPGN.formatGame(headers,sans,result,comments,whiteFirst,firstMove)}
+
+'''
+Play a stream of game tasks and yield the finished games in the order they end.
+At most maxPending games are queued at once, so memory use is independent of the number of games
+'''
+def playGames(tasks,workers=None,maxPending=None,**settings):
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        for task in tasks:
+            yield playGame(task,**settings)
+        return
+    maxPending = maxPending or workers*2
+    with ProcessPoolExecutor(workers) as pool:
+        pending = set()
+        for task in tasks:
+            pending.add(pool.submit(playGame,task,**settings))
+            if len(pending) >= maxPending:
+                done,pending = wait(pending,return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        while pending:
+            done,pending = wait(pending,return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+def _elo(score):
+    if score <= 0:
+        return -math.inf
+    if score >= 1:
+        return math.inf
+    return -400*math.log10(1/score - 1)
+
+'''
+(Elo difference, 95% error margin, likelihood of superiority) from the wins, losses and draws of one side
+'''
+def eloDifference(wins,losses,draws):
+    games = wins + losses + draws
+    if not games:
+        return 0.0,math.inf,0.5
+    score = (wins + draws/2)/games
+    deviation = math.sqrt((wins*(1-score)**2 + losses*score**2 + draws*(0.5-score)**2)/games)
+    margin = 1.959964*deviation/math.sqrt(games)
+    elo = _elo(score)
+    error = (_elo(score + margin) - _elo(score - margin))/2 if math.isfinite(elo) else math.inf
+    los = 0.5*(1 + math.erf((wins-losses)/math.sqrt(2*(wins+losses)))) if wins + losses else 0.5
+    return elo,error,los
+
+class TournamentStats():
+    '''
+    Running totals of finished games: win/loss/draw of every pair in engine order and search totals of every engine
+    '''
+    def __init__(self,names):
+        self.names = list(names)
+        self.pairs = {pair:[0,0,0] for pair in itertools.combinations(self.names,2)}
+        self.engines = {name:{'games':0,'points':0.0,'moves':0,'nodes':0,'seconds':0.0,'depth':0,'timeLosses':0}
+                        for name in self.names}
+        self.games = 0
+
+    def add(self,game):
+        self.games += 1
+        white,black = game['white'],game['black']
+        points = {'1-0':1.0,'0-1':0.0}.get(game['result'],0.5)
+        pair = (white,black) if (white,black) in self.pairs else (black,white)
+        first = points if pair[0] == white else 1 - points
+        self.pairs[pair][0 if first == 1 else 1 if first == 0 else 2] += 1
+        for name,score in ((white,points),(black,1-points)):
+            engine = self.engines[name]
+            engine['games'] += 1
+            engine['points'] += score
+            if game['reason'] == 'time forfeit' and score == 0:
+                engine['timeLosses'] += 1
+        for record in game['moves']:
+            if record['source'] != 'search':
+                continue
+            engine = self.engines[white if record['side'] == 'w' else black]
+            engine['moves'] += 1
+            engine['nodes'] += record['nodes']
+            engine['seconds'] += record['seconds']
+            engine['depth'] += record['depth']
+
+    def pairLine(self,pair):
+        wins,losses,draws = self.pairs[pair]
+        elo,error,los = eloDifference(wins,losses,draws)
+        games = wins + losses + draws
+        return '%s vs %s: +%d -%d =%d  score %.1f%%  Elo %s +/- %s  LOS %.1f%%' % (
+            pair[0],pair[1],wins,losses,draws,100.0*(wins + draws/2)/games if games else 50.0,
+            '%+.1f' % (elo + 0.0) if math.isfinite(elo) else '%sinf' % ('+' if elo > 0 else '-'),
+            '%.1f' % error if math.isfinite(error) else 'inf',100*los)
+
+    def report(self):
+        lines = ['%-16s %7s %7s %10s %7s %9s' % ('engine','games','score','nps','depth','timeouts')]
+        for name in self.names:
+            engine = self.engines[name]
+            lines.append('%-16s %7d %6.1f%% %10d %7.2f %9d' % (
+                name,engine['games'],100*engine['points']/engine['games'] if engine['games'] else 0,
+                engine['nodes']/engine['seconds'] if engine['seconds'] else 0,
+                engine['depth']/engine['moves'] if engine['moves'] else 0,engine['timeLosses']))
+        lines.extend(self.pairLine(pair) for pair in self.pairs)
+        return '\n'.join(lines)
+
+def _engine(text):
+    try:
+        return parseEngine(text)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Play engine configurations against each other')
+    parser.add_argument('--engine',type=_engine,action='append',default=[],help='engine configuration, at least two')
+    parser.add_argument('--openings',default=None,help='FEN/EPD or PGN opening suite (default start position)')
+    parser.add_argument('--plies',type=int,default=8,help='moves taken from each PGN opening')
+    parser.add_argument('--rounds',type=int,default=1,help='times every pair plays every opening with both colours')
+    parser.add_argument('--tc',default='10+0.1',help='time control of engines without limits, base+increment seconds')
+    parser.add_argument('--max-plies',type=int,default=MAX_PLIES,help='adjudicate longer games as draws')
+    parser.add_argument('--workers',type=int,default=None,help='games played at once (default: number of cores)')
+    parser.add_argument('--pgn',default='tournament.pgn',help='games file')
+    parser.add_argument('--results',default=None,help='JSON lines file with the per move time and nodes of every game')
+    parser.add_argument('--event',default='ChessEngine tournament')
+    parser.add_argument('--progress',type=float,default=10.0,help='seconds between progress reports on stderr, 0 for none')
+    args = parser.parse_args(argv)
+
+    engines = args.engine
+    if len(engines) < 2:
+        parser.error('at least two --engine configurations are needed')
+    if len({engine['name'] for engine in engines}) != len(engines):
+        parser.error('engine names must be different')
+    try:
+        parseTimeControl(args.tc)
+    except ValueError as e:
+        parser.error(str(e))
+    for engine in engines:
+        if not any(key in engine for key in ('tc','movetime','depth','nodes')):
+            engine['tc'] = args.tc
+        if engine.get('book'):
+            try:
+                ChessBook.OpeningBook(engine['book']).close()
+            except (OSError,ValueError) as e:
+                parser.error(str(e))
+        if engine.get('tablebases') and not os.path.isdir(engine['tablebases']):
+            parser.error('no tablebase directory %s' % engine['tablebases'])
+    try:
+        openings = readOpenings(args.openings,args.plies) if args.openings else [(START_FEN,())]
+    except (OSError,ValueError) as e:
+        parser.error(str(e))
+    if not openings:
+        parser.error('no openings in %s' % args.openings)
+    total = args.rounds*len(openings)*len(engines)*(len(engines)-1)
+
+    stats = TournamentStats(engine['name'] for engine in engines)
+    pgn = open(args.pgn,'w')
+    results = open(args.results,'w') if args.results else None
+    start = lastReport = time.perf_counter()
+    try:
+        games = playGames(iterGames(engines,openings,args.rounds,args.event),args.workers,maxPlies=args.max_plies)
+        for game in games:
+            pgn.write(game.pop('pgn'))
+            pgn.flush()
+            if results:
+                results.write(json.dumps(game) + '\n')
+                results.flush()
+            stats.add(game)
+            now = time.perf_counter()
+            if args.progress and now - lastReport >= args.progress:
+                lastReport = now
+                print('%d/%d games  %.1f games/min  %s' % (stats.games,total,60*stats.games/(now-start),
+                                                          stats.pairLine(next(iter(stats.pairs)))),file=sys.stderr)
+    except KeyboardInterrupt:
+        print('interrupted, %d of %d games played' % (stats.games,total),file=sys.stderr)
+    finally:
+        pgn.close()
+        if results:
+            results.close()
+    print('%d games in %.1fs' % (stats.games,time.perf_counter()-start))
+    print(stats.report())
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,321 @@
+'''
+UCI (Universal Chess Interface) entry point, runs the engine headless for tournament managers and chess GUIs.
+Commands are read from stdin by an asyncio loop while the search runs in a thread, so isready and stop are
+answered while the engine thinks; stop sets the flag negamax checks at every node and the bestmove follows within milliseconds.
+
+Usage:
+    python ChessUCI.py
+    python ChessUCI.py --check      play scripted command sequences (stop/ponderhit/quit right after go) and check the replies
+Supported: uci, debug, isready, setoption (Hash, BookFile, TablebasePath), ucinewgame, position, go (depth, nodes, movetime, wtime/btime/winc/binc,
+movestogo, infinite, ponder), ponderhit, stop, quit, and d to print the current FEN.
+'''
+import asyncio
+import os
+import sys
+import threading
+import time
+
+import ChessBook
+import ChessEngine
+import ChessSearch
+import ChessTablebase
+from ChessEngine import START_FEN
+
+ENGINE_NAME = 'ChessEngine'
+ENGINE_AUTHOR = 'Fadie313'
+DEFAULT_HASH_MB = 32
+TT_ENTRY_BYTES = 128 #rough size of one transposition table entry tuple, to turn the Hash option into entries
+MOVE_OVERHEAD = 0.05 #seconds kept back per move for I/O and the GUI
+
+'''
+Seconds to spend on a move from the UCI clock fields (milliseconds), None for no limit
+'''
+def allocateTime(remaining,increment=0,movesToGo=None):
+    if remaining is None:
+        return None
+    remaining /= 1000.0
+    budget = remaining/(movesToGo or 30) + increment/1000.0*0.75
+    return max(0.01,min(budget,remaining*0.5) - MOVE_OVERHEAD)
+
+class UCIEngine():
+    '''
+    Protocol state: the current position, the searcher and the running search. send writes one line to the GUI
+    '''
+    def __init__(self,send=None):
+        self.send = send or self.write
+        self.gs = ChessEngine.GameState()
+        self.book = None
+        self.tablebases = None
+        self.searcher = ChessSearch.Searcher(DEFAULT_HASH_MB*1024*1024 // TT_ENTRY_BYTES)
+        self.searchTask = None
+        self.searchDone = None #set when the GUI allows the bestmove of an infinite or ponder search to be sent
+        self.ponderBudget = None #time to use after ponderhit
+        self.loop = None
+
+    @staticmethod
+    def write(line):
+        sys.stdout.write(line + '\n')
+        sys.stdout.flush()
+
+    '''
+    Handle one command line, returns False after quit
+    '''
+    async def handle(self,line):
+        tokens = line.split()
+        if not tokens:
+            return True
+        command,args = tokens[0],tokens[1:]
+        if command == 'uci':
+            self.send('id name %s' % ENGINE_NAME)
+            self.send('id author %s' % ENGINE_AUTHOR)
+            self.send('option name Hash type spin default %d min 1 max 4096' % DEFAULT_HASH_MB)
+            self.send('option name BookFile type string default <empty>')
+            self.send('option name TablebasePath type string default <empty>')
+            self.send('uciok')
+        elif command == 'isready':
+            self.send('readyok')
+        elif command == 'setoption':
+            await self.stopSearch()
+            self.setOption(args)
+        elif command == 'ucinewgame':
+            await self.stopSearch()
+            self.searcher.tt.clear()
+        elif command == 'position':
+            await self.stopSearch()
+            self.setPosition(args)
+        elif command == 'go':
+            await self.stopSearch()
+            self.go(args)
+        elif command == 'stop':
+            await self.stopSearch()
+        elif command == 'ponderhit':
+            self.ponderHit()
+        elif command == 'd':
+            self.send('info string fen %s' % self.gs.getFen())
+        elif command == 'quit':
+            await self.stopSearch()
+            return False
+        #debug and unknown commands are ignored as the protocol asks
+        return True
+
+    def setOption(self,args):
+        text = ' '.join(args)
+        if ' value ' not in text:
+            return
+        name,value = text[len('name '):].split(' value ',1) if text.startswith('name ') else ('','')
+        if name.strip().lower() == 'hash':
+            try:
+                megabytes = max(1,min(int(value),4096))
+            except ValueError:
+                self.send('info string bad Hash value %s' % value)
+                return
+            self.searcher = ChessSearch.Searcher(megabytes*1024*1024 // TT_ENTRY_BYTES,book=self.book,
+                                                 tablebases=self.tablebases)
+        elif name.strip().lower() == 'bookfile':
+            path = value.strip()
+            if self.book is not None:
+                self.book.close()
+            self.book = None
+            if path and path != '<empty>':
+                try:
+                    self.book = ChessBook.OpeningBook(path)
+                except (OSError,ValueError) as e:
+                    self.send('info string %s' % e)
+            self.searcher.book = self.book
+        elif name.strip().lower() == 'tablebasepath':
+            path = value.strip()
+            if self.tablebases is not None:
+                self.tablebases.close()
+            self.tablebases = None
+            if path and path != '<empty>':
+                if os.path.isdir(path):
+                    self.tablebases = ChessTablebase.Tablebases(path)
+                else:
+                    self.send('info string no tablebase directory %s' % path)
+            self.searcher.tablebases = self.tablebases
+
+    '''
+    position startpos|fen <fen> [moves <move>...], moves in long algebraic notation like e2e4 or e7e8q
+    '''
+    def setPosition(self,args):
+        if 'moves' in args:
+            split = args.index('moves')
+            setup,moves = args[:split],args[split+1:]
+        else:
+            setup,moves = args,[]
+        try:
+            if setup and setup[0] == 'fen':
+                gs = ChessEngine.GameState.fromFen(' '.join(setup[1:]))
+            else:
+                gs = ChessEngine.GameState.fromFen(START_FEN)
+        except ValueError as e:
+            self.send('info string %s' % e)
+            return
+        for text in moves:
+            legal = {move.getChessNotation():move for move in gs.getValidMoves()}
+            if text not in legal:
+                self.send('info string illegal move %s' % text)
+                break
+            gs.makeMove(legal[text])
+        self.gs = gs
+
+    def go(self,args):
+        options = {}
+        flags = set()
+        i = 0
+        while i < len(args):
+            if args[i] in ('infinite','ponder'):
+                flags.add(args[i])
+                i += 1
+            elif args[i] == 'searchmoves': #not supported, the rest of the line is moves
+                break
+            else:
+                if i + 1 < len(args):
+                    try:
+                        options[args[i]] = int(args[i+1])
+                    except ValueError:
+                        pass
+                i += 2
+        white = self.gs.whiteToMove
+        if 'movetime' in options:
+            budget = max(0.01,options['movetime']/1000.0 - MOVE_OVERHEAD)
+        else:
+            budget = allocateTime(options.get('wtime' if white else 'btime'),options.get('winc' if white else 'binc',0),
+                                  options.get('movestogo'))
+        waitForStop = bool(flags) #infinite and ponder searches only report a bestmove after stop or ponderhit
+        self.ponderBudget = budget if 'ponder' in flags else None
+        timeLimit = None if waitForStop else budget
+        #the search thread gets its own copy, position commands must not change the board under it
+        gs = ChessEngine.GameState.fromSnapshot(self.gs.snapshot())
+        gs.keyHistory = list(self.gs.keyHistory)
+        self.searchDone = asyncio.Event()
+        if not waitForStop:
+            self.searchDone.set()
+        #started here rather than in the search thread, a stop or ponderhit right after go must not be overwritten
+        self.searcher.start(timeLimit)
+        self.searchTask = asyncio.ensure_future(self.runSearch(gs,options.get('depth',64),timeLimit,options.get('nodes')))
+
+    async def runSearch(self,gs,depth,timeLimit,nodes):
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        def info(iteration):
+            line = 'info depth %d score %s nodes %d nps %d time %d pv %s' % (
+                iteration['depth'],ChessSearch.formatScore(iteration['score']),iteration['nodes'],iteration['nps'],
+                int((time.perf_counter()-start)*1000),' '.join(move.getChessNotation() for move in iteration['pv']))
+            loop.call_soon_threadsafe(self.send,line)
+        searcher = self.searcher
+        result = await loop.run_in_executor(None,lambda: searcher.search(gs,depth,timeLimit,nodes,info,started=True))
+        await self.searchDone.wait()
+        if result.source == 'book':
+            self.send('info string book move')
+        elif result.source == 'tablebase':
+            self.send('info depth 0 score %s nodes 0 pv %s' % (ChessSearch.formatScore(result.score),
+                                                              result.bestMove.getChessNotation()))
+        if result.bestMove is None:
+            self.send('bestmove 0000')
+        elif len(result.pv) > 1:
+            self.send('bestmove %s ponder %s' % (result.bestMove.getChessNotation(),result.pv[1].getChessNotation()))
+        else:
+            self.send('bestmove %s' % result.bestMove.getChessNotation())
+
+    '''
+    Stop the running search, if any, and wait until its bestmove has been sent
+    '''
+    async def stopSearch(self):
+        if self.searchTask is None:
+            return
+        self.searcher.stop()
+        self.searchDone.set()
+        await self.searchTask
+        self.searchTask = None
+
+    '''
+    The opponent played the expected move, the ponder search carries on as a normal timed search
+    '''
+    def ponderHit(self):
+        if self.searchTask is None or self.searchDone.is_set():
+            return
+        if self.ponderBudget is not None:
+            self.searcher.deadline = time.perf_counter() + self.ponderBudget
+            self.searchDone.set()
+        self.ponderBudget = None
+
+    async def run(self,reader):
+        while True:
+            line = await reader.readline()
+            if not line:
+                break #stdin closed, same as quit
+            if not await self.handle(line.decode(errors='replace').strip()):
+                return
+        await self.stopSearch()
+
+'''
+stdin as an asyncio StreamReader. Pipes are read by the event loop directly, anything it can't watch
+(a regular file, a Windows console) is pumped in by a thread
+'''
+async def openStdin():
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader()
+    try:
+        await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader),sys.stdin)
+    except (ValueError,OSError,NotImplementedError):
+        def pump():
+            for line in sys.stdin.buffer:
+                loop.call_soon_threadsafe(reader.feed_data,line)
+            loop.call_soon_threadsafe(reader.feed_eof)
+        threading.Thread(target=pump,daemon=True).start()
+    return reader
+
+async def serve():
+    engine = UCIEngine()
+    await engine.run(await openStdin())
+
+#(commands, seconds allowed until the last command is answered), a stop or quit has to get through however early it comes
+CHECKS = [
+    (['position startpos','go infinite','stop'],1.0),
+    (['position startpos','go ponder wtime 1000 btime 1000','ponderhit'],2.0),
+    (['position startpos','go ponder wtime 1000 btime 1000','stop'],1.0),
+    (['position startpos moves e2e4','go depth 64','stop'],1.0),
+    (['position startpos','go movetime 200'],1.5),
+    (['position startpos','go infinite','quit'],1.0),
+]
+
+'''
+Run every CHECKS sequence against a fresh engine, returns a list of failure messages
+'''
+async def check():
+    failures = []
+    for commands,allowed in CHECKS:
+        lines = []
+        engine = UCIEngine(lines.append)
+        start = time.perf_counter()
+        try:
+            async def play():
+                for command in commands:
+                    if not await engine.handle(command):
+                        return
+                while not any(line.startswith('bestmove') for line in lines):
+                    await asyncio.sleep(0.01)
+            await asyncio.wait_for(play(),allowed)
+        except asyncio.TimeoutError:
+            engine.searcher.stop() #wait_for cancelled the task waiting for it, this ends the search thread
+            failures.append('%s: no answer after %.1fs' % (' / '.join(commands),allowed))
+            continue
+        bestmoves = [line for line in lines if line.startswith('bestmove')]
+        if len(bestmoves) != 1 or bestmoves[0] == 'bestmove 0000':
+            failures.append('%s: got %r' % (' / '.join(commands),bestmoves))
+        else:
+            print('ok %-60s %s in %.3fs' % (' / '.join(commands),bestmoves[0],time.perf_counter()-start))
+    return failures
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv == ['--check']:
+        failures = asyncio.run(check())
+        for failure in failures:
+            print('FAILED %s' % failure)
+        return 1 if failures else 0
+    asyncio.run(serve())
+
+if __name__ == '__main__':
+    sys.exit(main())
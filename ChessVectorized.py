@@ -0,0 +1,350 @@
+'''
+Vectorized move generation for large batches of independent positions, built on NumPy.
+Every position of a batch is a row of uint64 bitboards and the sliding attacks of all 64 squares are computed at once
+with Kogge-Stone fills, so attack maps, check flags, pin masks, move masks and legal move counts for the whole batch come
+out of a fixed number of array operations instead of a Python loop per position and per piece.
+The results agree exactly with GameState.getValidMoves, --check verifies that on every position of a run.
+NumPy is an optional dependency needed by this module only (pip install numpy), the rest of the engine runs without it.
+
+Usage:
+    python ChessVectorized.py --random 20000 --check
+    python ChessVectorized.py positions.fen --check
+'''
+import argparse
+import random
+import sys
+import time
+
+import numpy as np
+
+import ChessEngine
+from ChessBitboard import FULL,FILE_A,FILE_H,ROWS,RAYS,BETWEEN,KNIGHT_ATTACKS,KING_ATTACKS,PAWN_ATTACKS
+from ChessEngine import NO_PIECE,CASTLING_MOVES
+
+_U64 = np.uint64
+_ZERO = _U64(0)
+_FULL = _U64(FULL)
+SQUARE_BITS = np.array([1 << sq for sq in range(64)],dtype=np.uint64)
+_KNIGHT = np.array(KNIGHT_ATTACKS,dtype=np.uint64)
+_KING = np.array(KING_ATTACKS,dtype=np.uint64)
+_PAWN = np.array(PAWN_ATTACKS,dtype=np.uint64) #[color][square]
+_BETWEEN = np.array(BETWEEN,dtype=np.uint64)
+_ORTHOGONAL = np.array([RAYS[0][sq] | RAYS[1][sq] | RAYS[2][sq] | RAYS[3][sq] for sq in range(64)],dtype=np.uint64)
+_DIAGONAL = np.array([RAYS[4][sq] | RAYS[5][sq] | RAYS[6][sq] | RAYS[7][sq] for sq in range(64)],dtype=np.uint64)
+
+#_LINE[a][b] is the whole line through two aligned squares, a pinned piece can move anywhere on its line with the king
+_OPPOSITE = (2,3,0,1,7,6,5,4) #index of the reverse of each ChessBitboard.DIRECTIONS entry
+_line = [[0]*64 for sq in range(64)]
+for a in range(64):
+    for d in range(8):
+        line = RAYS[d][a] | RAYS[_OPPOSITE[d]][a] | 1 << a
+        rest = RAYS[d][a]
+        while rest:
+            b = rest & -rest
+            rest ^= b
+            _line[a][b.bit_length()-1] = line
+_LINE = np.array(_line,dtype=np.uint64)
+del _line
+
+#(shift, mask) per direction, a positive shift is towards higher squares. The mask drops bits that wrapped around a file
+_NOT_A = _U64(FULL ^ FILE_A)
+_NOT_H = _U64(FULL ^ FILE_H)
+_ORTHOGONAL_SHIFTS = ((-8,_FULL),(8,_FULL),(1,_NOT_A),(-1,_NOT_H))
+_DIAGONAL_SHIFTS = ((-7,_NOT_A),(-9,_NOT_H),(9,_NOT_A),(7,_NOT_H))
+_LAST_RANK = np.array([ROWS[0],ROWS[7]],dtype=np.uint64) #promotion rank of white and black
+
+def _shift(bb,shift):
+    return bb << _U64(shift) if shift > 0 else bb >> _U64(-shift)
+
+'''
+Kogge-Stone occluded fill: every square the pieces in gens attack in one direction, stopping at (and including) the first blocker
+'''
+def _fill(gens,empty,shift,mask):
+    pro = empty & mask
+    gens = gens | (pro & _shift(gens,shift))
+    pro = pro & _shift(pro,shift)
+    gens = gens | (pro & _shift(gens,2*shift))
+    pro = pro & _shift(pro,2*shift)
+    gens = gens | (pro & _shift(gens,4*shift))
+    return _shift(gens,shift) & mask
+
+def _slidingAttacks(gens,empty,shifts):
+    attacks = _ZERO
+    for shift,mask in shifts:
+        attacks = attacks | _fill(gens,empty,shift,mask)
+    return attacks
+
+if hasattr(np,'bitwise_count'):
+    _popcount = np.bitwise_count
+else: #NumPy before 2.0
+    def _popcount(x):
+        x = x - ((x >> _U64(1)) & _U64(0x5555555555555555))
+        x = (x & _U64(0x3333333333333333)) + ((x >> _U64(2)) & _U64(0x3333333333333333))
+        x = (x + (x >> _U64(4))) & _U64(0x0F0F0F0F0F0F0F0F)
+        return (x * _U64(0x0101010101010101)) >> _U64(56)
+
+class BatchAnalysis():
+    '''
+    Results of analyzeBatch for N positions, squares are row*8+col like GameState.
+    attacks (N,2) uint64 squares attacked by white and by black, inCheck (N,) bool for the side to move,
+    checkers and pinned (N,) uint64 bitboards of the pieces giving check and of our pinned pieces,
+    pseudoMasks and legalMasks (N,64) uint64 target squares of the piece of the side to move on each square,
+    pseudo legal ignores checks and pins (castling only needs the right and empty squares), legalCounts (N,) is
+    len(getValidMoves()), every promotion counting as four moves
+    '''
+    def __init__(self,attacks,inCheck,checkers,pinned,pseudoMasks,legalMasks,legalCounts):
+        self.attacks = attacks
+        self.inCheck = inCheck
+        self.checkers = checkers
+        self.pinned = pinned
+        self.pseudoMasks = pseudoMasks
+        self.legalMasks = legalMasks
+        self.legalCounts = legalCounts
+
+    def __len__(self):
+        return len(self.legalCounts)
+
+'''
+(N,64) int8 array of PIECES indexes (NO_PIECE for empty squares) from an (N,8,8) board array of PIECES indexes
+or (N,12,64) / (N,12,8,8) piece planes in PIECES order. Values outside 0-11 on a board are empty squares
+'''
+def toMailbox(positions):
+    positions = np.asarray(positions)
+    n = len(positions)
+    if positions.ndim >= 3 and positions.shape[1] == 12:
+        planes = positions.reshape(n,12,64).astype(bool)
+        return np.where(planes.any(axis=1),planes.argmax(axis=1),NO_PIECE).astype(np.int8)
+    if positions.shape[1:] not in ((8,8),(64,)):
+        raise ValueError('positions must be (N,8,8) boards or (N,12,64) planes, got shape %r' % (positions.shape,))
+    mailbox = positions.reshape(n,64)
+    return np.where((mailbox >= 0) & (mailbox < 12),mailbox,NO_PIECE).astype(np.int8)
+
+'''
+Batch arrays for a list of GameStates: (boards (N,8,8) int8, whiteToMove, castlingRights, enPassant), the arguments of analyzeBatch
+'''
+def encodeStates(states):
+    boards = np.array([gs.mailbox for gs in states],dtype=np.int8).reshape(-1,8,8)
+    whiteToMove = np.array([gs.whiteToMove for gs in states],dtype=bool)
+    castlingRights = np.array([gs.castlingRights for gs in states],dtype=np.uint8)
+    enPassant = np.array([gs.enPassantSquare for gs in states],dtype=np.int8)
+    return boards,whiteToMove,castlingRights,enPassant
+
+'''
+Scalar GameState for row i of a batch, what --check compares against
+'''
+def decodeState(mailbox,whiteToMove,castlingRights,enPassant,i):
+    return ChessEngine.GameState.fromSnapshot((bytes(mailbox[i].astype(np.uint8)),bool(whiteToMove[i]),
+                                               int(castlingRights[i]),int(enPassant[i]),0,1))
+
+'''
+Attack maps, checks, pins, move masks and legal move counts of every position. positions is anything toMailbox accepts,
+whiteToMove (default all True), castlingRights (4 bit masks like GameState.castlingRights, default none) and
+enPassant (square or -1, default -1) have one entry per position. Castling rights without the king and rook at home
+and unusable en-passant squares are dropped like GameState.refreshState does.
+Positions are processed chunkSize at a time so memory stays bounded for any batch size
+'''
+def analyzeBatch(positions,whiteToMove=None,castlingRights=None,enPassant=None,chunkSize=4096):
+    mailbox = toMailbox(positions)
+    n = len(mailbox)
+    white = np.ones(n,dtype=bool) if whiteToMove is None else np.asarray(whiteToMove,dtype=bool)
+    castling = np.zeros(n,dtype=np.uint8) if castlingRights is None else np.array(castlingRights,dtype=np.uint8)
+    ep = np.full(n,-1,dtype=np.int16) if enPassant is None else np.array(enPassant,dtype=np.int16)
+    castling,ep = _cleanState(mailbox,white,castling,ep)
+    parts = [_analyzeChunk(mailbox[i:i+chunkSize],white[i:i+chunkSize],castling[i:i+chunkSize],ep[i:i+chunkSize])
+             for i in range(0,n,chunkSize)]
+    if not parts:
+        parts = [_analyzeChunk(mailbox,white,castling,ep)]
+    return BatchAnalysis(*(np.concatenate([part[field] for part in parts]) for field in range(7)))
+
+def _cleanState(mailbox,white,castling,ep):
+    castling = castling & 15
+    for right,kingStart,kingEnd,empty,safe in CASTLING_MOVES:
+        rook = 3 if kingStart == 60 else 9
+        rookSq = kingStart + 3 if kingEnd > kingStart else kingStart - 4
+        missing = (mailbox[:,kingStart] != rook + 2) | (mailbox[:,rookSq] != rook)
+        castling = np.where(missing,castling & (15 ^ right),castling).astype(np.uint8)
+    rows = np.arange(len(ep))
+    square = np.clip(ep,0,63)
+    pushed = np.where(white,square + 8,square - 8) % 64
+    ourPawn = np.where(white,0,6)
+    left = np.where(square % 8 > 0,mailbox[rows,(pushed - 1) % 64],NO_PIECE) #pawns beside the pushed pawn
+    right = np.where(square % 8 < 7,mailbox[rows,(pushed + 1) % 64],NO_PIECE)
+    valid = ((ep >= 0) & (ep < 64) & (square // 8 == np.where(white,2,5)) & (mailbox[rows,pushed] == 6 - ourPawn) &
+             (mailbox[rows,square] == NO_PIECE) & ((left == ourPawn) | (right == ourPawn)))
+    return castling,np.where(valid,ep,-1).astype(np.int16)
+
+'''
+Attack set of whatever stands on each square, (n,64), with the sliding attacks already filled for the occupancy
+'''
+def _pieceAttacks(kind,color,orthogonal,diagonal):
+    attacks = np.where(kind == 0,np.where(color == 0,_PAWN[0],_PAWN[1]),_ZERO)
+    attacks = np.where(kind == 1,_KNIGHT,attacks)
+    attacks = np.where(kind == 2,diagonal,attacks)
+    attacks = np.where(kind == 3,orthogonal,attacks)
+    attacks = np.where(kind == 4,orthogonal | diagonal,attacks)
+    return np.where(kind == 5,_KING,attacks)
+
+def _analyzeChunk(mailbox,white,castling,ep):
+    n = len(mailbox)
+    mailbox = mailbox.astype(np.int16)
+    occupied = mailbox != NO_PIECE
+    kind = np.where(occupied,mailbox % 6,-1)
+    color = np.where(occupied,mailbox // 6,-1)
+    us = np.where(white,0,1)
+    them = 1 - us
+    mine = color == us[:,None]
+    theirs = color == them[:,None]
+    squareBits = np.broadcast_to(SQUARE_BITS,(n,64))
+    ours = np.bitwise_or.reduce(np.where(mine,squareBits,_ZERO),axis=1)
+    enemy = np.bitwise_or.reduce(np.where(theirs,squareBits,_ZERO),axis=1)
+    occ = ours | enemy
+    empty = ~occ
+
+    #attacks from every square with the real occupancy, and the enemy's again with our king lifted off
+    gens = SQUARE_BITS[None,:]
+    orthogonal = _slidingAttacks(gens,empty[:,None],_ORTHOGONAL_SHIFTS)
+    diagonal = _slidingAttacks(gens,empty[:,None],_DIAGONAL_SHIFTS)
+    attackSets = np.where(occupied,_pieceAttacks(kind,color,orthogonal,diagonal),_ZERO)
+    attacks = np.stack([np.bitwise_or.reduce(np.where(color == c,attackSets,_ZERO),axis=1) for c in (0,1)],axis=1)
+    kingSq = np.argmax(mailbox == (5 + 6*us)[:,None],axis=1)
+    kingBit = SQUARE_BITS[kingSq]
+    withoutKing = ~(occ ^ kingBit)
+    enemySets = _pieceAttacks(kind,color,_slidingAttacks(gens,withoutKing[:,None],_ORTHOGONAL_SHIFTS),
+                              _slidingAttacks(gens,withoutKing[:,None],_DIAGONAL_SHIFTS))
+    attacked = np.bitwise_or.reduce(np.where(theirs,enemySets,_ZERO),axis=1)
+
+    #checks: the squares that capture or block a single checker, nothing in double check
+    checking = theirs & ((attackSets & kingBit[:,None]) != 0)
+    checkers = np.bitwise_or.reduce(np.where(checking,squareBits,_ZERO),axis=1)
+    checkerCount = checking.sum(axis=1)
+    checkerSq = np.argmax(checking,axis=1)
+    checkMask = np.where(checkerCount == 0,_FULL,
+                         np.where(checkerCount == 1,SQUARE_BITS[checkerSq] | _BETWEEN[kingSq,checkerSq],_ZERO))
+    inCheck = checkerCount > 0
+
+    #pins: an enemy slider lined up with our king with exactly one piece, ours, in between
+    orthogonalSnipers = theirs & ((kind == 3) | (kind == 4)) & ((_ORTHOGONAL[kingSq][:,None] & SQUARE_BITS) != 0)
+    diagonalSnipers = theirs & ((kind == 2) | (kind == 4)) & ((_DIAGONAL[kingSq][:,None] & SQUARE_BITS) != 0)
+    blockers = _BETWEEN[kingSq] & occ[:,None]
+    pinning = (orthogonalSnipers | diagonalSnipers) & (_popcount(blockers) == 1) & ((blockers & ours[:,None]) != 0)
+    pinned = np.bitwise_or.reduce(np.where(pinning,blockers,_ZERO),axis=1)
+    pinMask = np.where((pinned[:,None] & SQUARE_BITS) != 0,_LINE[kingSq],_FULL)
+
+    #pawns, pushes depend on the side to move
+    whiteSingle = (SQUARE_BITS >> _U64(8)) & empty[:,None]
+    whiteDouble = ((whiteSingle & _U64(ROWS[5])) >> _U64(8)) & empty[:,None]
+    blackSingle = (SQUARE_BITS << _U64(8)) & empty[:,None]
+    blackDouble = ((blackSingle & _U64(ROWS[2])) << _U64(8)) & empty[:,None]
+    pushes = np.where(white[:,None],whiteSingle | whiteDouble,blackSingle | blackDouble)
+    epBit = np.where(ep >= 0,SQUARE_BITS[np.clip(ep,0,63)],_ZERO)
+    isPawn = mine & (kind == 0)
+    pawnTargets = pushes | (attackSets & enemy[:,None])
+    epCapture = isPawn & ((attackSets & epBit[:,None]) != 0)
+
+    isKing = mine & (kind == 5)
+    pseudo = np.where(isPawn,pawnTargets | (attackSets & epBit[:,None]),np.where(mine,attackSets & ~ours[:,None],_ZERO))
+    legal = np.where(isPawn,pawnTargets,attackSets & ~ours[:,None]) & checkMask[:,None] & pinMask
+    legal = np.where(isKing,_KING[kingSq][:,None] & ~ours[:,None] & ~attacked[:,None],legal)
+    legal = np.where(mine,legal,_ZERO)
+
+    #castling, added to the king's square
+    for right,kingStart,kingEnd,path,safe in CASTLING_MOVES:
+        possible = ((castling & right) != 0) & (kingSq == kingStart) & ((occ & _U64(path)) == 0)
+        pseudo[:,kingStart] |= np.where(possible,SQUARE_BITS[kingEnd],_ZERO)
+        allowed = possible & ~inCheck & ((attacked & _U64(safe)) == 0)
+        legal[:,kingStart] |= np.where(allowed,SQUARE_BITS[kingEnd],_ZERO)
+
+    #en-passant, each capture is tested on the occupancy after it since the two pawns can leave a line to the king open
+    pairs,starts = np.nonzero(epCapture)
+    if len(pairs):
+        square = ep[pairs]
+        capturedBit = SQUARE_BITS[np.where(white[pairs],square + 8,square - 8)]
+        after = (occ[pairs] ^ SQUARE_BITS[starts] ^ capturedBit) | SQUARE_BITS[square]
+        king = kingSq[pairs]
+        enemyBase = 6*them[pairs]
+        box = mailbox[pairs]
+        def enemyPieces(offsets):
+            found = np.isin(box - enemyBase[:,None],offsets) & (box != NO_PIECE) & (box // 6 == them[pairs][:,None])
+            return np.bitwise_or.reduce(np.where(found,SQUARE_BITS,_ZERO),axis=1)
+        kingGen = SQUARE_BITS[king]
+        hit = ((_slidingAttacks(kingGen,~after,_ORTHOGONAL_SHIFTS) & enemyPieces((3,4))) |
+               (_slidingAttacks(kingGen,~after,_DIAGONAL_SHIFTS) & enemyPieces((2,4))) |
+               (_KNIGHT[king] & enemyPieces((1,))) |
+               (_PAWN[us[pairs],king] & enemyPieces((0,)) & ~capturedBit))
+        legal[pairs,starts] |= np.where(hit == 0,SQUARE_BITS[square],_ZERO)
+
+    counts = _popcount(legal).sum(axis=1,dtype=np.int64)
+    promotions = _popcount(np.where(isPawn,legal & _LAST_RANK[us][:,None],_ZERO)).sum(axis=1,dtype=np.int64)
+    legalCounts = counts + 3*promotions
+    return attacks,inCheck,checkers,pinned,pseudo,legal,legalCounts
+
+'''
+Legal move targets per start square worked out by the scalar generator, the same layout as BatchAnalysis.legalMasks
+'''
+def scalarMasks(gs):
+    masks = [0]*64
+    for move in gs.getValidMoves():
+        masks[move.startRow*8+move.startCol] |= 1 << (move.endRow*8+move.endCol)
+    return masks
+
+'''
+Positions reached by random playouts from the start position, for benchmarks and checks
+'''
+def randomPositions(count,seed=1,maxPlies=120):
+    rng = random.Random(seed)
+    states = []
+    while len(states) < count:
+        gs = ChessEngine.GameState()
+        for ply in range(rng.randrange(maxPlies)):
+            moves = gs.generateMoves()
+            if not moves:
+                break
+            gs.pushMove(rng.choice(moves))
+        states.append(ChessEngine.GameState.fromSnapshot(gs.snapshot()))
+    return states
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Vectorized batch move generation')
+    parser.add_argument('inputs',nargs='*',help='FEN files, one position per line')
+    parser.add_argument('--random',type=int,default=0,help='add this many positions from random playouts')
+    parser.add_argument('--seed',type=int,default=1)
+    parser.add_argument('--chunk',type=int,default=4096,help='positions per vectorized chunk')
+    parser.add_argument('--check',action='store_true',help='compare every position with the scalar getValidMoves')
+    args = parser.parse_args(argv)
+
+    states = []
+    for path in args.inputs:
+        with open(path) as f:
+            states.extend(ChessEngine.GameState.fromFen(line) for line in f if line.strip() and not line.startswith('#'))
+    if args.random or not states:
+        states.extend(randomPositions(args.random or 10000,args.seed))
+    boards,whiteToMove,castlingRights,enPassant = encodeStates(states)
+
+    start = time.perf_counter()
+    result = analyzeBatch(boards,whiteToMove,castlingRights,enPassant,args.chunk)
+    vectorSeconds = time.perf_counter() - start
+    print('vectorized  %d positions  %.3fs  %d positions/s' % (len(states),vectorSeconds,len(states)/vectorSeconds))
+
+    start = time.perf_counter()
+    counts = [len(gs.getValidMoves()) for gs in states]
+    scalarSeconds = time.perf_counter() - start
+    print('scalar      %d positions  %.3fs  %d positions/s  speedup %.2fx' % (
+        len(states),scalarSeconds,len(states)/scalarSeconds,scalarSeconds/vectorSeconds))
+
+    if args.check:
+        mismatches = 0
+        mailbox = boards.reshape(-1,64)
+        for i,gs in enumerate(states):
+            gs = decodeState(mailbox,whiteToMove,castlingRights,enPassant,i)
+            masks = scalarMasks(gs)
+            if (counts[i] != result.legalCounts[i] or gs.inCheck != result.inCheck[i] or
+                    masks != [int(mask) for mask in result.legalMasks[i]]):
+                mismatches += 1
+                if mismatches <= 10:
+                    print('mismatch: %s  scalar %d  vectorized %d' % (gs.getFen(),counts[i],result.legalCounts[i]))
+        print('checked %d positions, %d mismatches' % (len(states),mismatches))
+        return 1 if mismatches else 0
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,102 @@
+'''
+Engine worker thread for the GUI. The UI hands positions to an EngineWorker and carries on with its event loop,
+the worker works out the legal moves, searches and reports back through a post callback
+(ChessMain turns those into pygame events), so no engine call ever runs inside the UI loop.
+Every request gets an id and replaces the one before it: a running search is stopped within about 1024 nodes
+and results of replaced requests are never posted, which is how undo and new moves cancel a search.
+'''
+import queue
+import threading
+
+import ChessEngine
+import ChessSearch
+
+#what to do with a position after its legal moves are posted
+NO_SEARCH = None
+SEARCH = 'search' #search for a move to play, posts info events and a bestmove
+PONDER = 'ponder' #search on the opponent's time to fill the transposition table, posts info events only
+
+class _WorkerSearcher(ChessSearch.Searcher):
+    '''
+    Searcher that also stops as soon as its request is replaced, checked with the budget every 1024 nodes
+    so a cancel can't be lost between taking a request and starting the search
+    '''
+    def __init__(self,worker,ttSize,book=None,tablebases=None):
+        ChessSearch.Searcher.__init__(self,ttSize,book=book,tablebases=tablebases)
+        self.worker = worker
+        self.requestId = 0
+
+    def checkLimits(self):
+        ChessSearch.Searcher.checkLimits(self)
+        if self.worker.requestId != self.requestId:
+            self.stopRequested = True
+
+class EngineWorker():
+    '''
+    post(kind, data) is called from the worker thread with:
+    'moves'    {'requestId', 'moves' (list of Move), 'inCheck'}
+    'info'     {'requestId', 'iteration' (see Searcher.search), 'ponder'}
+    'bestmove' {'requestId', 'move' (None without legal moves), 'score', 'depth', 'nodes'}, not posted for ponder searches.
+    post must be safe to call from another thread, pygame.event.post is.
+    book is an opening book searches play from first (see ChessBook.OpeningBook), None for none,
+    tablebases the endgame tablebases they play from next (see ChessTablebase.Tablebases)
+    '''
+    def __init__(self,post,ttSize=1 << 18,book=None,tablebases=None):
+        self.post = post
+        self.requests = queue.Queue()
+        self.requestId = 0
+        self.lock = threading.Lock()
+        self.searcher = _WorkerSearcher(self,ttSize,book,tablebases)
+        self.thread = threading.Thread(target=self.run,name='EngineWorker',daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    '''
+    Queue a position and return the request id its results will carry. mode is NO_SEARCH, SEARCH or PONDER,
+    maxDepth/timeLimit bound a SEARCH (a PONDER runs until it is replaced or finds a mate). Replaces the current request
+    '''
+    def analyze(self,gs,mode=NO_SEARCH,maxDepth=64,timeLimit=None):
+        with self.lock:
+            self.requestId += 1
+            requestId = self.requestId
+        self.searcher.stop()
+        self.requests.put((requestId,gs.snapshot(),tuple(gs.keyHistory),mode,maxDepth,timeLimit))
+        return requestId
+
+    '''
+    Stop whatever the worker is doing, nothing more is posted for earlier requests
+    '''
+    def cancel(self):
+        with self.lock:
+            self.requestId += 1
+        self.searcher.stop()
+
+    def close(self):
+        self.cancel()
+        self.requests.put(None)
+
+    def run(self):
+        while True:
+            request = self.requests.get()
+            if request is None:
+                return
+            requestId,snapshot,keys,mode,maxDepth,timeLimit = request
+            if requestId != self.requestId:
+                continue #already replaced
+            gs = ChessEngine.GameState.fromSnapshot(snapshot)
+            gs.keyHistory = list(keys) #so the search sees repetitions of the game
+            moves = gs.getValidMoves()
+            self.post('moves',{'requestId':requestId,'moves':moves,'inCheck':gs.inCheck})
+            if mode is NO_SEARCH or not moves:
+                continue
+            ponder = mode == PONDER
+            def info(iteration):
+                if requestId == self.requestId:
+                    self.post('info',{'requestId':requestId,'iteration':iteration,'ponder':ponder})
+            self.searcher.requestId = requestId
+            result = self.searcher.search(gs,maxDepth,None if ponder else timeLimit,info=info)
+            if not ponder and requestId == self.requestId:
+                self.post('bestmove',{'requestId':requestId,'move':result.bestMove,'score':result.score,
+                                      'depth':result.depth,'nodes':result.nodes})